@@ -1,6 +1,6 @@
 import numpy as np
 from matplotlib import pyplot as plt
-from spex import stokes, elements
+from spex import stokes, elements, train
 from spectacle.general import gauss1d, gaussMd
 
 # Load the input spectrum
@@ -28,9 +28,6 @@ SRF_RGB_interp = np.stack([np.interp(wavelengths, SRF_wavelengths, SRF, left=0,
 polariser_0 = elements.Linear_polarizer_general(0.9, 0.005, 0)
 polariser_90 = elements.Linear_polarizer_general(0.9, 0.005, 90)
 
-# Propagate the source light through the input polariser
-after_polariser_0 = np.einsum("ij,wi->wj", polariser_0, source)
-
 # Retardances to loop over
 retardances_relative = np.linspace(0, 10, 250)
 retardances_absolute = retardances_relative * 560.
@@ -38,15 +35,12 @@ retardances_absolute = retardances_relative * 560.
 # Integral of RGB intensities
 integral_SRF = np.zeros((3,len(retardances_relative)))
 
-# Create foils and propagate through them
-foils = np.stack([elements.Retarder_wavelengths(retardance_absolute, 45, wavelengths) for retardance_absolute in retardances_absolute])
-after_foils = np.einsum("rwij,wi->rwj", foils, after_polariser_0)
-
-# Propagate through the output polariser
-after_polariser_90 = np.einsum("ij,rwj->rwi", polariser_90, after_foils)
+# Create foils
+foils = elements.Retarder_wavelengths(retardances_absolute[:,np.newaxis], 45, wavelengths)
 
-# Get only the total intensity spectra
-intensities = after_polariser_90[...,0]
+# Propagate through the input polariser, foils, and output polariser
+# Only the total intensity spectra are calculated
+intensities = train.propagate_intensity([polariser_0, foils, polariser_90], source)
 
 for i, (retardance_relative, retardance_absolute, intensity) in enumerate(zip(retardances_relative, retardances_absolute, intensities)):
     # Status indicator
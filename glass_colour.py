@@ -1,6 +1,6 @@
 import numpy as np
 from matplotlib import pyplot as plt
-from spex import stokes, elements
+from spex import stokes, elements, train
 from spectacle.general import gauss1d, gaussMd
 from spectacle.linearity import sRGB as sRGB_generic
 from spectacle import spectral
@@ -30,9 +30,6 @@ source = stokes.Stokes_nm(source_intensity, 0, 0, 0)
 polariser_0 = elements.Linear_polarizer_general(0.9, 0.005, 0)
 polariser_90 = elements.Linear_polarizer_general(0.9, 0.005, 90)
 
-# Propagate the source light through the input polariser
-after_polariser_0 = np.einsum("ij,wj->wi", polariser_0, source)
-
 # Retardances to loop over
 retardances_relative = np.linspace(0, 5, nr_retardances)
 retardances_absolute = retardances_relative * 560.
@@ -40,19 +37,15 @@ retardances_absolute = retardances_relative * 560.
 # Integral of RGB intensities
 integral_SRF = np.zeros((3,len(retardances_relative)))
 
-# Create foils and propagate through them
-foils = np.stack([elements.Retarder_wavelengths(retardance_absolute, 45, wavelengths) for retardance_absolute in retardances_absolute])
-after_foils = np.einsum("rwij,wj->rwi", foils, after_polariser_0)
+# Create foils
+foils = elements.Retarder_wavelengths(retardances_absolute[:,np.newaxis], 45, wavelengths)
 
-# Propagate through the output polarisers (orthogonal, parallel)
-after_polariser_orthogonal = np.einsum("ij,rwj->rwi", polariser_90, after_foils)
-after_polariser_parallel = np.einsum("ij,rwj->rwi", polariser_0, after_foils)
+# Propagate through the input polariser, foils, and output polarisers (orthogonal, parallel)
+# Only the total intensity spectra are calculated
+intensities_orthogonal = train.propagate_intensity([polariser_0, foils, polariser_90], source)
+intensities_parallel = train.propagate_intensity([polariser_0, foils, polariser_0], source)
 polariser_labels = ["Orthogonal", "Parallel"]
 
-# Get only the total intensity spectra
-intensities_orthogonal = after_polariser_orthogonal[...,0]
-intensities_parallel = after_polariser_parallel[...,0]
-
 # Interpolate the intensity spectra to the CIE XYZ wavelengths
 intensity_orthogonal_interpolated = spectral.interpolate_spectral_data(wavelengths, intensities_orthogonal, spectral.cie_wavelengths)
 intensity_parallel_interpolated = spectral.interpolate_spectral_data(wavelengths, intensities_parallel, spectral.cie_wavelengths)
@@ -1,3 +1,3 @@
-from . import io, data_processing, demodulation, instrument, plot
+from . import io, data_processing, demodulation, instrument, plot, archive
 from .io import load_data_folder
 from .instrument import *
@@ -0,0 +1,215 @@
+"""
+groundSPEX campaign archive: all exposures of a campaign in one binary,
+memory-mappable file per product, with a small JSON index.
+
+Products are stored as raw arrays with the exposure as the first axis, e.g.
+"data" [N, 2, 3648], "data_dark" [N, 2, 13] and "data_timestamps" [N, 2].
+Appending a new observation only writes to the end of each file and then
+updates the index, so existing data are never rewritten, and any range of
+exposures can be read without copying.
+Raw counts can be stored compactly (see `io.RawCounts`), as an integer
+product with a boolean "_mask" product for the missing values next to it.
+"""
+import json
+import os
+from itertools import tee
+from pathlib import Path
+import numpy as np
+from . import io
+from .data_processing import correct_chunks
+
+INDEX_FILENAME = "index.json"
+
+
+class CampaignArchive(object):
+    """
+    Chunked, memory-mapped archive of groundSPEX exposures.
+    """
+    def __init__(self, folder):
+        """
+        Create the object.
+        folder: Folder containing the archive. Created if necessary.
+        """
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.filename_index = self.folder/INDEX_FILENAME
+
+        if self.filename_index.exists():
+            self.index = json.loads(self.filename_index.read_text())
+        else:
+            self.index = {"length": 0, "products": {}, "sources": [], "complete": []}
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return f"groundSPEX campaign archive in {self.folder}: {len(self)} exposures from {len({entry['source'] for entry in self.sources})} sources; products: {', '.join(self.products)}"
+
+
+    def __len__(self):
+        return self.index["length"]
+
+
+    @property
+    def products(self):
+        return list(self.index["products"])
+
+
+    @property
+    def sources(self):
+        """
+        The appended chunks, as a list of {"source", "start", "stop"} entries.
+        """
+        return self.index["sources"]
+
+
+    def _filename(self, product):
+        return self.folder/f"{product}.bin"
+
+
+    def _save_index(self):
+        filename_temporary = self.filename_index.with_suffix(".tmp.json")
+        filename_temporary.write_text(json.dumps(self.index, indent=1))
+        os.replace(filename_temporary, self.filename_index)
+
+
+    def __getitem__(self, product):
+        """
+        Memory-mapped, read-only array with all exposures of a `product`.
+        Slicing it (e.g. archive["data"][1000:2000]) does not copy.
+        """
+        description = self.index["products"][product]
+        shape = (len(self),) + tuple(description["shape"])
+        dtype = np.dtype(description["dtype"])
+        if len(self) == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self._filename(product), dtype=dtype, mode="r", shape=shape)
+
+
+    def read(self, start=None, stop=None, products=None):
+        """
+        Dictionary with the exposures from `start` to `stop` of the given
+        `products` (default: all), as memory-mapped views.
+        """
+        products = self.products if products is None else products
+        return {product: self[product][start:stop] for product in products}
+
+
+    def raw(self, product, start=None, stop=None):
+        """
+        A `product` stored as compact raw counts, with its mask, as
+        `io.RawCounts` of the exposures from `start` to `stop`.
+        """
+        return io.RawCounts(self[product], self[f"{product}_mask"])[start:stop]
+
+
+    def append(self, source=None, **products):
+        """
+        Append a chunk of exposures. Every keyword argument is a product, with
+        the same number of exposures along the first axis; the first chunk
+        sets the products, their dtypes and shapes.
+        `source` (e.g. the data folder) is recorded in the index.
+        """
+        lengths = {len(array) for array in products.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"All products must have the same number of exposures, not {lengths}")
+        length = lengths.pop()
+
+        if len(self) == 0 and not self.index["products"]:
+            self.index["products"] = {product: {"dtype": np.asarray(array).dtype.str, "shape": list(np.shape(array)[1:])} for product, array in products.items()}
+        if set(products) != set(self.products):
+            raise ValueError(f"Products {sorted(products)} do not match the archive: {sorted(self.products)}")
+
+        for product, array in products.items():
+            description = self.index["products"][product]
+            dtype = np.dtype(description["dtype"])
+            if list(np.shape(array)[1:]) != description["shape"]:
+                raise ValueError(f"Product {product} has shape {np.shape(array)[1:]} per exposure instead of {tuple(description['shape'])}")
+
+            # Remove anything left over from an interrupted append, then add to the end
+            filename = self._filename(product)
+            size = len(self) * dtype.itemsize * int(np.prod(description["shape"]))
+            if filename.exists() and filename.stat().st_size > size:
+                os.truncate(filename, size)
+            with open(filename, "ab") as file:
+                np.ascontiguousarray(array, dtype=dtype).tofile(file)
+
+        # The index is only updated once all products have been written
+        self.index["sources"].append({"source": None if source is None else str(source), "start": len(self), "stop": len(self) + length})
+        self.index["length"] += length
+        self._save_index()
+
+
+    def truncate(self, length):
+        """
+        Remove all exposures from `length` onwards, e.g. those from an
+        interrupted conversion. This does not rewrite the remaining data.
+        """
+        if length > len(self):
+            raise ValueError(f"Cannot truncate an archive of {len(self)} exposures to {length}")
+        for product, description in self.index["products"].items():
+            size = length * np.dtype(description["dtype"]).itemsize * int(np.prod(description["shape"]))
+            os.truncate(self._filename(product), size)
+        # Chunks that are cut through keep their remaining exposures
+        self.index["sources"] = [dict(entry, stop=min(entry["stop"], length)) for entry in self.sources if entry["start"] < length]
+        remaining = {entry["source"] for entry in self.sources}
+        self.index["complete"] = [source for source in self.index.get("complete", []) if source in remaining]
+        self.index["length"] = length
+        self._save_index()
+
+
+def convert_folder(folder, archive, chunk_size=50, corrected=False, compact=False, **correction_kwargs):
+    """
+    Append all data from a groundSPEX data `folder` to a `CampaignArchive`
+    (or the folder of one), `chunk_size` files at a time.
+    If `corrected` is True, the dark-, wavelength- and transmission-corrected
+    spectra are stored as well, as "data_corrected" (see
+    `data_processing.correct_chunks`, which gets `correction_kwargs`), with
+    their wavelengths in the archive folder as "wavelengths.npy".
+    If `compact` is True, the data and dark counts are stored as integers
+    with masks (read them with `CampaignArchive.raw`).
+
+    Folders that are already in the archive are skipped. If the last folder
+    in the archive is this one, but its conversion was interrupted, it is
+    removed and converted again.
+    Returns the archive.
+    """
+    if not isinstance(archive, CampaignArchive):
+        archive = CampaignArchive(archive)
+    source = str(Path(folder).absolute())
+
+    if source in archive.index.get("complete", []):
+        return archive
+    previous = [entry for entry in archive.sources if entry["source"] == source]
+    if previous:
+        if previous[-1]["stop"] != len(archive):
+            raise ValueError(f"The archive contains an incomplete conversion of {source} followed by other data")
+        archive.truncate(previous[0]["start"])
+
+    chunks = io.iterate_data_folder(folder, chunk_size=chunk_size, compact=compact)
+    if corrected:
+        # Run the corrections alongside the raw data; tee only keeps the current chunk
+        chunks, chunks_to_correct = tee(chunks)
+        chunks = zip(chunks, correct_chunks(chunks_to_correct, **correction_kwargs))
+    else:
+        chunks = ((chunk, None) for chunk in chunks)
+
+    wavelengths = None
+    for (data, data_dark, data_timestamps), corrected_chunk in chunks:
+        products = dict(data=data, data_dark=data_dark, data_timestamps=data_timestamps)
+        if compact:
+            for product in ("data", "data_dark"):
+                counts = products[product]
+                products[product] = counts.counts
+                products[f"{product}_mask"] = np.zeros(counts.shape, dtype=bool) if counts.mask is None else counts.mask
+        if corrected_chunk is not None:
+            wavelengths, products["data_corrected"], _ = corrected_chunk
+        archive.append(source=source, **products)
+
+    if wavelengths is not None:
+        np.save(archive.folder/"wavelengths.npy", wavelengths)
+    archive.index.setdefault("complete", []).append(source)
+    archive._save_index()
+
+    return archive
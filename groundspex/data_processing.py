@@ -15,10 +15,12 @@ wavelength_coeffs_Avantes = np.array([[356.377,0.167307,-2.97917e-6, -2.14825e-1
 wavelength_coeffs_JdB = np.array([[356.058,0.167297,-2.88384e-6,-2.28596e-10], [360.120,0.165363,-3.33891e-6,-1.90909e-10]])
 
 
-def correct_darkcurrent(data, data_dark, darkmap=None, texp=200., temperature=26.):
+def correct_darkcurrent(data, data_dark, darkmap=None, texp=200., temperature=26., dtype=np.float64):
     """
     Apply a dark current correction to given data.
     If no darkmap is given, load one from file.
+    The data may be raw counts (`io.RawCounts`); they are converted to `dtype`
+    (e.g. np.float32 to halve the memory use), which the result has too.
     """
     # Load darkmap from file if none was given
     if darkmap is None:
@@ -37,6 +39,10 @@ def correct_darkcurrent(data, data_dark, darkmap=None, texp=200., temperature=26
     darkcurrent_darkpixels = apply_polynomial(texp, temperature, polynomial_coeffs_darkpixels)
     darkcurrent_spectrum = apply_polynomial(texp, temperature, polynomial_coeffs_spectrum)
 
+    # Convert the counts and the model to the working precision
+    data, data_dark = io.as_float(data, dtype), io.as_float(data_dark, dtype)
+    darkcurrent_darkpixels, darkcurrent_spectrum = darkcurrent_darkpixels.astype(dtype), darkcurrent_spectrum.astype(dtype)
+
     # Apply the correction
     correction_darkpixels = np.nanmean(data_dark - darkcurrent_darkpixels, axis=2)
     data_corrected = data - darkcurrent_spectrum - correction_darkpixels[...,np.newaxis]
@@ -104,3 +110,26 @@ def correct_efficiency(data, wavelengths=None, efficiency_data=None):
     ind_660 = np.nanargmin(np.abs(efficiency_data[0,5] - 660))
     ind_672 = np.nanargmin(np.abs(efficiency_data[0,5] - 672))
     wvlrange = np.s_[ind_660:ind_672]
+
+
+def correct_chunks(chunks, darkmap=None, wavelengths=None, transmission_correction_data=None, texp=200., temperature=26., dtype=np.float64):
+    """
+    Apply the dark current, wavelength and transmission corrections to a
+    stream of (data, data_dark, data_timestamps) chunks, e.g. from
+    `io.iterate_data_folder`, one chunk at a time.
+    The calibration data are loaded only once. Raw counts (`io.RawCounts`)
+    are converted to floats of `dtype` one chunk at a time.
+    Yields (wavelengths, data_corrected, data_timestamps) for each chunk.
+    """
+    if darkmap is None:
+        darkmap = io.read_darkmap()
+    if wavelengths is None:
+        wavelengths = generate_wavelengths()
+    if transmission_correction_data is None:
+        transmission_correction_data = io.read_transmission_correction()
+
+    for data, data_dark, data_timestamps in chunks:
+        data = correct_darkcurrent(data, data_dark, darkmap=darkmap, texp=texp, temperature=temperature, dtype=dtype)
+        wavelengths_corrected, data = correct_wavelengths(data, wavelengths=wavelengths)
+        data = correct_transmission(data, transmission_correction_data=transmission_correction_data)
+        yield wavelengths_corrected, data, data_timestamps
@@ -3,6 +3,7 @@ groundSPEX spectropolarimetric demodulation code
 """
 import numpy as np
 from scipy.optimize import curve_fit
+from spex.resolution import convolve_lsf
 from .instrument import MOR_RETARDANCE_NOMINAL
 
 
@@ -32,25 +33,28 @@ def calculate_psi(wavelengths, aolp, retardance):
     return 2*np.pi*retardance/wavelengths + 2*aolp
 
 
-def modulation(wavelengths, intensity, dolp, aolp, retardance_mor=MOR_RETARDANCE_NOMINAL):
+def modulation(wavelengths, intensity, dolp, aolp, retardance_mor=MOR_RETARDANCE_NOMINAL, fwhm=None):
     """
     From the unpolarised intensity and the degree and angle of linear polarisation, generate the modulated spectra in both channels of a dual-channel spectorpolarimeter.
     retardance_mor is the retardance of the multi-order retarder in the same units as wavelengths (not normalised!)
     All quantities are assumed to be wavelength-dependent.
+    If `fwhm` is given, the spectra are convolved with a line-spread function of that width (in the same units as wavelengths).
     """
     psi = calculate_psi(wavelengths, aolp, retardance_mor)  # Helper variable: phase
     Splus = 0.5*intensity*(1 + dolp*np.cos(psi))
     Smin = 0.5*intensity*(1 - dolp*np.cos(psi))
+    Splus = convolve_lsf(wavelengths, Splus, fwhm)
+    Smin = convolve_lsf(wavelengths, Smin, fwhm)
 
     return Splus, Smin
 
 
-def modulation_normalised(wavelengths, dolp, aolp, retardance_mor=MOR_RETARDANCE_NOMINAL):
+def modulation_normalised(wavelengths, dolp, aolp, retardance_mor=MOR_RETARDANCE_NOMINAL, fwhm=None):
     """
     From the degree and angle of linear polarisation, generate the modulation fraction (I+ - I-)/(I+ + I-).
     """
     psi = calculate_psi(wavelengths, aolp, retardance_mor)  # Helper variable: phase
-    fraction = dolp*np.cos(psi)
+    fraction = convolve_lsf(wavelengths, dolp*np.cos(psi), fwhm)
 
     return fraction
 
@@ -76,3 +80,26 @@ def fit_modulation_single(wavelengths, ydata, func=modulation_to_fit, p0=[0.1, 0
         popt = np.tile(np.nan, 4)
         pcov = np.tile(np.nan, (4, 4))
     return popt, pcov
+
+
+def modulation_fraction(data):
+    """
+    Calculate Stokes I (the sum of both channels) and the modulation fraction
+    (I+ - I-)/(I+ + I-) for dual-channel data with shape [..., 2, nr_pixels].
+    """
+    Stokes_I = np.nansum(data, axis=-2)
+    fraction = (data[...,1,:] - data[...,0,:]) / Stokes_I
+    return Stokes_I, fraction
+
+
+def demodulate_chunks(corrected_chunks, wavelength_limits=(419, 851)):
+    """
+    Crop a stream of corrected (wavelengths, data, data_timestamps) chunks,
+    e.g. from `data_processing.correct_chunks`, and calculate Stokes I and
+    the modulation fraction for each, one chunk at a time.
+    Yields (wavelengths, Stokes_I, fraction, data_timestamps) for each chunk.
+    """
+    for wavelengths, data, data_timestamps in corrected_chunks:
+        wavelengths_crop, data_crop = crop_spectra(wavelengths, data, wavelength_limits=wavelength_limits)
+        Stokes_I, fraction = modulation_fraction(data_crop)
+        yield wavelengths_crop, Stokes_I, fraction, data_timestamps
@@ -1,6 +1,8 @@
 """
 groundSPEX input/output functions
 """
+import json
+import os
 from functools import partial
 from pathlib import Path
 import numpy as np
@@ -9,6 +11,187 @@ from .instrument import PIXEL_NUMBER_AVANTES
 
 load_csv = partial(np.genfromtxt, delimiter=",")
 
+# Name of the sidecar folder in which `load_data_folder` caches its results
+CACHE_FOLDER = ".groundspex_cache"
+CACHE_PRODUCTS = ("data", "data_dark", "data_timestamps")
+# Version of the cached array layout; caches of other versions are not used
+CACHE_VERSION = 2
+
+# Translation table that turns every separator in a data file into a space
+_SEPARATORS = bytes.maketrans(b",;\t\r\n", b"     ")
+
+# Integer type for compact raw counts (the Avantes ADC has 16 bits)
+COMPACT_DTYPE = np.uint16
+
+
+class RawCounts(object):
+    """
+    Raw detector counts stored compactly as integers, with a boolean mask of
+    the missing values (NaN in the data files), if there are any.
+    Conversion to floating point is done only when needed, e.g. by
+    `to_float` or `np.asarray`, and can be done per slice.
+    The loading functions only return raw counts when asked to with
+    `compact=True`; by default, they return float arrays.
+    """
+    def __init__(self, counts, mask=None):
+        """
+        Create the object.
+        counts: Integer array of counts; missing values may have any value.
+        mask: Boolean array that is True for missing values, or None if there are none.
+        """
+        self.counts = counts
+        self.mask = mask
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        missing = 0 if self.mask is None else np.count_nonzero(self.mask)
+        return f"Raw counts with shape {self.shape} ({self.dtype}, {self.nbytes/2**20:.1f} MiB), {missing} missing"
+
+
+    @classmethod
+    def from_float(cls, data, dtype=COMPACT_DTYPE):
+        """
+        Store floating-point counts as integers of `dtype`.
+        Raises a ValueError if the valid counts are not whole numbers within
+        the range of `dtype`.
+        """
+        data = np.asarray(data)
+        mask = np.isnan(data)
+        counts = np.where(mask, 0, data)
+        limits = np.iinfo(dtype)
+        if counts.size and (counts.min() < limits.min or counts.max() > limits.max or np.any(counts != np.round(counts))):
+            raise ValueError(f"Counts cannot be stored exactly as {np.dtype(dtype)}; load them as floats instead")
+        return cls(counts.astype(dtype), mask if mask.any() else None)
+
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    @property
+    def ndim(self):
+        return self.counts.ndim
+
+    @property
+    def dtype(self):
+        return self.counts.dtype
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes + (0 if self.mask is None else self.mask.nbytes)
+
+
+    def __len__(self):
+        return len(self.counts)
+
+
+    def apply(self, function):
+        """
+        Apply an indexing or reshaping `function` to both the counts and the
+        mask, and return the result as new raw counts.
+        """
+        return RawCounts(function(self.counts), None if self.mask is None else function(self.mask))
+
+
+    def __getitem__(self, index):
+        return self.apply(lambda array: array[index])
+
+
+    def to_float(self, dtype=np.float64):
+        """
+        Convert to floating point, with NaN for missing values.
+        """
+        data = self.counts.astype(dtype)
+        if self.mask is not None:
+            data[self.mask] = np.nan
+        return data
+
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_float(np.float64 if dtype is None else dtype)
+
+
+def as_float(data, dtype=np.float64):
+    """
+    Convert data (`RawCounts` or any array) to floating point of `dtype`,
+    without copying if they already are.
+    """
+    if isinstance(data, RawCounts):
+        return data.to_float(dtype)
+    return np.asarray(data, dtype=dtype)
+
+
+def _count_fields(text):
+    """
+    Count the fields in `text` (bytes) that are separated by commas and/or
+    whitespace, without splitting it.
+    """
+    characters = np.frombuffer(text.translate(_SEPARATORS), dtype=np.uint8)
+    if characters.size == 0:
+        return 0
+    is_separator = characters == ord(" ")
+    # A field starts at every non-separator that follows a separator (or the start of the text)
+    return int(not is_separator[0]) + int(np.count_nonzero(is_separator[:-1] & ~is_separator[1:]))
+
+
+def parse_numbers(text, dtype=np.float64):
+    """
+    Parse all numbers in `text` (bytes), separated by commas and/or
+    whitespace, into a flat array, in a single pass of NumPy's text parser.
+    Empty fields are skipped, so check the number of values if it matters.
+    Returns None if any field is not a number (e.g. text in a data file), so
+    the caller can fall back to a general parser.
+    """
+    nr_fields = _count_fields(text)
+    if nr_fields == 0:
+        return np.empty(0, dtype=dtype)
+    try:
+        numbers = np.fromstring(text.translate(_SEPARATORS), dtype=dtype, sep=" ")
+    except ValueError:
+        return None
+    # Older NumPy versions stop at the first bad field with a warning instead of raising
+    if len(numbers) != nr_fields:
+        return None
+    return numbers
+
+
+def _lines(text):
+    return [line for line in text.splitlines() if line.strip(b", \t")]
+
+
+def parse_pixel_file(filename):
+    """
+    Fast parser for Avantes `_pix.txt` files: a single line of comma-separated
+    counts, with all spectra concatenated and a trailing comma.
+    Returns a flat float64 array of counts, or None if the file does not
+    have that layout (e.g. empty fields), so the caller can fall back to a
+    general parser.
+    """
+    text = Path(filename).read_bytes()
+    counts = parse_numbers(text)
+    if counts is None or len(_lines(text)) != 1 or len(counts) != text.count(b","):
+        return None
+    return counts
+
+
+def parse_dark_file(filename, nr_columns=13):
+    """
+    Fast parser for Avantes `.dark13.txt` files: one line of `nr_columns`
+    comma-separated dark pixel counts per spectrum, each with a trailing
+    comma.
+    Returns an array of shape (nr_spectra, nr_columns), or (nr_columns,) for
+    a single spectrum, or None if the file does not have that layout.
+    """
+    text = Path(filename).read_bytes()
+    counts = parse_numbers(text)
+    nr_rows = len(_lines(text))
+    if counts is None or nr_rows == 0 or len(counts) != nr_rows * nr_columns or text.count(b",") != len(counts):
+        return None
+    return counts.reshape(nr_rows, nr_columns) if nr_rows > 1 else counts
+
 def get_filenames(folder):
     """
     Get the filenames for both spectrometers from a given folder.
@@ -30,7 +213,9 @@ def load_data_file(filename):
     """
     Load a groundSPEX spectrum from file.
     """
-    counts = load_csv(filename)[:-1]  # Remove the last element which is always empty
+    counts = parse_pixel_file(filename)
+    if counts is None:  # Unexpected layout, use the general (slow) parser
+        counts = load_csv(filename)[:-1]  # Remove the last element which is always empty
 
     # groundSPEX data files have all spectra concatenated, so if we have multiple spectra in this file, split them
     if len(counts) > PIXEL_NUMBER_AVANTES:
@@ -44,7 +229,9 @@ def load_data_file_dark(filename):
     Load a dark pixel file from a spectrum filename.
     """
     filename_dark = filename.with_suffix(".dark13.txt")
-    counts_dark = load_csv(filename_dark)[...,:13]  # Remove the 14th element in each row, which is always empty
+    counts_dark = parse_dark_file(filename_dark)
+    if counts_dark is None:  # Unexpected layout, use the general (slow) parser
+        counts_dark = load_csv(filename_dark)[...,:13]  # Remove the 14th element in each row, which is always empty
     return counts_dark
 
 
@@ -53,42 +240,378 @@ def load_data_file_timestamp(filename):
     Load a timestamp data file from a spectrum filename.
     """
     filename_timestamp = filename.with_suffix(".timestamps.txt")
-    timestamp = np.loadtxt(filename_timestamp, dtype=np.int64)
+    text = filename_timestamp.read_bytes()
+    timestamp = parse_numbers(text, dtype=np.int64)
+    if timestamp is None or len(timestamp) != len(_lines(text)):  # Unexpected layout, use the general (slow) parser
+        timestamp = np.loadtxt(filename_timestamp, dtype=np.int64)
+    elif len(timestamp) == 1:
+        timestamp = timestamp.reshape(())  # Same as np.loadtxt for a single value
     return timestamp
 
 
-def load_data_bulk(filenames1, filenames2, load=load_data_file):
+def load_data_bulk(filenames1, filenames2, load=load_data_file, squeeze=True, compact=False):
     """
     Load data in bulk.
     `load` can be any loading function.
+    If `squeeze` is True, axes of length 1 (e.g. one spectrum per file) are
+    removed from the result.
+    If `compact` is True, the counts are stored as `RawCounts`, in
+    `COMPACT_DTYPE` with a mask of missing values, instead of as floats
+    (the default).
+    The output array is allocated once, and every file is written directly
+    into its place in it.
     """
-    # Load all the data - shape will be [2, nr_files, nr_spectra, nr_pixels]
-    data = np.array([[load(f) for f in filenames] for filenames in [filenames1, filenames2]])
+    filenames = [(channel, i, f) for channel, channel_filenames in enumerate([filenames1, filenames2]) for i, f in enumerate(channel_filenames)]
+    if len(filenames1) != len(filenames2):
+        raise ValueError(f"Different numbers of files for both spectrometers: {len(filenames1)} and {len(filenames2)}")
+
+    # Use the first file to find the shape of the output
+    first = np.asarray(load(filenames[0][2]))
+    nr_files = len(filenames1)
+
+    # Output shape is [nr_files, nr_spectra, 2, nr_pixels]
+    # `target` is a view of it with shape [2, nr_files, nr_spectra, nr_pixels] to write into
+    dtype = COMPACT_DTYPE if compact else first.dtype
+    if first.ndim == 0:
+        data = np.empty((nr_files, 2), dtype=dtype)
+        to_target = np.transpose
+    else:
+        data = np.empty((nr_files, first.shape[0], 2) + first.shape[1:], dtype=dtype)
+        to_target = lambda array: np.moveaxis(array, (0, 1), (1, 2))
+    target = to_target(data)
+    if compact:
+        mask = np.zeros(data.shape, dtype=bool)
+        target_mask = to_target(mask)
 
-    # Reshape to [nr_files, nr_spectra, 2, nr_pixels]
-    data = np.moveaxis(data, (1, 2), (0, 1))
+    for channel, i, f in filenames:
+        result = first if (channel, i) == (0, 0) else load(f)
+        if np.shape(result) != first.shape:
+            raise ValueError(f"File {f} has shape {np.shape(result)} instead of {first.shape}")
+        if compact:
+            result = RawCounts.from_float(result, dtype)
+            if result.mask is not None:
+                target_mask[channel, i] = result.mask
+            result = result.counts
+        target[channel, i] = result
+
+    if compact:
+        data = RawCounts(data, mask if mask.any() else None)
 
     # If N = 1, remove that axis
-    data = np.squeeze(data)
+    if squeeze:
+        data = data.apply(np.squeeze) if compact else np.squeeze(data)
 
     return data
 
 
-def load_data_folder(folder):
+def folder_signature(filenames1, filenames2):
+    """
+    Describe the data, dark and timestamp files by their names, sizes and
+    modification times, so that a change to any of them can be detected.
+    """
+    signature = []
+    for filename in [f for filenames in [filenames1, filenames2] for f in filenames]:
+        for f in [filename, filename.with_suffix(".dark13.txt"), filename.with_suffix(".timestamps.txt")]:
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                signature.append([f.name, None, None])
+            else:
+                signature.append([f.name, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def load_cache(folder, signature):
+    """
+    Load the cached data, dark and timestamp arrays for a folder, if the
+    cache exists and matches `signature`. The arrays are memory-mapped
+    copy-on-write: they can be changed in memory like freshly loaded arrays,
+    but changes are never written back to the cache.
+    Products that were cached as `RawCounts` are loaded as such.
+    Returns None otherwise.
+    """
+    cache = Path(folder)/CACHE_FOLDER
+    try:
+        description = json.loads((cache/"signature.json").read_text())
+        if description["signature"] != signature:
+            return None
+        arrays = []
+        for product in CACHE_PRODUCTS:
+            array = np.load(cache/f"{product}.npy", mmap_mode="c")
+            if product in description["raw"]:
+                mask = np.load(cache/f"{product}_mask.npy", mmap_mode="c") if description["raw"][product] else None
+                array = RawCounts(array, mask)
+            arrays.append(array)
+        return tuple(arrays)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_cache(folder, signature, arrays):
+    """
+    Save the data, dark and timestamp arrays for a folder to its cache.
+    Every file is written under a temporary name first, and the signature is
+    written last, so an interrupted write never looks like a valid cache.
+    If the folder is not writable, nothing is saved.
+    """
+    cache = Path(folder)/CACHE_FOLDER
+    # For RawCounts, the counts and mask are saved separately; `raw` records whether there is a mask
+    raw = {}
+    try:
+        cache.mkdir(exist_ok=True)
+        (cache/"signature.json").unlink(missing_ok=True)
+        for product, array in zip(CACHE_PRODUCTS, arrays):
+            files = {product: array}
+            if isinstance(array, RawCounts):
+                raw[product] = array.mask is not None
+                files = {product: array.counts}
+                if array.mask is not None:
+                    files[f"{product}_mask"] = array.mask
+            for name, values in files.items():
+                filename_temporary = cache/f"{name}.tmp.npy"
+                np.save(filename_temporary, values)
+                os.replace(filename_temporary, cache/f"{name}.npy")
+        filename_temporary = cache/"signature.tmp.json"
+        filename_temporary.write_text(json.dumps({"signature": signature, "raw": raw}))
+        os.replace(filename_temporary, cache/"signature.json")
+    except OSError:
+        pass
+
+
+def _channels_first(data):
+    """
+    With one spectrum per file, `load_data_bulk` gives counts with shape
+    [nr_files, nr_pixels, 2]; move the spectrometer axis in front of the
+    pixels, to [nr_files, 2, nr_pixels], like for several spectra per file.
+    """
+    if data.ndim != 3:
+        return data
+    swap = lambda array: np.ascontiguousarray(np.swapaxes(array, 1, 2))
+    return data.apply(swap) if isinstance(data, RawCounts) else swap(data)
+
+
+def load_data_folder(folder, cache=False, compact=False):
     """
     Load all groundSPEX data from a folder.
+    The data and dark counts have shapes [nr_files, nr_spectra, 2, nr_pixels]
+    or, with one spectrum per file, [nr_files, 2, nr_pixels], and the
+    timestamps [nr_files, nr_spectra, 2] or [nr_files, 2]; axes of length 1
+    are removed.
+    If `cache` is True, the results are stored in a sidecar folder
+    (`CACHE_FOLDER`) inside the data folder and loaded from there (memory-
+    mapped, see `load_cache`) as long as none of the files in the folder have
+    been added, removed or changed. If the data folder is not writable,
+    nothing is cached. Either way, the arrays can be changed in place.
+    If `compact` is True, the data and dark counts are returned as
+    `RawCounts`, which take a quarter of the memory; the corrections in
+    `data_processing` convert them to floats. This is off by default, so
+    that the counts are plain float arrays as before.
     """
     # Get the filenames
     data_filenames1, data_filenames2 = get_filenames(folder)
 
-    # Load the data into an array of shape [2, N, 3648] with N the number of files
-    data = load_data_bulk(data_filenames1, data_filenames2)
-    data_dark = load_data_bulk(data_filenames1, data_filenames2, load_data_file_dark)
+    if cache:
+        signature = {"files": folder_signature(data_filenames1, data_filenames2), "compact": compact, "version": CACHE_VERSION}
+        cached = load_cache(folder, signature)
+        if cached is not None:
+            return cached
+
+    # Load the data into arrays of shape [N, (nr_spectra,) 2, nr_pixels] with N the number of files
+    data, data_dark = [_channels_first(load_data_bulk(data_filenames1, data_filenames2, load, squeeze=False, compact=compact)) for load in [load_data_file, load_data_file_dark]]
+    data, data_dark = [array.apply(np.squeeze) if compact else np.squeeze(array) for array in (data, data_dark)]
     data_timestamps = load_data_bulk(data_filenames1, data_filenames2, load_data_file_timestamp)
 
+    if cache:
+        save_cache(folder, signature, (data, data_dark, data_timestamps))
+
     return data, data_dark, data_timestamps
 
 
+def iterate_data_folder(folder, chunk_size=50, compact=False):
+    """
+    Iterate over all groundSPEX data in a folder, `chunk_size` files at a
+    time, so that only one chunk needs to be in memory.
+    The files of both spectrometers are paired like in `load_data_folder`.
+    Each step gives (data, data_dark, data_timestamps) with shapes
+    [N, 2, 3648], [N, 2, 13] and [N, 2], where N is the number of exposures
+    (spectra) in that chunk. This is the axis order of `load_data_folder`,
+    with the file and spectrum axes combined.
+    If `compact` is True, data and dark counts are given as `RawCounts`.
+    """
+    data_filenames1, data_filenames2 = get_filenames(folder)
+    if len(data_filenames1) != len(data_filenames2):
+        raise ValueError(f"Different numbers of files for both spectrometers: {len(data_filenames1)} and {len(data_filenames2)}")
+
+    for start in range(0, len(data_filenames1), chunk_size):
+        filenames1 = data_filenames1[start:start+chunk_size]
+        filenames2 = data_filenames2[start:start+chunk_size]
+
+        # Load without squeezing, then combine the file and spectrum axes into one exposure axis
+        data, data_dark = [_channels_first(load_data_bulk(filenames1, filenames2, load, squeeze=False, compact=compact)) for load in [load_data_file, load_data_file_dark]]
+        data_timestamps = load_data_bulk(filenames1, filenames2, load_data_file_timestamp, squeeze=False)
+        if data.ndim == 4:  # Several spectra per file: [nr_files, nr_spectra, 2, nr_pixels]
+            to_exposures = lambda array: array.reshape(-1, *array.shape[2:])
+            data, data_dark = [array.apply(to_exposures) if compact else to_exposures(array) for array in (data, data_dark)]
+            data_timestamps = data_timestamps.reshape(-1, 2)
+
+        yield data, data_dark, data_timestamps
+
+
+def _spectrum_offsets(filename, nr_pixels=PIXEL_NUMBER_AVANTES):
+    """
+    Byte offsets and lengths of each spectrum in a `_pix.txt` file, found from
+    the positions of the commas.
+    """
+    text = np.fromfile(filename, dtype=np.uint8)
+    commas = np.flatnonzero(text == ord(","))
+    ends = commas[nr_pixels-1::nr_pixels] + 1
+    starts = np.concatenate([[0], ends[:-1]])
+    return starts, ends - starts
+
+
+class ExposureCatalogue(object):
+    """
+    Catalogue of all exposures (single spectra) in a groundSPEX data folder,
+    sorted by timestamp, as a structured array with the file name,
+    spectrometer (0 or 1), file number, spectrum index within the file,
+    timestamp, and the position of the spectrum in its file (byte offset and
+    length). Spectra can be loaded from the catalogue individually, without
+    reading the rest of their files.
+    """
+    def __init__(self, folder, entries):
+        """
+        Create the object.
+        folder: Data folder that the file names are relative to.
+        entries: Structured array of exposures.
+        """
+        self.folder = Path(folder)
+        self.entries = entries
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return f"Exposure catalogue of {self.folder} with {len(self)} spectra"
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def __getitem__(self, index):
+        """
+        Select exposures by index, slice or boolean mask.
+        """
+        return ExposureCatalogue(self.folder, np.atleast_1d(self.entries[index]))
+
+
+    @classmethod
+    def build(cls, folder):
+        """
+        Build the catalogue by reading the timestamp files and finding the
+        positions of the spectra in the data files.
+        """
+        folder = Path(folder)
+        entries = []
+        for spectrometer, filenames in enumerate(get_filenames(folder)):
+            for filename in filenames:
+                timestamps = np.atleast_1d(load_data_file_timestamp(filename))
+                offsets, nbytes = _spectrum_offsets(filename)
+                if len(offsets) != len(timestamps):
+                    raise ValueError(f"{filename} contains {len(offsets)} spectra but {len(timestamps)} timestamps")
+                file_number = int(filename.stem.split("_")[2])
+                entries.extend((filename.name, spectrometer, file_number, i, t, o, n) for i, (t, o, n) in enumerate(zip(timestamps, offsets, nbytes)))
+
+        name_length = max([len(entry[0]) for entry in entries], default=1)
+        dtype = [("file", f"U{name_length}"), ("spectrometer", np.int8), ("file_number", np.int32), ("spectrum", np.int32), ("timestamp", np.int64), ("offset", np.int64), ("nbytes", np.int64)]
+        entries = np.array(entries, dtype=dtype)
+        entries = entries[np.argsort(entries["timestamp"], kind="stable")]
+        return cls(folder, entries)
+
+
+    def save(self, filename=None):
+        """
+        Save the catalogue, by default in the cache folder next to the data.
+        """
+        filename = self.folder/CACHE_FOLDER/"catalogue.npy" if filename is None else Path(filename)
+        filename.parent.mkdir(exist_ok=True)
+        np.save(filename, self.entries)
+
+
+    @classmethod
+    def load(cls, folder, rebuild=False):
+        """
+        Load the catalogue of a data folder from its cache folder, or build
+        and save it if it does not exist, is outdated, or `rebuild` is True.
+        """
+        folder = Path(folder)
+        cache = folder/CACHE_FOLDER
+        signature = folder_signature(*get_filenames(folder))
+        if not rebuild:
+            try:
+                if json.loads((cache/"catalogue_signature.json").read_text()) == signature:
+                    return cls(folder, np.load(cache/"catalogue.npy"))
+            except (OSError, ValueError):
+                pass
+
+        catalogue = cls.build(folder)
+        try:
+            catalogue.save()
+            (cache/"catalogue_signature.json").write_text(json.dumps(signature))
+        except OSError:
+            pass
+        return catalogue
+
+
+    @property
+    def timestamps(self):
+        return self.entries["timestamp"]
+
+
+    def between(self, start=None, stop=None, spectrometer=None):
+        """
+        Exposures with start <= timestamp < stop, optionally for one
+        `spectrometer` only (0 or 1).
+        """
+        first = 0 if start is None else np.searchsorted(self.timestamps, start, side="left")
+        last = len(self) if stop is None else np.searchsorted(self.timestamps, stop, side="left")
+        selection = self[first:last]
+        if spectrometer is not None:
+            selection = selection[selection.entries["spectrometer"] == spectrometer]
+        return selection
+
+
+    def load_spectra(self):
+        """
+        Load the spectra in this catalogue, in order, reading only their own
+        part of each file. Returns an array of shape [N, 3648].
+        """
+        spectra = np.empty((len(self), PIXEL_NUMBER_AVANTES))
+        for k, entry in enumerate(self.entries):
+            with open(self.folder/entry["file"], "rb") as file:
+                file.seek(entry["offset"])
+                counts = parse_numbers(file.read(entry["nbytes"]))
+            if counts is None or len(counts) != PIXEL_NUMBER_AVANTES:  # Unexpected layout, e.g. empty fields or text
+                counts = np.atleast_2d(load_data_file(self.folder/entry["file"]))[entry["spectrum"]]
+            spectra[k] = counts
+        return spectra
+
+
+    def load_dark(self):
+        """
+        Load the dark pixels for the spectra in this catalogue, in order.
+        Every dark file is read once, however many of its spectra are used.
+        Returns an array of shape [N, 13].
+        """
+        dark = np.empty((len(self), 13))
+        files, file_index = np.unique(self.entries["file"], return_inverse=True)
+        for k, filename in enumerate(files):
+            selected = np.flatnonzero(file_index == k)
+            dark[selected] = np.atleast_2d(load_data_file_dark(self.folder/filename))[self.entries["spectrum"][selected]]
+        return dark
+
+
 def read_darkmap(filename="pipeline_GvH/darkmap.sav"):
     """
     Load a darkmap from a .sav file.
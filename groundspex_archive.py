@@ -0,0 +1,19 @@
+"""
+Convert groundSPEX data folders into a campaign archive, or add new folders
+to an existing one.
+Usage: python groundspex_archive.py path/to/archive path/to/data1 [path/to/data2 ...] [--corrected]
+"""
+from sys import argv
+import groundspex
+
+arguments = [argument for argument in argv[1:] if not argument.startswith("--")]
+corrected = "--corrected" in argv
+archive_folder, data_folders = arguments[0], arguments[1:]
+
+archive = groundspex.archive.CampaignArchive(archive_folder)
+for data_folder in data_folders:
+    length = len(archive)
+    groundspex.archive.convert_folder(data_folder, archive, corrected=corrected)
+    print(f"{data_folder}: {len(archive) - length} exposures added")
+
+print(archive)
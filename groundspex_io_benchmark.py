@@ -0,0 +1,70 @@
+"""
+Benchmark of the groundSPEX data file parsers against the general numpy
+text readers, on synthetic Avantes files with the same layout as real data.
+Usage: python groundspex_io_benchmark.py [nr_files] [nr_spectra_per_file]
+"""
+from pathlib import Path
+from sys import argv
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import numpy as np
+from groundspex import io
+from groundspex.instrument import PIXEL_NUMBER_AVANTES
+
+nr_files = int(argv[1]) if len(argv) > 1 else 50
+nr_spectra = int(argv[2]) if len(argv) > 2 else 5
+
+
+def write_synthetic_files(folder, rng):
+    """
+    Write `nr_files` spectrum, dark and timestamp files for both spectrometers.
+    """
+    for spectrometer in ["1105161U2", "1105162U2"]:
+        for i in range(nr_files):
+            filename = folder/f"Spectrometer_{spectrometer}_{i}_pix.txt"
+            counts = rng.integers(0, 2**16, nr_spectra*PIXEL_NUMBER_AVANTES)
+            filename.write_text("".join(f"{c}," for c in counts))
+            dark = rng.integers(0, 2**12, (nr_spectra, 13))
+            filename.with_suffix(".dark13.txt").write_text("".join("".join(f"{c}," for c in row) + "\n" for row in dark))
+            timestamps = rng.integers(0, 10**9, nr_spectra)
+            filename.with_suffix(".timestamps.txt").write_text("".join(f"{t}\n" for t in timestamps))
+
+
+def load_general(filename):
+    """
+    The previous loaders, using np.genfromtxt and np.loadtxt.
+    """
+    counts = io.load_csv(filename)[:-1]
+    if len(counts) > PIXEL_NUMBER_AVANTES:
+        counts = counts.reshape((-1, PIXEL_NUMBER_AVANTES))
+    dark = io.load_csv(filename.with_suffix(".dark13.txt"))[...,:13]
+    timestamps = np.loadtxt(filename.with_suffix(".timestamps.txt"), dtype=np.int64)
+    return counts, dark, timestamps
+
+
+def load_fast(filename):
+    return io.load_data_file(filename), io.load_data_file_dark(filename), io.load_data_file_timestamp(filename)
+
+
+with TemporaryDirectory() as folder:
+    folder = Path(folder)
+    write_synthetic_files(folder, np.random.default_rng(1))
+    filenames = [f for filenames in io.get_filenames(folder) for f in filenames]
+    size = sum(f.stat().st_size for f in filenames) / 2**20
+    print(f"{len(filenames)} files with {nr_spectra} spectra each ({size:.1f} MiB of spectra)")
+
+    timings = {}
+    for label, load in [("general", load_general), ("fast", load_fast)]:
+        start = perf_counter()
+        results = [load(f) for f in filenames]
+        timings[label] = perf_counter() - start
+        print(f"{label:>8}: {timings[label]:.3f} s ({1000*timings[label]/len(filenames):.2f} ms per file)")
+        if label == "general":
+            reference = results
+
+    # Check that both give the same data
+    for r, f in zip(reference, results):
+        for a, b in zip(r, f):
+            assert np.array_equal(a, b) and a.shape == b.shape and a.dtype == b.dtype
+
+    print(f"Speed-up: {timings['general']/timings['fast']:.1f}x; results identical")
@@ -0,0 +1,38 @@
+"""
+Accuracy and speed of float32 simulations compared to float64, on the
+single-parameter tolerance sweeps of ispex2_error.py.
+"""
+from time import perf_counter
+import numpy as np
+import spex
+from spex import stokes
+from spex.margins import D_err, A_err, margin
+
+wavelengths = np.arange(450, 700, 0.3)
+sources = [(0.1, 0.), (0.3, 0.4), (-0.5, 0.), (0., 0.7), (0.9, 0.)]
+parameters = {"QWP_d": np.linspace(-15, 15, 301), "QWP_t": np.linspace(-20, 20, 401),
+              "MOR1_d": np.linspace(-20, 20, 401), "MOR1_t": np.linspace(-10, 10, 201),
+              "MOR2_d": np.linspace(-20, 20, 401), "MOR2_t": np.linspace(-10, 10, 201),
+              "POL0_t": np.linspace(-20, 20, 401), "POL90_t": np.linspace(-20, 20, 401)}
+
+times = {np.float32: 0., np.float64: 0.}
+print(f"{'Q':>5} {'U':>5} {'parameter':>9} {'max dI':>9} {'max dDoLP':>10} {'max dAoLP':>10} {'margin 64':>10} {'margin 32':>10}")
+for Q, U in sources:
+    source = stokes.Stokes_nm(np.ones_like(wavelengths), Q, U, 0.)
+    DoLP_real = stokes.DoLP(*source[0]) ; AoLP_real = stokes.AoLP_deg(*source[0])
+    for parameter, prange in parameters.items():
+        results = {}
+        for dtype in times:
+            start = perf_counter()
+            I0s, I90s = spex.simulate_iSPEX2_sweep(wavelengths, source, dtype=dtype, **{parameter: prange})
+            DoLPs, AoLPs = spex.retrieval.retrieve_DoLP_linear2(wavelengths, source, I0s, I90s)
+            times[dtype] += perf_counter() - start
+            results[dtype] = (I0s, DoLPs, AoLPs, margin(prange, DoLPs, AoLPs, DoLP_real, AoLP_real))
+
+        (I64, D64, A64, m64), (I32, D32, A32, m32) = results[np.float64], results[np.float32]
+        dI = np.abs(I32 - I64).max()
+        dD = np.abs(D_err(D32, D64)).max()
+        dA = A_err(A32, A64).max()
+        print(f"{Q:5.2f} {U:5.2f} {parameter:>9} {dI:9.1e} {dD:10.1e} {dA:10.1e} {m64:10.3f} {m32:10.3f}")
+
+print(f"Total time: float64 {times[np.float64]:.2f} s, float32 {times[np.float32]:.2f} s")
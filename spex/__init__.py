@@ -0,0 +1,8 @@
+from . import elements, stokes, modulation, cache, parallel, train, ispex, retrieval, margins, montecarlo, sensitivity, emulator, noise, resolution, precision
+from .train import OpticalTrain
+from .stokes import StokesArray
+from .precision import set_precision
+from .ispex import *
+from .retrieval import retrieve_DoLP_linear, retrieve_DoLP_joint
+from .margins import margin_map
+from .montecarlo import monte_carlo
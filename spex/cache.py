@@ -0,0 +1,178 @@
+"""
+Opt-in memoization of wavelength-dependent element stacks.
+
+Building a stack such as `Retarder_wavelengths(d_nm, t, wavelengths)` means
+evaluating trigonometric functions over the whole wavelength grid. Sweeps
+that perturb one element re-use the others unchanged, so those stacks can be
+cached. Caching is disabled by default; call `enable()` to switch it on.
+"""
+from collections import OrderedDict, namedtuple
+import numpy as np
+from .precision import get_dtype
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "maxbytes", "currsize", "nbytes"])
+
+
+def wavelength_fingerprint(wavelengths):
+    """
+    Create a hashable fingerprint of a wavelength grid (or any array), so that
+    results calculated on that grid can be cached.
+    The fingerprint contains the full contents of the array rather than just
+    their hash, so two different grids can never share a cache entry.
+    """
+    wavelengths = np.ascontiguousarray(wavelengths)
+    return (wavelengths.shape, wavelengths.dtype.str, wavelengths.tobytes())
+
+
+def qualified_name(function):
+    """
+    Name of a function including its module, e.g. "spex.elements.Filter", so
+    that functions with the same name in different modules are told apart.
+    """
+    return f"{function.__module__}.{function.__qualname__}"
+
+
+def hashable(parameter):
+    """
+    Convert an element parameter into something hashable.
+    Arrays are described by their fingerprint.
+    """
+    if isinstance(parameter, np.ndarray):
+        return wavelength_fingerprint(parameter)
+    return parameter
+
+
+class LRUCache(object):
+    """
+    Least-recently-used cache for arrays, bounded both in the number of
+    entries and in the total number of bytes stored.
+    Cached arrays are made read-only so they cannot be changed by accident.
+    """
+    def __init__(self, maxsize=256, maxbytes=2**28):
+        """
+        Create the object.
+        maxsize: Maximum number of entries.
+        maxbytes: Maximum total size of the cached arrays, in bytes.
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return f"LRUCache with {len(self)} entries ({self.nbytes/2**20:.1f} MiB); {self.hits} hits, {self.misses} misses"
+
+
+    def __len__(self):
+        return len(self._data)
+
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+    def info(self):
+        """
+        Statistics about the use of this cache.
+        """
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, self.maxbytes, len(self), self.nbytes)
+
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters.
+        """
+        self._data.clear()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+
+    def get(self, key, build):
+        """
+        Return the array stored under `key`.
+        If there is none, call `build()` to create it and store the result.
+        """
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+        value = np.asarray(build())
+        self.put(key, value)
+        return value
+
+
+    def put(self, key, value):
+        """
+        Store an array under `key`, evicting the least recently used entries
+        if the cache is full. Arrays larger than `maxbytes` are not stored.
+        """
+        if value.nbytes > self.maxbytes:
+            return
+
+        if key in self._data:
+            self.nbytes -= self._data.pop(key).nbytes
+
+        value.flags.writeable = False
+        self._data[key] = value
+        self.nbytes += value.nbytes
+
+        while len(self._data) > self.maxsize or self.nbytes > self.maxbytes:
+            _, evicted = self._data.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+
+# The cache used for element stacks, or None if caching is disabled
+_element_cache = None
+
+
+def enable(maxsize=256, maxbytes=2**28):
+    """
+    Switch on caching of element stacks, with the given bounds.
+    Returns the cache so its statistics can be inspected.
+    """
+    global _element_cache
+    _element_cache = LRUCache(maxsize=maxsize, maxbytes=maxbytes)
+    return _element_cache
+
+
+def disable():
+    """
+    Switch off caching of element stacks and free the cached arrays.
+    """
+    global _element_cache
+    _element_cache = None
+
+
+def element_cache():
+    """
+    The active element cache, or None if caching is disabled.
+    """
+    return _element_cache
+
+
+def cached_element(constructor, *parameters, wavelengths=None):
+    """
+    Call a constructor from `spex.elements` with the given parameters (and
+    `wavelengths` as its last argument, if given), using the element cache if
+    it is enabled. The cache key consists of the constructor, its parameters,
+    a fingerprint of the wavelength grid and the working precision.
+    """
+    arguments = parameters if wavelengths is None else parameters + (wavelengths,)
+    if _element_cache is None:
+        return constructor(*arguments)
+
+    key = (qualified_name(constructor), tuple(hashable(p) for p in parameters), None if wavelengths is None else wavelength_fingerprint(wavelengths), get_dtype().str)
+    return _element_cache.get(key, lambda: constructor(*arguments))
@@ -1,18 +1,45 @@
 import numpy as np
 from numpy import sin, cos
+from .precision import get_dtype
+
+def _empty_stack(*arrays):
+    """
+    Create an array of zeros with shape (..., 4, 4), where ... is the shape
+    that the given parameter arrays broadcast to, in the working precision.
+    """
+    shape = np.broadcast_shapes(*[np.shape(a) for a in arrays])
+    return np.zeros(shape + (4, 4), dtype=get_dtype())
 
 def Rotation_matrix_radians(phi):
-    return np.array([[1.,          0.,          0., 0.],
-                     [0.,  cos(2*phi),  sin(2*phi), 0.],
-                     [0., -sin(2*phi),  cos(2*phi), 0.],
-                     [0.,          0.,          0., 1.]])
+    """
+    Mueller matrix for a rotation of the reference frame by `phi` radians.
+    `phi` may be a scalar or an array of any shape, giving a stack of matrices
+    with shape (..., 4, 4).
+    """
+    cos_2phi = cos(2*phi)
+    sin_2phi = sin(2*phi)
+
+    rotation = _empty_stack(phi)
+    rotation[...,0,0] = 1.
+    rotation[...,1,1] = cos_2phi
+    rotation[...,1,2] = sin_2phi
+    rotation[...,2,1] = -sin_2phi
+    rotation[...,2,2] = cos_2phi
+    rotation[...,3,3] = 1.
+    return rotation
 
 def Rotation_matrix_degrees(phi_degrees):
     phi_radians = np.deg2rad(phi_degrees)
     return Rotation_matrix_radians(phi_radians)
 
 def rotate_element_radians(element, phi):
-    return Rotation_matrix_radians(-phi) @ element @ Rotation_matrix_radians(phi)
+    """
+    Rotate an `element` (shape (..., 4, 4)) to the angle `phi` in radians.
+    The leading axes of `element` and the shape of `phi` are broadcast
+    against each other.
+    """
+    rotation = Rotation_matrix_radians(phi)
+    return Rotation_matrix_radians(-phi) @ np.asarray(element, dtype=rotation.dtype) @ rotation
 
 def rotate_element_degrees(element, phi_degrees):
     phi = np.deg2rad(phi_degrees)
@@ -31,21 +58,49 @@ def Linear_polarizer_degrees(phi_degrees):
     return Linear_polarizer_radians(phi)
 
 def Linear_polarizer_general(kx, ky, phi_degrees=0):
+    """
+    Mueller matrix for a partial linear polarizer with principal
+    transmittances `kx` and `ky`, rotated to `phi_degrees`.
+    All parameters may be arrays, which are broadcast against each other to
+    give a stack with shape (..., 4, 4).
+    """
     px = np.sqrt(kx)
     py = np.sqrt(ky)
-    polarizer_0 = 0.5 * np.array([[px**2 + py**2, px**2 - py**2,       0, 0      ],
-                                  [px**2 - py**2, px**2 + py**2,       0, 0      ],
-                                  [0            , 0            , 2*px*py, 0      ],
-                                  [0            , 0            , 0      , 2*px*py]])
+
+    polarizer_0 = _empty_stack(px, py)
+    polarizer_0[...,0,0] = polarizer_0[...,1,1] = 0.5 * (px**2 + py**2)
+    polarizer_0[...,0,1] = polarizer_0[...,1,0] = 0.5 * (px**2 - py**2)
+    polarizer_0[...,2,2] = polarizer_0[...,3,3] = px*py
+
     polarizer = rotate_element_degrees(polarizer_0, phi_degrees)
     return polarizer
 
 def Retarder_radians(delta, phi):
-    retarder = np.array([[1, 0,          0,           0],
-                         [0, 1,          0,           0],
-                         [0, 0, cos(delta), -sin(delta)],
-                         [0, 0, sin(delta),  cos(delta)]])
-    return rotate_element_radians(retarder, phi)
+    """
+    Mueller matrix for a linear retarder with retardance `delta` at an angle
+    `phi`, both in radians.
+    Both parameters may be arrays, which are broadcast against each other to
+    give a stack with shape (..., 4, 4).
+
+    The rotation is applied in closed form rather than through two matrix
+    products, which matters when building large stacks.
+    """
+    cos_d = cos(delta)
+    sin_d = sin(delta)
+    cos_2phi = cos(2*phi)
+    sin_2phi = sin(2*phi)
+
+    retarder = _empty_stack(delta, phi)
+    retarder[...,0,0] = 1.
+    retarder[...,1,1] = cos_2phi**2 + sin_2phi**2 * cos_d
+    retarder[...,1,2] = retarder[...,2,1] = cos_2phi * sin_2phi * (1 - cos_d)
+    retarder[...,1,3] = sin_2phi * sin_d
+    retarder[...,2,2] = sin_2phi**2 + cos_2phi**2 * cos_d
+    retarder[...,2,3] = -cos_2phi * sin_d
+    retarder[...,3,1] = -sin_2phi * sin_d
+    retarder[...,3,2] = cos_2phi * sin_d
+    retarder[...,3,3] = cos_d
+    return retarder
 
 def Retarder_degrees(delta, phi_degrees):
     phi = np.deg2rad(phi_degrees)
@@ -66,29 +121,26 @@ def Retarder_wavelengths(d_nm, t, wavelengths):
 
     The resulting array has a shape (L, 4, 4) where L is the length of the
     wavelength array.
+
+    `d_nm`, `t` and `wavelengths` are broadcast against each other, so a whole
+    grid of retarders can be made in one call. For example, `d_nm` with shape
+    (R, 1) and `wavelengths` with shape (L,) give an array of shape
+    (R, L, 4, 4); `t` can likewise be a scalar or have shape (R, 1).
     """
     # Convert the given retardance(s) to radians
-    d_frac = d_nm / wavelengths
+    d_frac = np.divide(d_nm, wavelengths)
     d_rad = d_frac * 2 * np.pi
-    cos_d = np.cos(d_rad)
-    sin_d = np.sin(d_rad)
-
-    # Create an empty array and fill in the Mueller matrix elements
-    stack = np.zeros((len(d_rad), 4, 4))
-    stack[:,0,0] = 1.
-    stack[:,1,1] = 1.
-    stack[:,2,2] = cos_d
-    stack[:,3,3] = cos_d
-    stack[:,3,2] = sin_d
-    stack[:,2,3] = -sin_d
-
-    # Rotate the stack to the angle t
-    stack = rotate_element_degrees(stack, t)
+    t_rad = np.deg2rad(t)
 
-    return stack
+    return Retarder_radians(d_rad, t_rad)
 
 def Filter(attenuation):
-    return attenuation * np.eye(4)
+    """
+    Mueller matrix for a neutral filter.
+    `attenuation` may be an array of any shape, giving a stack with shape
+    (..., 4, 4).
+    """
+    return np.multiply.outer(attenuation, np.eye(4)).astype(get_dtype(), copy=False)
 
 def modulation(wavelengths, source, DoLP, AoLP, delta):
     AoLP_rad = np.deg2rad(AoLP)
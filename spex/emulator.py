@@ -0,0 +1,168 @@
+"""
+Retrieval-error emulator: a precomputed table of DoLP and AoLP retrieval
+errors over normalised Stokes (Q, U) and perturbed instrument parameters,
+with fast N-dimensional interpolation for queries.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from . import stokes
+from .margins import D_err, A_err, simulate_and_retrieve
+from .parallel import _initialise, _call_shared, number_of_jobs
+
+
+def _error_table_cell(wavelengths, parameters, instrument, method, batch_size, cell):
+    """
+    Calculate the DoLP and AoLP errors over the whole parameter grid for a
+    single (Q, U) cell.
+    """
+    i, j, Q, U = cell
+    shape = tuple(len(prange) for prange in parameters.values())
+    DoLP_errors = np.tile(np.nan, shape)
+    AoLP_errors = np.tile(np.nan, shape)
+    if not 0 < Q**2 + U**2 <= 1:
+        return i, j, DoLP_errors, AoLP_errors
+
+    source = stokes.Stokes_nm(np.ones_like(wavelengths), Q, U, 0.)
+    DoLP_real = stokes.DoLP(*source[0]) ; AoLP_real = stokes.AoLP_deg(*source[0])
+
+    # Flatten the parameter grid and evaluate it in batches to limit memory use
+    grid = [prange.ravel() for prange in np.meshgrid(*parameters.values(), indexing="ij")]
+    for start in range(0, DoLP_errors.size, batch_size):
+        batch = np.s_[start:start+batch_size]
+        perturbations = {parameter: values[batch] for parameter, values in zip(parameters, grid)}
+        DoLPs, AoLPs = simulate_and_retrieve(wavelengths, source, instrument, method, **perturbations)
+        DoLP_errors.flat[batch] = D_err(DoLPs, DoLP_real)
+        AoLP_errors.flat[batch] = A_err(AoLPs, AoLP_real)
+
+    return i, j, DoLP_errors, AoLP_errors
+
+
+class ErrorTable(object):
+    """
+    Table of relative DoLP errors and AoLP errors (in degrees) on a regular
+    grid of (Q, U, parameter_1, ..., parameter_N), where the parameters are
+    offsets from the default instrument.
+    Queries are answered by linear interpolation on the grid. Cells without
+    a value (NaN: Q = U = 0, outside the unit disc, or failed retrievals) are
+    left out of the interpolation, and the weights of the other corners are
+    renormalised, so valid queries next to such cells still get a value.
+    """
+    def __init__(self, axes, DoLP_errors, AoLP_errors, instrument="iSPEX2", method="linear"):
+        """
+        Create the object.
+        axes: Dictionary of 1D grids, starting with "Q" and "U".
+        DoLP_errors, AoLP_errors: Arrays with one axis per entry in `axes`.
+        instrument, method: How the table was made (see `spex.margins.simulate_and_retrieve`).
+        """
+        self.axes = {name: np.asarray(axis) for name, axis in axes.items()}
+        self.DoLP_errors = np.asarray(DoLP_errors)
+        self.AoLP_errors = np.asarray(AoLP_errors)
+        self.instrument = instrument
+        self.method = method
+
+        # For each table, interpolate the values with NaN set to 0, and the weights of the valid cells
+        grid = tuple(self.axes.values())
+        self._interpolators = []
+        for errors in (self.DoLP_errors, self.AoLP_errors):
+            valid = np.isfinite(errors)
+            values = RegularGridInterpolator(grid, np.where(valid, errors, 0.), bounds_error=False, fill_value=np.nan)
+            weights = RegularGridInterpolator(grid, valid.astype(np.float64), bounds_error=False, fill_value=np.nan)
+            self._interpolators.append((values, weights))
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        axes = ", ".join(f"{name} [{len(axis)}]" for name, axis in self.axes.items())
+        return f"Retrieval error table for {self.instrument} over {axes}"
+
+
+    @property
+    def parameters(self):
+        """
+        Names of the instrument parameters in this table.
+        """
+        return list(self.axes)[2:]
+
+
+    @classmethod
+    def build(cls, wavelengths, Qrange, Urange, parameters, instrument="iSPEX2", method="linear", batch_size=250, n_jobs=1):
+        """
+        Calculate a table of retrieval errors.
+        `parameters` is a dictionary with the grid of offsets for each
+        instrument parameter, e.g. {"MOR1_t": np.linspace(-9, 9, 37)}.
+        The (Q, U) cells are spread over `n_jobs` processes (-1 for all CPUs).
+        Cells outside the unit disc, or with Q = U = 0, are NaN.
+        """
+        Qrange = np.asarray(Qrange, dtype=np.float64) ; Urange = np.asarray(Urange, dtype=np.float64)
+        parameters = {parameter: np.asarray(prange, dtype=np.float64) for parameter, prange in parameters.items()}
+
+        shape = (len(Qrange), len(Urange)) + tuple(len(prange) for prange in parameters.values())
+        DoLP_errors = np.tile(np.nan, shape).astype(np.float32)
+        AoLP_errors = DoLP_errors.copy()
+
+        cells = [(i, j, Q, U) for i, Q in enumerate(Qrange) for j, U in enumerate(Urange)]
+        shared = (wavelengths, parameters, instrument, method, batch_size)
+
+        n_jobs = number_of_jobs(n_jobs)
+        if n_jobs == 1:
+            results = (_error_table_cell(*shared, cell) for cell in cells)
+            for i, j, D, A in results:
+                DoLP_errors[i,j] = D ; AoLP_errors[i,j] = A
+        else:
+            with ProcessPoolExecutor(n_jobs, initializer=_initialise, initargs=(shared,)) as pool:
+                for i, j, D, A in pool.map(partial(_call_shared, _error_table_cell), cells):
+                    DoLP_errors[i,j] = D ; AoLP_errors[i,j] = A
+
+        axes = {"Q": Qrange, "U": Urange, **parameters}
+        return cls(axes, DoLP_errors, AoLP_errors, instrument=instrument, method=method)
+
+
+    def save(self, filename):
+        """
+        Save the table to a compressed .npz file, with the errors in float32.
+        """
+        arrays = {f"axis_{name}": axis for name, axis in self.axes.items()}
+        np.savez_compressed(filename, DoLP_errors=self.DoLP_errors.astype(np.float32), AoLP_errors=self.AoLP_errors.astype(np.float32),
+                            axis_names=np.array(list(self.axes)), instrument=self.instrument, method=self.method, **arrays)
+
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a table saved with `save`.
+        """
+        with np.load(filename) as data:
+            axes = {str(name): data[f"axis_{name}"] for name in data["axis_names"]}
+            return cls(axes, data["DoLP_errors"], data["AoLP_errors"], instrument=str(data["instrument"]), method=str(data["method"]))
+
+
+    def __call__(self, Q, U, **parameters):
+        """
+        Interpolate the DoLP and AoLP errors at the given (Q, U) and parameter
+        offsets. All arguments are broadcast against each other; parameters
+        that are not given are taken as 0 (the default instrument).
+        Points outside the table or outside the unit disc (Q**2 + U**2 > 1),
+        and points whose surrounding cells are all empty, give NaN.
+        """
+        unknown = set(parameters) - set(self.parameters)
+        if unknown:
+            raise TypeError(f"Parameter(s) not in this table: {', '.join(sorted(unknown))}")
+
+        values = [Q, U] + [parameters.get(parameter, 0.) for parameter in self.parameters]
+        points = np.stack(np.broadcast_arrays(*values), axis=-1)
+        shape = points.shape[:-1]
+        points = points.reshape(-1, len(values))
+        outside_disc = points[:,0]**2 + points[:,1]**2 > 1
+
+        results = []
+        for values, weights in self._interpolators:
+            total = weights(points)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result = values(points) / total
+            result[(total < 1e-9) | outside_disc] = np.nan
+            results.append(result.reshape(shape))
+        return tuple(results)
@@ -1,60 +1,145 @@
-import pol
 import numpy as np
-from inspect import signature
+from functools import lru_cache
 from scipy.optimize import curve_fit
+from . import elements
+from .parallel import chunked_map
+from .precision import precision
+from .resolution import convolve_lsf
+from .train import OpticalTrain, Retarder, Polarizer, propagate_intensity
 
-def simulate_iSPEX(wavelengths, source, QWP_d=140., QWP_t=0., MOR1_d=2240., MOR1_t=-45., MOR2_d=2240., MOR2_t=-45., POL_t=0.):
-    QWP = pol.Retarder_wavelengths(QWP_d, QWP_t, wavelengths)
-    MOR1= pol.Retarder_wavelengths(MOR1_d, MOR1_t, wavelengths)
-    MOR2= pol.Retarder_wavelengths(MOR2_d, MOR2_t, wavelengths)
-    POL = pol.LinPol_deg(POL_t)
+iSPEX_DEFAULTS = dict(QWP_d=140., QWP_t=0., MOR1_d=2240., MOR1_t=-45., MOR2_d=2240., MOR2_t=-45., POL_t=0.)
+iSPEX2_DEFAULTS = dict(QWP_d=140., QWP_t=0., MOR1_d=2240., MOR1_t=-45., MOR2_d=2240., MOR2_t=-45., POL0_t=0., POL90_t=90.)
 
-    after_QWP = np.einsum("wij,wj->wi", QWP , source    )
-    after_MOR1= np.einsum("wij,wj->wi", MOR1, after_QWP )
-    after_MOR2= np.einsum("wij,wj->wi", MOR2, after_MOR1)
-    after_POL = np.einsum( "ij,wj->wi", POL , after_MOR2)
+def _build_iSPEX_train(QWP_d, QWP_t, MOR1_d, MOR1_t, MOR2_d, MOR2_t, POL_t):
+    return OpticalTrain([Retarder(QWP_d, QWP_t), Retarder(MOR1_d, MOR1_t), Retarder(MOR2_d, MOR2_t), Polarizer(POL_t)])
 
-    return after_POL.T  # transpose to split I, Q, U, V if wanted
+_cached_iSPEX_train = lru_cache(maxsize=64)(_build_iSPEX_train)
 
-def simulate_iSPEX2(wavelengths, source, QWP_d=140., QWP_t=0., MOR1_d=2240., MOR1_t=-45., MOR2_d=2240., MOR2_t=-45., POL0_t=0., POL90_t=90.):
-    QWP  = pol.Retarder_wavelengths(QWP_d, QWP_t, wavelengths)
-    MOR1 = pol.Retarder_wavelengths(MOR1_d, MOR1_t, wavelengths)
-    MOR2 = pol.Retarder_wavelengths(MOR2_d, MOR2_t, wavelengths)
-    POL0 = pol.LinPol_deg(POL0_t )
-    POL90= pol.LinPol_deg(POL90_t)
+def iSPEX_train(QWP_d=140., QWP_t=0., MOR1_d=2240., MOR1_t=-45., MOR2_d=2240., MOR2_t=-45., POL_t=0.):
+    """
+    Optical train for iSPEX: QWP, two multi-order retarders and a polarizer.
+    Trains with scalar parameters are cached, so that repeated simulations
+    with the same instrument re-use the system Mueller matrix. Parameters may
+    also be arrays, e.g. a retardance per wavelength; those trains are built
+    anew every time.
+    """
+    parameters = (QWP_d, QWP_t, MOR1_d, MOR1_t, MOR2_d, MOR2_t, POL_t)
+    if all(np.ndim(p) == 0 for p in parameters):
+        return _cached_iSPEX_train(*parameters)
+    return _build_iSPEX_train(*parameters)
 
-    after_QWP  = np.einsum("wij,wj->wi", QWP , source    )
-    after_MOR1 = np.einsum("wij,wj->wi", MOR1, after_QWP )
-    after_MOR2 = np.einsum("wij,wj->wi", MOR2, after_MOR1)
-    after_POL0 = np.einsum( "ij,wj->wi", POL0 , after_MOR2)
-    after_POL90= np.einsum( "ij,wj->wi", POL90, after_MOR2)
+def simulate_iSPEX(wavelengths, source, QWP_d=140., QWP_t=0., MOR1_d=2240., MOR1_t=-45., MOR2_d=2240., MOR2_t=-45., POL_t=0., fwhm=None):
+    train = iSPEX_train(QWP_d, QWP_t, MOR1_d, MOR1_t, MOR2_d, MOR2_t, POL_t)
+    after_POL = train.propagate(wavelengths, source)
 
-    return after_POL0[:,0], after_POL90[:,0]  # transpose to split I, Q, U, V if wanted
+    after_POL = np.moveaxis(after_POL, -1, 0)  # split I, Q, U, V if wanted
+    return convolve_lsf(wavelengths, after_POL, fwhm)  # finite spectral resolution, if `fwhm` is given
+
+def simulate_iSPEX2(wavelengths, source, QWP_d=140., QWP_t=0., MOR1_d=2240., MOR1_t=-45., MOR2_d=2240., MOR2_t=-45., POL0_t=0., POL90_t=90., fwhm=None):
+    train0  = iSPEX_train(QWP_d, QWP_t, MOR1_d, MOR1_t, MOR2_d, MOR2_t, POL0_t )
+    train90 = iSPEX_train(QWP_d, QWP_t, MOR1_d, MOR1_t, MOR2_d, MOR2_t, POL90_t)
+    I0 = train0 .propagate_intensity(wavelengths, source)
+    I90= train90.propagate_intensity(wavelengths, source)
+    if fwhm is not None:  # finite spectral resolution; both channels in one convolution
+        I0, I90 = convolve_lsf(wavelengths, np.stack([I0, I90]), fwhm)
+
+    return I0, I90
+
+def _sweep_parameters(defaults, perturbations):
+    """
+    Add arrays of `perturbations` to the `defaults` of an instrument.
+    The perturbations are broadcast against each other; an axis is added at
+    the end of each parameter so it also broadcasts with the wavelengths.
+    Returns the broadcast shape of the sweep and a dictionary of parameters.
+    """
+    unknown = set(perturbations) - set(defaults)
+    if unknown:
+        raise TypeError(f"Unknown instrument parameter(s): {', '.join(sorted(unknown))}")
+
+    parameters = {key: np.add(default, perturbations.get(key, 0.)) for key, default in defaults.items()}
+    shape = np.broadcast_shapes(*[p.shape for p in parameters.values()])
+    parameters = {key: value[...,np.newaxis] for key, value in parameters.items()}
+    return shape, parameters
+
+def simulate_iSPEX_sweep(wavelengths, source, fwhm=None, dtype=None, **perturbations):
+    """
+    Simulate the intensity measured by iSPEX for a whole sweep of instrument
+    perturbations at once.
+    Each keyword argument (e.g. `QWP_d`, `MOR1_t`) is an array of offsets
+    from the default value of that parameter. The arrays are broadcast
+    against each other, so perturbing several parameters jointly or on a grid
+    is possible. The result has a shape (S..., L) where S... is the
+    broadcast shape of the perturbations and L the number of wavelengths.
+    If `fwhm` is given, the result is convolved with the line-spread function
+    (see `spex.resolution.convolve_lsf`).
+    `dtype` (np.float32 or np.float64) overrides the working precision (see
+    `spex.precision`).
+    """
+    _, p = _sweep_parameters(iSPEX_DEFAULTS, perturbations)
+
+    with precision(dtype):
+        QWP = elements.Retarder_wavelengths(p["QWP_d"], p["QWP_t"], wavelengths)
+        MOR1= elements.Retarder_wavelengths(p["MOR1_d"], p["MOR1_t"], wavelengths)
+        MOR2= elements.Retarder_wavelengths(p["MOR2_d"], p["MOR2_t"], wavelengths)
+        POL = elements.Linear_polarizer_degrees(p["POL_t"])
+
+    return convolve_lsf(wavelengths, propagate_intensity([QWP, MOR1, MOR2, POL], source), fwhm)
+
+def simulate_iSPEX2_sweep(wavelengths, source, fwhm=None, dtype=None, **perturbations):
+    """
+    Simulate the intensities measured by iSPEX 2 in both channels for a whole
+    sweep of instrument perturbations at once.
+    See `simulate_iSPEX_sweep`; the polarizer parameters are `POL0_t` and
+    `POL90_t`. Returns two arrays of shape (S..., L).
+    """
+    shape, p = _sweep_parameters(iSPEX2_DEFAULTS, perturbations)
+
+    with precision(dtype):
+        QWP = elements.Retarder_wavelengths(p["QWP_d"], p["QWP_t"], wavelengths)
+        MOR1= elements.Retarder_wavelengths(p["MOR1_d"], p["MOR1_t"], wavelengths)
+        MOR2= elements.Retarder_wavelengths(p["MOR2_d"], p["MOR2_t"], wavelengths)
+        # Both polarizers in one stack, with the channel as the first axis, in front of the sweep and source axes
+        batch = np.broadcast_shapes(shape, np.shape(source)[:-2]) + (1,)
+        POL_t = np.stack([np.broadcast_to(p["POL0_t"], batch), np.broadcast_to(p["POL90_t"], batch)])
+        POL = elements.Linear_polarizer_degrees(POL_t)
+
+    I0, I90 = convolve_lsf(wavelengths, propagate_intensity([QWP, MOR1, MOR2, POL], source), fwhm)
+    return I0, I90
 
 def simulate_iSPEX_error(wavelengths, source, parameter, prange):
-    default = signature(simulate_iSPEX).parameters[parameter].default
-    kwargs_list = [{parameter: default + p} for p in prange]
-    Is = np.array([simulate_iSPEX(wavelengths, source, **kwargs)[0] for kwargs in kwargs_list])
+    Is = simulate_iSPEX_sweep(wavelengths, source, **{parameter: prange})
     return Is
 
 def simulate_iSPEX2_error(wavelengths, source, parameter, prange):
-    default = signature(simulate_iSPEX2).parameters[parameter].default
-    kwargs_list = [{parameter: default + p} for p in prange]
-    I0s, I90s = zip(*[simulate_iSPEX2(wavelengths, source, **kwargs) for kwargs in kwargs_list])
-    I0s = np.array(I0s) ; I90s = np.array(I90s)
+    I0s, I90s = simulate_iSPEX2_sweep(wavelengths, source, **{parameter: prange})
     return I0s, I90s
 
 def retrieve_DoLP(wavelengths, source, I, delta=4480):
-    mod_source = lambda wvl, DoLP, AoLP: pol.modulation(wvl, source[:,0], DoLP, AoLP, delta)
+    mod_source = lambda wvl, DoLP, AoLP: elements.modulation(wvl, source[:,0], DoLP, AoLP, delta)
     dolp_init = I.max() - I.min()
     popt, pcov = curve_fit(mod_source, wavelengths, I, bounds=([0, -90], [1, 90]), p0=[dolp_init,0])
     DoLP, AoLP = popt
-    if AoLP <= -89.9:
-        AoLP += 180
+    AoLP = _wrap_AoLP(AoLP)[()]
     return DoLP, AoLP
 
-def retrieve_DoLP_many(wavelengths, source, Is, **kwargs):
-    DoLPs, AoLPs = np.array([retrieve_DoLP(wavelengths, source, I, **kwargs) for I in Is]).T
+def _wrap_AoLP(AoLP):
+    """
+    Move AoLPs at the lower edge of the fit range (<= -89.9 degrees) to the
+    upper edge, so that all retrievals report AoLPs near +-90 the same way.
+    """
+    return np.where(AoLP <= -89.9, AoLP + 180, AoLP)
+
+def _retrieve_DoLP_chunk(wavelengths, source, kwargs, Is):
+    return np.array([retrieve_DoLP(wavelengths, source, I, **kwargs) for I in Is]).reshape(-1, 2)
+
+def retrieve_DoLP_many(wavelengths, source, Is, n_jobs=1, executor=None, **kwargs):
+    """
+    Retrieve DoLP and AoLP from each spectrum in `Is` with `retrieve_DoLP`.
+    The fits can be spread over `n_jobs` processes (-1 for all CPUs) or over
+    an existing `executor` with `n_jobs` workers, in chunks (see
+    `spex.parallel.chunked_map`); the output order does not change.
+    """
+    DoLPs, AoLPs = chunked_map(_retrieve_DoLP_chunk, np.asarray(Is), shared=(wavelengths, source, kwargs), n_jobs=n_jobs, executor=executor).T
     return DoLPs, AoLPs
 
 def _correct_AoLP90(A90):
@@ -64,19 +149,25 @@ def _correct_AoLP90(A90):
     return A
 
 def _merge_DoLP_AoLP(D0, D90, A0, A90):
-    A = np.stack([A0, A90]).mean(axis=0)
-    D = np.stack([D0, D90]).mean(axis=0)
-    use_0 = np.where((A0 > -5) & (A0 <  5))
-    use_90= np.where((A90> 85) | (A90<-85))
+    A = np.asarray(np.stack([A0, A90]).mean(axis=0))
+    D = np.asarray(np.stack([D0, D90]).mean(axis=0))
+    use_0 = (A0 > -5) & (A0 <  5)
+    use_90= (A90> 85) | (A90<-85)
     A[use_0] = A0 [use_0]
     D[use_0] = D0 [use_0]
     A[use_90]= A90[use_90]
     D[use_90]= D90[use_90]
     return D, A
 
-def retrieve_DoLP_many2(wavelengths, source, I0s, I90s, **kwargs):
-    DoLPs0 , AoLPs0  = np.array([retrieve_DoLP(wavelengths, source, I, **kwargs) for I in I0s ]).T
-    DoLPs90, AoLPs90 = np.array([retrieve_DoLP(wavelengths, source, I, **kwargs) for I in I90s]).T
+def retrieve_DoLP_many2(wavelengths, source, I0s, I90s, n_jobs=1, executor=None, **kwargs):
+    """
+    Retrieve DoLP and AoLP from pairs of iSPEX 2 spectra, fitting both
+    channels separately and merging the results.
+    See `retrieve_DoLP_many` for the parallelisation options.
+    """
+    DoLPs, AoLPs = retrieve_DoLP_many(wavelengths, source, np.concatenate([I0s, I90s]), n_jobs=n_jobs, executor=executor, **kwargs)
+    DoLPs0 , DoLPs90 = np.split(DoLPs, 2)
+    AoLPs0 , AoLPs90 = np.split(AoLPs, 2)
     AoLPs90 = _correct_AoLP90(AoLPs90)
     D, A = _merge_DoLP_AoLP(DoLPs0, DoLPs90, AoLPs0, AoLPs90)
     return D, A
\ No newline at end of file
@@ -0,0 +1,298 @@
+"""
+Tolerance margins: how far an instrument parameter can be perturbed before
+the retrieved DoLP or AoLP exceeds a given error.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+import numpy as np
+from . import stokes
+from .ispex import simulate_iSPEX_sweep, simulate_iSPEX2_sweep, retrieve_DoLP_many, retrieve_DoLP_many2
+from .parallel import _initialise, _call_shared, number_of_jobs
+from .retrieval import retrieve_DoLP_linear, retrieve_DoLP_linear2, retrieve_DoLP_joint
+
+
+def D_err(D, D_real):
+    return D/D_real - 1
+
+def A_err(A, A_real):
+    diff1 = np.abs(A - A_real)
+    diff2 = np.abs(A - A_real + 180)
+    diff3 = np.abs(A - A_real - 180)
+    diff = np.stack((diff1, diff2, diff3)).min(axis=0)
+    return diff
+
+def margin(x, DoLPs, AoLPs, real_DoLP, real_AoLP, Dlim=0.03, Alim=5):
+    D = D_err(DoLPs, real_DoLP)
+    A = A_err(AoLPs, real_AoLP)
+
+    D_ind = np.where(np.abs(D) > Dlim)
+    A_ind = np.where(np.abs(A) > Alim)
+
+    try:
+        D_min = np.abs(x[D_ind]).min()
+    except ValueError:
+        D_min = np.abs(x).max()
+    try:
+        A_min = np.abs(x[A_ind]).min()
+    except ValueError:
+        A_min = np.abs(x).max()
+
+    x_min = np.min([D_min, A_min])
+
+    return x_min
+
+
+def find_margin(exceeds, xmax, tolerance=None, nr_bracket=4, guess=None):
+    """
+    Find the smallest |x| <= `xmax` for which `exceeds(x)` is True, on both
+    sides of zero, by bracketing and bisection.
+    `exceeds` takes an array of x values and returns a boolean array; all
+    points in one step are evaluated in a single call.
+
+    First, x = 0 and `nr_bracket` evenly spaced points on either side are
+    evaluated. On each side, the interval between the last point within the
+    limits and the first point exceeding them is then bisected until it is
+    smaller than `tolerance` (default: `xmax` / 1000).
+    Like `margin`, returns `xmax` if the limits are never exceeded, and the
+    first x found to exceed them otherwise.
+
+    A crossing that starts and ends between two bracketing points is missed;
+    increase `nr_bracket` if the error is strongly non-monotonic.
+
+    A `guess` of the margin (e.g. from `spex.sensitivity.first_order_guesses`)
+    adds bracketing points just below and above it, so that a good guess
+    leaves only a short interval to bisect. The evenly spaced points are
+    always evaluated too, so a poor guess does not change the result.
+    """
+    if tolerance is None:
+        tolerance = xmax / 1000.
+
+    # Coarse bracketing on both sides of zero
+    steps = xmax * np.arange(1, nr_bracket+1) / nr_bracket
+    if guess is not None and 0 < guess < xmax:
+        steps = np.union1d(steps, np.clip(guess * np.array([0.9, 1.1]), 0, xmax))
+    bad = exceeds(np.concatenate([[0.], steps, -steps]))
+    if bad[0]:
+        return 0.
+    bad = np.reshape(bad[1:], (2, len(steps)))
+
+    signs = np.array([1., -1.])
+    low = np.zeros(2)
+    high = np.tile(np.nan, 2)
+    for side in range(2):
+        if bad[side].any():
+            first = np.argmax(bad[side])
+            high[side] = steps[first]
+            low[side] = steps[first-1] if first > 0 else 0.
+
+    # Bisect the brackets that were found, both sides at once
+    while True:
+        active = np.where(~np.isnan(high) & (high - low > tolerance))[0]
+        if len(active) == 0:
+            break
+        middle = 0.5 * (low[active] + high[active])
+        bad_middle = exceeds(signs[active] * middle)
+        high[active] = np.where(bad_middle, middle, high[active])
+        low[active] = np.where(bad_middle, low[active], middle)
+
+    margins = np.where(np.isnan(high), xmax, high)
+    return margins.min()
+
+
+def margin_adaptive(wavelengths, source, parameter, xmax, instrument="iSPEX2", method="linear", Dlim=0.03, Alim=5, tolerance=None, nr_bracket=4, guess=None):
+    """
+    Find the margin on an instrument `parameter`, like `margin` applied to a
+    dense sweep from -`xmax` to `xmax`, but with `find_margin` so that only
+    a few batches of simulations and retrievals are needed.
+    `guess` is passed on to `find_margin` to seed the bracketing.
+    """
+    DoLP_real = stokes.DoLP(*source[0]) ; AoLP_real = stokes.AoLP_deg(*source[0])
+
+    def exceeds(x):
+        DoLPs, AoLPs = simulate_and_retrieve(wavelengths, source, instrument, method, **{parameter: x})
+        return (np.abs(D_err(DoLPs, DoLP_real)) > Dlim) | (np.abs(A_err(AoLPs, AoLP_real)) > Alim)
+
+    return find_margin(exceeds, xmax, tolerance=tolerance, nr_bracket=nr_bracket, guess=guess)
+
+
+def retrieval_function(instrument="iSPEX2", method="linear"):
+    """
+    The DoLP/AoLP retrieval function for an `instrument` ("iSPEX" or
+    "iSPEX2") and `method`: "linear" for the closed-form retrieval, "joint"
+    for the closed-form retrieval fitting both iSPEX 2 channels together (the
+    same as "linear" for iSPEX), or "curve_fit" for the per-spectrum fits in
+    `spex.ispex`.
+    For iSPEX it is called as `f(wavelengths, source, Is)`, for iSPEX 2 as
+    `f(wavelengths, source, I0s, I90s)`.
+    """
+    if method not in ("linear", "joint", "curve_fit"):
+        raise ValueError(f"Unknown retrieval method: {method}")
+
+    if instrument == "iSPEX":
+        return retrieve_DoLP_many if method == "curve_fit" else retrieve_DoLP_linear
+    elif instrument == "iSPEX2":
+        return {"linear": retrieve_DoLP_linear2, "joint": retrieve_DoLP_joint, "curve_fit": retrieve_DoLP_many2}[method]
+    else:
+        raise ValueError(f"Unknown instrument: {instrument}")
+
+
+def simulate_and_retrieve(wavelengths, source, instrument="iSPEX2", method="linear", **perturbations):
+    """
+    Simulate a sweep of instrument perturbations (see `simulate_iSPEX_sweep`)
+    for the given `instrument` ("iSPEX" or "iSPEX2") and retrieve DoLP and
+    AoLP from the results with `method` (see `retrieval_function`).
+    """
+    retrieve = retrieval_function(instrument, method)
+    if instrument == "iSPEX":
+        Is = simulate_iSPEX_sweep(wavelengths, source, **perturbations)
+        return retrieve(wavelengths, source, Is)
+    else:
+        I0s, I90s = simulate_iSPEX2_sweep(wavelengths, source, **perturbations)
+        return retrieve(wavelengths, source, I0s, I90s)
+
+
+def _margin_cell(wavelengths, parameters, instrument, method, Dlim, Alim, adaptive, cell):
+    """
+    Calculate the margins for every parameter at a single (Q, U) grid cell.
+    """
+    i, j, Q, U = cell
+    source = stokes.Stokes_nm(np.ones_like(wavelengths), Q, U, 0.)
+    DoLP_real = stokes.DoLP(*source[0]) ; AoLP_real = stokes.AoLP_deg(*source[0])
+
+    margins = np.tile(np.nan, len(parameters))
+    for k, (parameter, prange) in enumerate(parameters.items()):
+        if adaptive:
+            margins[k] = margin_adaptive(wavelengths, source, parameter, np.abs(prange).max(), instrument, method, Dlim=Dlim, Alim=Alim)
+        else:
+            DoLPs, AoLPs = simulate_and_retrieve(wavelengths, source, instrument, method, **{parameter: prange})
+            margins[k] = margin(prange, DoLPs, AoLPs, DoLP_real, AoLP_real, Dlim=Dlim, Alim=Alim)
+
+    return i, j, margins
+
+
+class MarginCheckpoint(object):
+    """
+    On-disk store of finished (Q, U) grid cells, so that an interrupted
+    margin-map run can be resumed.
+    Every cell is saved as a separate .npy file; a small JSON file describes
+    the grid and parameters so that a checkpoint is not re-used for a
+    different run.
+    """
+    def __init__(self, folder, description):
+        """
+        Create the object.
+        folder: Folder in which the cells are stored. Created if necessary.
+        description: JSON-serialisable description of the run.
+        """
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.filename_description = self.folder/"margin_map.json"
+
+        if self.filename_description.exists():
+            existing = json.loads(self.filename_description.read_text())
+            if existing != description:
+                raise ValueError(f"Checkpoint folder {self.folder} belongs to a different margin map")
+        else:
+            self.filename_description.write_text(json.dumps(description))
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return f"Margin-map checkpoint in {self.folder}"
+
+
+    def _filename(self, i, j):
+        return self.folder/f"cell_{i}_{j}.npy"
+
+
+    def load(self, i, j):
+        """
+        Load the margins for cell (i, j), or None if it has not been done.
+        """
+        try:
+            return np.load(self._filename(i, j))
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+
+
+    def save(self, i, j, margins):
+        """
+        Save the margins for cell (i, j). The file is written under a
+        temporary name first, so a crash cannot leave a partial file.
+        """
+        filename = self._filename(i, j)
+        filename_temporary = filename.with_suffix(".tmp.npy")
+        np.save(filename_temporary, margins)
+        os.replace(filename_temporary, filename)
+
+
+def margin_map(wavelengths, Qrange, Urange, parameters, instrument="iSPEX2", method="linear", Dlim=0.03, Alim=5, adaptive=False, checkpoint=None, n_jobs=1, verbose=False):
+    """
+    Calculate tolerance margins for instrument parameters over a grid of
+    normalised Stokes (Q, U) values.
+
+    `parameters` is a dictionary with the perturbation ranges to sweep for
+    each parameter, e.g. {"QWP_d": np.linspace(-15, 15, 100), ...}.
+    Grid cells outside the unit disc, or with Q = U = 0, are NaN.
+    If `adaptive` is True, only the extent of each range is used and the
+    margins are found with `margin_adaptive` instead of a dense sweep.
+
+    The cells are spread over `n_jobs` processes (-1 for all CPUs). If a
+    `checkpoint` folder is given, every finished cell is saved there and
+    cells that were already finished are loaded instead of re-calculated.
+
+    Returns a dictionary with a (len(Qrange), len(Urange)) array of margins
+    for each parameter.
+    """
+    Qrange = np.asarray(Qrange, dtype=np.float64) ; Urange = np.asarray(Urange, dtype=np.float64)
+    parameters = {parameter: np.asarray(prange, dtype=np.float64) for parameter, prange in parameters.items()}
+    result = np.tile(np.nan, (len(parameters), len(Qrange), len(Urange)))
+
+    if checkpoint is not None:
+        description = {"wavelengths": [float(wavelengths[0]), float(wavelengths[-1]), len(wavelengths)],
+                       "Q": Qrange.tolist(), "U": Urange.tolist(),
+                       "parameters": {parameter: prange.tolist() for parameter, prange in parameters.items()},
+                       "instrument": instrument, "method": method, "Dlim": Dlim, "Alim": Alim, "adaptive": adaptive}
+        checkpoint = MarginCheckpoint(checkpoint, description)
+
+    # Find the cells that still need to be calculated
+    cells = []
+    for i, Q in enumerate(Qrange):
+        for j, U in enumerate(Urange):
+            if not 0 < Q**2 + U**2 <= 1:
+                continue
+            margins = None if checkpoint is None else checkpoint.load(i, j)
+            if margins is None:
+                cells.append((i, j, Q, U))
+            else:
+                result[:,i,j] = margins
+
+    if verbose:
+        print(f"Margin map: {len(cells)} cells to calculate")
+
+    def _store(i, j, margins):
+        result[:,i,j] = margins
+        if checkpoint is not None:
+            checkpoint.save(i, j, margins)
+
+    shared = (wavelengths, parameters, instrument, method, Dlim, Alim, adaptive)
+    n_jobs = number_of_jobs(n_jobs)
+    if n_jobs == 1:
+        for k, cell in enumerate(cells):
+            _store(*_margin_cell(*shared, cell))
+            if verbose:
+                print(f"{100*(k+1)/len(cells):.1f}%", end="\r")
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=_initialise, initargs=(shared,)) as pool:
+            futures = [pool.submit(partial(_call_shared, _margin_cell), cell) for cell in cells]
+            for k, future in enumerate(as_completed(futures)):
+                _store(*future.result())
+                if verbose:
+                    print(f"{100*(k+1)/len(cells):.1f}%", end="\r")
+
+    return dict(zip(parameters, result))
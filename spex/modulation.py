@@ -1,8 +1,82 @@
+"""
+Matrix-based modulation and demodulation for multi-channel polarimeters.
+
+The modulation matrix of a polarimeter maps the incoming Stokes vector onto
+the intensities in its channels; at every wavelength, its rows are the first
+rows of the system Mueller matrices of the channels. The demodulation matrix
+is its pseudo-inverse. For a whole wavelength grid, these are stacks with
+shapes (L, channels, 4) and (L, 4, channels), so that demodulating a stack
+of measurements is a single matrix product per wavelength.
+"""
 import numpy as np
+from .cache import LRUCache, wavelength_fingerprint
+from .train import OpticalTrain
+
+# Demodulation matrices, keyed on (modulation matrix, components, rcond)
+_demodulation_cache = LRUCache(maxsize=32)
+
+
+def _first_row(channel, wavelengths):
+    """
+    First row of the system Mueller matrix of one channel, with shape (L, 4)
+    or (4,). A channel is an `OpticalTrain`, a list of Mueller matrices (first
+    element first), or a system Mueller matrix (..., 4, 4).
+    """
+    if isinstance(channel, OpticalTrain):
+        return channel.intensity_row(wavelengths)
+
+    if isinstance(channel, (list, tuple)):
+        row = np.array([1., 0., 0., 0.])
+        for matrix in channel[::-1]:
+            row = np.einsum("...i,...ij->...j", row, matrix)
+        return row
+
+    return np.asarray(channel)[...,0,:]
+
+
+def Modulation_matrix(polarimeter, wavelengths=None):
+    """
+    Modulation matrices (L, channels, 4) for a `polarimeter`, given as a list
+    of channels (see `_first_row`). `wavelengths` are needed for channels
+    that are `OpticalTrain`s.
+    Channels without a wavelength dependence are broadcast over the others.
+    """
+    rows = [_first_row(channel, wavelengths) for channel in polarimeter]
+    rows = np.broadcast_arrays(*rows)
+    return np.stack(rows, axis=-2)
+
+
+def Demodulation_matrix(modulation_matrix, components=None, rcond=1e-15):
+    """
+    Demodulation matrices (L, 4, channels) for a stack of modulation matrices
+    (L, channels, 4), from one batched pseudo-inverse (SVD).
+    `components` selects the Stokes components to solve for, e.g. (0, 1, 2)
+    to assume V = 0 with three channels; the others are 0 in the result.
+    The result is cached on the modulation matrices.
+    """
+    modulation_matrix = np.asarray(modulation_matrix, dtype=np.float64)
+    components = tuple(range(4)) if components is None else tuple(components)
+
+    def build():
+        demodulation_matrix = np.zeros(modulation_matrix.shape[:-2] + (4, modulation_matrix.shape[-2]))
+        demodulation_matrix[...,components,:] = np.linalg.pinv(modulation_matrix[...,components], rcond=rcond)
+        return demodulation_matrix
+
+    key = (wavelength_fingerprint(modulation_matrix), modulation_matrix.shape, components, rcond)
+    return _demodulation_cache.get(key, build)
+
+
+def modulate(modulation_matrix, source):
+    """
+    Intensities (..., channels, L) in every channel for a `source` Stokes
+    vector (L, 4) or a stack of them (..., L, 4).
+    """
+    return np.einsum("lcs,...ls->...cl", modulation_matrix, source)
 
-def Modulation_matrix(polarimeter):
-    # take first row of each Mueller matrix in `polarimeter'
-    pass
 
-def Demodulation_matrix(modulation_matrix):
-    return np.linalg.pinv(modulation_matrix)
+def demodulate(demodulation_matrix, measurements):
+    """
+    Stokes vectors (..., L, 4) from a stack of `measurements` with shape
+    (..., channels, L), in a single matrix product.
+    """
+    return np.einsum("lsc,...cl->...ls", demodulation_matrix, measurements)
@@ -0,0 +1,257 @@
+"""
+Joint Monte Carlo tolerance analysis: all instrument parameters are drawn
+together from given distributions, and the resulting DoLP/AoLP errors are
+summarised with streaming statistics so that no samples need to be kept.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from . import stokes
+from .margins import D_err, A_err, simulate_and_retrieve
+from .parallel import _initialise, _call_shared, number_of_jobs
+
+
+class StreamingStatistics(object):
+    """
+    Running count, mean, variance, extremes and histogram of a stream of
+    values. Quantiles are interpolated from the histogram, so their accuracy
+    is set by the number of bins within `range`; values outside `range` are
+    counted in the outermost bins.
+    Statistics from different streams (e.g. different workers) can be merged.
+    """
+    def __init__(self, range, bins=10000):
+        """
+        Create the object.
+        range: (lower, upper) limits of the histogram.
+        bins: Number of histogram bins.
+        """
+        self.range = tuple(range)
+        self.edges = np.linspace(*self.range, bins+1)
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.count = 0
+        self.mean = 0.
+        self._M2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return f"Statistics of {self.count} values: mean {self.mean:.4g}, standard deviation {self.std:.4g}"
+
+
+    @property
+    def variance(self):
+        return self._M2 / (self.count - 1) if self.count > 1 else np.nan
+
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+    def _combine(self, count, mean, M2):
+        """
+        Combine the moments of another set of values with these (Chan et al.).
+        """
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self._M2 += M2 + delta**2 * self.count * count / total
+        self.count = total
+
+
+    def update(self, values):
+        """
+        Add an array of values. Non-finite values are ignored.
+        """
+        values = np.ravel(values)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+
+        mean = values.mean()
+        self._combine(len(values), mean, np.sum((values - mean)**2))
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        indices = np.clip(np.searchsorted(self.edges, values, side="right") - 1, 0, len(self.histogram)-1)
+        self.histogram += np.bincount(indices, minlength=len(self.histogram))
+
+
+    def merge(self, other):
+        """
+        Add the statistics of `other`, which must have the same histogram bins.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge statistics with different histogram bins")
+        if other.count == 0:
+            return
+
+        self._combine(other.count, other.mean, other._M2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.histogram += other.histogram
+
+
+    def quantile(self, q):
+        """
+        Approximate quantile(s) `q` (between 0 and 1) from the histogram.
+        """
+        cumulative = np.concatenate([[0], np.cumsum(self.histogram)]) / max(self.count, 1)
+        # Use the true extremes instead of the histogram limits where possible
+        edges = self.edges.copy()
+        edges[0] = max(edges[0], min(self.min, edges[1]))
+        edges[-1] = min(edges[-1], max(self.max, edges[-2]))
+        return np.interp(q, cumulative, edges)
+
+
+class ToleranceStatistics(object):
+    """
+    Streaming statistics of DoLP and AoLP errors, and the fraction of samples
+    in which either exceeds its limit.
+    """
+    def __init__(self, Dlim=0.03, Alim=5, bins=10000):
+        """
+        Create the object.
+        Dlim: Limit on the relative DoLP error.
+        Alim: Limit on the AoLP error in degrees.
+        bins: Number of histogram bins used for quantiles.
+        """
+        self.Dlim = Dlim
+        self.Alim = Alim
+        self.DoLP = StreamingStatistics((-1., 1.), bins=bins)
+        self.AoLP = StreamingStatistics((0., 90.), bins=bins)
+        self.count = 0
+        self.failures = 0
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return f"Tolerance statistics of {self.count} samples: failure rate {self.failure_rate:.2%}"
+
+
+    @property
+    def failure_rate(self):
+        return self.failures / self.count if self.count else np.nan
+
+
+    def update(self, DoLP_errors, AoLP_errors):
+        """
+        Add a batch of relative DoLP errors and absolute AoLP errors.
+        """
+        self.DoLP.update(DoLP_errors)
+        self.AoLP.update(AoLP_errors)
+        within_limits = (np.abs(DoLP_errors) <= self.Dlim) & (np.abs(AoLP_errors) <= self.Alim)
+        self.count += within_limits.size
+        self.failures += int(within_limits.size - np.count_nonzero(within_limits))
+
+
+    def merge(self, other):
+        """
+        Add the statistics of `other`.
+        """
+        self.DoLP.merge(other.DoLP)
+        self.AoLP.merge(other.AoLP)
+        self.count += other.count
+        self.failures += other.failures
+
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        """
+        Dictionary with the most important statistics.
+        """
+        summary = {"samples": self.count, "failure_rate": self.failure_rate}
+        for label, statistics in zip(["DoLP", "AoLP"], [self.DoLP, self.AoLP]):
+            summary[f"{label}_mean"] = statistics.mean
+            summary[f"{label}_std"] = statistics.std
+            for q in quantiles:
+                summary[f"{label}_q{q:g}"] = statistics.quantile(q)
+        return summary
+
+
+def draw_parameters(rng, distributions, size):
+    """
+    Draw `size` offsets for each instrument parameter.
+    `distributions` maps parameter names to either ("normal", sigma),
+    ("uniform", half_width), or a function `f(rng, size)`.
+    """
+    draws = {}
+    for parameter, distribution in distributions.items():
+        if callable(distribution):
+            draws[parameter] = np.asarray(distribution(rng, size))
+            continue
+
+        kind, width = distribution
+        if kind == "normal":
+            draws[parameter] = rng.normal(0., width, size)
+        elif kind == "uniform":
+            draws[parameter] = rng.uniform(-width, width, size)
+        else:
+            raise ValueError(f"Unknown distribution for {parameter}: {kind}")
+    return draws
+
+
+def _monte_carlo_batch(wavelengths, source, distributions, instrument, method, Dlim, Alim, bins, batch):
+    """
+    Simulate and retrieve one batch of jointly drawn parameter sets.
+    `batch` is a (SeedSequence, size) pair.
+    """
+    seed, size = batch
+    rng = np.random.default_rng(seed)
+    perturbations = draw_parameters(rng, distributions, size)
+
+    DoLPs, AoLPs = simulate_and_retrieve(wavelengths, source, instrument, method, **perturbations)
+    DoLP_real = stokes.DoLP(*source[0]) ; AoLP_real = stokes.AoLP_deg(*source[0])
+
+    statistics = ToleranceStatistics(Dlim=Dlim, Alim=Alim, bins=bins)
+    statistics.update(D_err(DoLPs, DoLP_real), A_err(AoLPs, AoLP_real))
+    return statistics
+
+
+def monte_carlo(wavelengths, source, distributions, nr_samples, batch_size=250, instrument="iSPEX2", method="linear", Dlim=0.03, Alim=5, bins=10000, seed=None, n_jobs=1):
+    """
+    Joint Monte Carlo tolerance analysis for a single `source`.
+
+    In every sample, all parameters in `distributions` (see `draw_parameters`)
+    are perturbed together. Samples are drawn and simulated in vectorised
+    batches of `batch_size`. Every batch gets its own random stream, spawned
+    from `seed`, so the result does not depend on the number of processes
+    `n_jobs`. With `n_jobs` other than 1, function distributions must be
+    picklable (defined at module level), and at most `2 * n_jobs` batches
+    are in flight at a time; each result is merged as soon as it is its
+    turn, so finished batches are not kept in memory.
+
+    Returns a `ToleranceStatistics` object; individual samples are not kept.
+    """
+    nr_batches = int(np.ceil(nr_samples / batch_size))
+    sizes = np.diff(np.linspace(0, nr_samples, nr_batches+1).astype(int))
+    seeds = np.random.SeedSequence(seed).spawn(nr_batches)
+    batches = list(zip(seeds, sizes))
+
+    statistics = ToleranceStatistics(Dlim=Dlim, Alim=Alim, bins=bins)
+    shared = (wavelengths, source, distributions, instrument, method, Dlim, Alim, bins)
+
+    n_jobs = number_of_jobs(n_jobs)
+    if n_jobs == 1:
+        results = (_monte_carlo_batch(*shared, batch) for batch in batches)
+        for result in results:
+            statistics.merge(result)
+    else:
+        function = partial(_call_shared, _monte_carlo_batch)
+        with ProcessPoolExecutor(n_jobs, initializer=_initialise, initargs=(shared,)) as pool:
+            # Merge in submission order, so the result does not depend on which worker finishes first
+            in_flight = deque()
+            for batch in batches:
+                in_flight.append(pool.submit(function, batch))
+                if len(in_flight) >= 2 * n_jobs:
+                    statistics.merge(in_flight.popleft().result())
+            while in_flight:
+                statistics.merge(in_flight.popleft().result())
+
+    return statistics
@@ -0,0 +1,135 @@
+"""
+Detector noise for simulated spectra: photon (shot) noise, dark signal,
+read noise and ADU quantisation.
+
+Noisy realisations are drawn for a whole stack of spectra at once, in
+batches. Every batch has its own random stream, spawned from one seed, so
+results are reproducible and batches can be generated in any order or in
+different processes. Batches can be fed into the retrieval one at a time
+with `noisy_realisations`, so that they never all have to be in memory.
+The noise model works on any array of intensities, so it can be applied to
+the output of `simulate_iSPEX`, `simulate_iSPEX2`, the sweeps, or
+`groundspex.demodulation.modulation` alike.
+"""
+import numpy as np
+from . import stokes
+from .margins import D_err, A_err, retrieval_function
+from .montecarlo import ToleranceStatistics
+
+
+class DetectorNoise(object):
+    """
+    Noise model for a detector that converts simulated intensities into
+    counts (ADU) and back.
+    """
+    def __init__(self, electrons_per_intensity=1e4, gain=1., read_noise=0., dark=0., bias=0., bit_depth=None, quantise=True):
+        """
+        Create the object.
+        electrons_per_intensity: Expected photo-electrons per unit of simulated intensity.
+        gain: Electrons per ADU.
+        read_noise: Read noise in electrons (RMS).
+        dark: Expected dark signal in electrons per pixel per exposure.
+        bias: Bias level in ADU.
+        bit_depth: If given, counts are clipped to [0, 2**bit_depth - 1].
+        quantise: If True, counts are rounded to whole ADU.
+        """
+        self.electrons_per_intensity = electrons_per_intensity
+        self.gain = gain
+        self.read_noise = read_noise
+        self.dark = dark
+        self.bias = bias
+        self.bit_depth = bit_depth
+        self.quantise = quantise
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return f"Detector noise: {self.electrons_per_intensity:g} e-/intensity, gain {self.gain:g} e-/ADU, read noise {self.read_noise:g} e-, dark {self.dark:g} e-"
+
+
+    def counts(self, intensity, rng, size=None):
+        """
+        Draw noisy counts (ADU) for an array of `intensity`.
+        With `size` (an integer), that many realisations are drawn at once,
+        along a new first axis.
+        """
+        shape = np.shape(intensity) if size is None else (size,) + np.shape(intensity)
+        expected = np.clip((np.asarray(intensity) * self.electrons_per_intensity + self.dark), 0, None)
+
+        # Photon and dark-current shot noise are Poisson, read noise is Gaussian
+        electrons = rng.poisson(expected, size=shape).astype(np.float64)
+        if self.read_noise:
+            electrons += rng.normal(0., self.read_noise, size=shape)
+
+        counts = electrons / self.gain + self.bias
+        if self.quantise:
+            np.rint(counts, out=counts)
+        if self.bit_depth is not None:
+            np.clip(counts, 0, 2**self.bit_depth - 1, out=counts)
+        return counts
+
+
+    def intensity(self, counts):
+        """
+        Convert counts (ADU) back into intensities, subtracting the bias and
+        the expected dark signal.
+        """
+        return ((np.asarray(counts) - self.bias) * self.gain - self.dark) / self.electrons_per_intensity
+
+
+    def __call__(self, intensity, rng, size=None):
+        """
+        Draw noisy realisations of `intensity`, calibrated back into
+        intensities (see `counts` and `intensity`).
+        """
+        return self.intensity(self.counts(intensity, rng, size=size))
+
+
+def noise_streams(seed, nr_streams):
+    """
+    Independent random generators spawned from `seed` (an integer, None, or
+    a `np.random.SeedSequence`), one for each batch of realisations.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(s) for s in seed.spawn(nr_streams)]
+
+
+def noisy_realisations(intensities, noise, nr_realisations, batch_size=100, seed=None):
+    """
+    Generator of noisy realisations of `intensities` (an array, or a tuple of
+    arrays such as the two iSPEX 2 channels), in batches of up to
+    `batch_size` realisations along a new first axis.
+    Every batch is drawn from its own stream (see `noise_streams`), so the
+    same `seed` and `batch_size` always give the same realisations.
+    """
+    nr_batches = int(np.ceil(nr_realisations / batch_size))
+    sizes = np.diff(np.linspace(0, nr_realisations, nr_batches+1).astype(int))
+    for rng, size in zip(noise_streams(seed, nr_batches), sizes):
+        if isinstance(intensities, tuple):
+            yield tuple(noise(I, rng, size=size) for I in intensities)
+        else:
+            yield noise(intensities, rng, size=size)
+
+
+def retrieval_precision(wavelengths, source, intensities, noise, nr_realisations, batch_size=100, instrument="iSPEX2", method="linear", Dlim=0.03, Alim=5, bins=10000, seed=None):
+    """
+    Statistics of the DoLP/AoLP errors retrieved from noisy realisations of
+    simulated `intensities` of a `source` (for iSPEX 2, a tuple (I0, I90)).
+    The realisations are drawn and retrieved one batch at a time, so memory
+    use does not grow with `nr_realisations`.
+    Returns a `ToleranceStatistics` object.
+    """
+    retrieve = retrieval_function(instrument, method)
+    DoLP_real = stokes.DoLP(*source[0]) ; AoLP_real = stokes.AoLP_deg(*source[0])
+    if instrument == "iSPEX2":
+        intensities = tuple(intensities)
+
+    statistics = ToleranceStatistics(Dlim=Dlim, Alim=Alim, bins=bins)
+    for batch in noisy_realisations(intensities, noise, nr_realisations, batch_size=batch_size, seed=seed):
+        batch = batch if isinstance(batch, tuple) else (batch,)
+        DoLPs, AoLPs = retrieve(wavelengths, source, *batch)
+        statistics.update(D_err(DoLPs, DoLP_real), A_err(AoLPs, AoLP_real))
+    return statistics
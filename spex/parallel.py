@@ -0,0 +1,75 @@
+"""
+Helpers for spreading independent calculations over a process pool.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+
+# Data shared with every task, set once per worker process by `_initialise`
+_shared = ()
+
+
+def _initialise(shared):
+    """
+    Store the shared data in a worker process.
+    """
+    global _shared
+    _shared = shared
+
+
+def _call_shared(function, chunk):
+    """
+    Apply `function` to a chunk, using the shared data stored in this worker.
+    """
+    return function(*_shared, chunk)
+
+
+def _call(function, shared, chunk):
+    """
+    Apply `function` to a chunk, with the shared data passed explicitly.
+    """
+    return function(*shared, chunk)
+
+
+def number_of_jobs(n_jobs):
+    """
+    Interpret `n_jobs` like joblib does: -1 means all CPUs, -2 all but one, etc.
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        n_jobs = max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+
+def chunked_map(function, items, shared=(), n_jobs=1, executor=None, chunks_per_job=4):
+    """
+    Calculate `function(*shared, chunk)` for chunks of `items` (split along
+    the first axis) and concatenate the resulting arrays, in order.
+
+    If `executor` is given, the chunks are submitted to it; `shared` is then
+    sent along with each chunk. Its number of workers can be given as
+    `n_jobs` to choose the number of chunks; if `n_jobs` is 1, the executor
+    is assumed to have one worker per CPU. Otherwise, if `n_jobs` is not 1,
+    a process pool is created in which `shared` is sent to every worker only
+    once.
+    `function` must be defined at module level so it can be pickled.
+    """
+    n_jobs = number_of_jobs(n_jobs)
+    if executor is None and n_jobs == 1:
+        return function(*shared, items)
+
+    if executor is not None and n_jobs == 1:
+        n_jobs = number_of_jobs(-1)
+
+    nr_chunks = max(1, min(len(items), n_jobs * chunks_per_job))
+    chunks = np.array_split(items, nr_chunks)
+
+    if executor is not None:
+        results = list(executor.map(partial(_call, function, shared), chunks))
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=_initialise, initargs=(shared,)) as pool:
+            results = list(pool.map(partial(_call_shared, function), chunks))
+
+    return np.concatenate(results)
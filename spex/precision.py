@@ -0,0 +1,66 @@
+"""
+Floating-point precision of the simulations.
+
+By default everything is calculated in float64. Large sweeps are limited by
+memory, so they can be run in float32 to halve the size of the element
+stacks and intensities. The precision can be set globally with
+`set_precision`, for a block of code with `precision`, or per call through
+the `dtype` argument of the sweep functions (and so of
+`spex.margins.simulate_and_retrieve`).
+
+Phases (2 pi delta / wavelength) are always calculated in float64 before
+the Mueller matrices are stored in the working precision, because the
+multi-order retarders have phases of tens of radians.
+The retrieval follows the precision of the spectra given to it.
+
+Accuracy of float32 against float64 (from `precision_check.py`, which runs
+the single-parameter tolerance sweeps of `ispex2_error.py` for a set of
+(Q, U) sources): intensities agree to within 2e-7, retrieved DoLP to within
+1e-6 (relative) and AoLP to within 2e-5 degrees, and all tolerance margins
+are identical. Run time drops by ~15% on those sweeps; the gain is larger
+for sweeps that do not fit in the CPU cache.
+"""
+from contextlib import contextmanager
+import numpy as np
+
+PRECISIONS = (np.float32, np.float64)
+
+# The working precision
+_dtype = np.dtype(np.float64)
+
+
+def _check(dtype):
+    dtype = np.dtype(dtype)
+    if dtype not in PRECISIONS:
+        raise ValueError(f"Precision must be float32 or float64, not {dtype}")
+    return dtype
+
+
+def get_dtype(dtype=None):
+    """
+    The given `dtype`, or the working precision if it is None.
+    """
+    return _dtype if dtype is None else _check(dtype)
+
+
+def set_precision(dtype):
+    """
+    Set the working precision (np.float32 or np.float64) globally.
+    """
+    global _dtype
+    _dtype = _check(dtype)
+
+
+@contextmanager
+def precision(dtype):
+    """
+    Use a different working precision within a `with` block.
+    If `dtype` is None, the working precision is not changed.
+    """
+    global _dtype
+    previous = _dtype
+    _dtype = get_dtype(dtype)
+    try:
+        yield _dtype
+    finally:
+        _dtype = previous
@@ -0,0 +1,130 @@
+"""
+Finite spectral resolution: convolution of simulated spectra with the
+instrument line-spread function (LSF).
+
+The LSF is a Gaussian with a full width at half maximum `fwhm` that may
+vary with wavelength. The spectrum is split into blocks, each of which is
+convolved with the LSF at its centre using FFTs, and the results are added
+(overlap-add). Everything is batched over the leading axes of the stack,
+and the kernel spectra for a given grid and `fwhm` are cached, so repeated
+convolutions cost only a few FFTs.
+Spectra on a non-uniform grid are resampled onto a uniform one first.
+"""
+import numpy as np
+from .cache import LRUCache, wavelength_fingerprint
+
+# Kernel spectra and edge normalisations for the overlap-add, keyed on (wavelengths, fwhm, block_size, truncate)
+_plan_cache = LRUCache(maxsize=16)
+
+FWHM_TO_SIGMA = 1 / (2 * np.sqrt(2 * np.log(2)))
+
+
+def gaussian_kernel(sigma, truncate=4.):
+    """
+    Normalised Gaussian kernel with a standard deviation `sigma` in pixels,
+    truncated at `truncate` standard deviations.
+    """
+    halfwidth = max(int(np.ceil(truncate * sigma)), 1)
+    x = np.arange(-halfwidth, halfwidth+1)
+    kernel = np.exp(-0.5 * (x / max(sigma, 1e-9))**2)
+    return kernel / kernel.sum()
+
+
+def _is_uniform(wavelengths):
+    step = np.diff(wavelengths)
+    return np.allclose(step, step[0], rtol=1e-6, atol=0)
+
+
+def _interpolation_weights(x_new, x):
+    """
+    Indices and weights for linear interpolation from `x` to `x_new`, so that
+    a whole stack of spectra can be resampled with one expression.
+    """
+    indices = np.clip(np.searchsorted(x, x_new) - 1, 0, len(x)-2)
+    weights = (x_new - x[indices]) / (x[indices+1] - x[indices])
+    return indices, np.clip(weights, 0, 1)
+
+
+def _resample(spectra, indices, weights):
+    weights = weights.astype(spectra.dtype, copy=False)
+    return spectra[...,indices] * (1 - weights) + spectra[...,indices+1] * weights
+
+
+def _kernel_spectra(sigmas, halfwidth, nfft, truncate):
+    """
+    FFTs of Gaussian kernels of width `sigmas` (in pixels, one per block),
+    all centred on index `halfwidth` so that the blocks line up.
+    """
+    kernels = [gaussian_kernel(sigma, truncate) for sigma in sigmas]
+    return np.array([np.fft.rfft(np.pad(kernel, halfwidth - len(kernel)//2), nfft) for kernel in kernels])
+
+
+def _overlap_add(spectra, kernel_spectra, block_size, halfwidth):
+    """
+    Convolve a stack of spectra (..., L) block by block, with one kernel
+    spectrum per block of `block_size` pixels.
+    The result has the precision of `spectra` and `kernel_spectra` combined,
+    e.g. float32 for float32 spectra and complex64 kernel spectra.
+    """
+    nfft = 2 * (kernel_spectra.shape[-1] - 1)
+    L = spectra.shape[-1]
+    result = np.zeros(spectra.shape[:-1] + (L + nfft,), dtype=np.result_type(spectra, kernel_spectra.real))
+
+    for start, kernel_spectrum in zip(range(0, L, block_size), kernel_spectra):
+        block = spectra[...,start:start+block_size]
+        result[...,start:start+nfft] += np.fft.irfft(np.fft.rfft(block, nfft) * kernel_spectrum, nfft)
+
+    # The kernel centres are at `halfwidth`, so the convolved spectra are shifted by that much
+    return result[...,halfwidth:halfwidth+L]
+
+
+def convolve_lsf(wavelengths, spectra, fwhm, block_size=256, truncate=4.):
+    """
+    Convolve a stack of `spectra` (..., L) with a Gaussian line-spread
+    function of full width at half maximum `fwhm`, in the same units as
+    `wavelengths`. `fwhm` may be a scalar or an array (L) that varies with
+    wavelength; in the latter case it is taken as constant within each block
+    of `block_size` pixels.
+    If `fwhm` is None or 0, the spectra are returned unchanged.
+    The result has the precision of `spectra` (float32 or float64).
+    """
+    if fwhm is None or np.all(np.asarray(fwhm) == 0):
+        return spectra
+
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    dtype = np.result_type(spectra, np.float32)
+    spectra = np.asarray(spectra, dtype=dtype)
+    fwhm = np.broadcast_to(fwhm, wavelengths.shape).astype(np.float64)
+
+    # Resample onto a uniform grid if necessary
+    uniform = _is_uniform(wavelengths)
+    if not uniform:
+        grid = np.linspace(wavelengths[0], wavelengths[-1], len(wavelengths))
+        spectra = _resample(spectra, *_interpolation_weights(grid, wavelengths))
+        fwhm = np.interp(grid, wavelengths, fwhm)
+    else:
+        grid = wavelengths
+    step = np.abs(grid[1] - grid[0])
+
+    L = len(grid)
+    block_size = min(block_size, L)
+    if np.all(fwhm == fwhm[0]):
+        block_size = L
+
+    sigmas = [fwhm[start:start+block_size].mean() * FWHM_TO_SIGMA / step for start in range(0, L, block_size)]
+    halfwidth = max(max(int(np.ceil(truncate * sigma)), 1) for sigma in sigmas)
+    nfft = int(2**np.ceil(np.log2(block_size + 2*halfwidth)))
+
+    key = (wavelength_fingerprint(grid), wavelength_fingerprint(fwhm), block_size, truncate)
+    kernel_spectra = _plan_cache.get(key + ("kernels",), lambda: _kernel_spectra(sigmas, halfwidth, nfft, truncate))
+    # Normalise by the response to a flat spectrum, so the edges are not darkened
+    normalisation = _plan_cache.get(key + ("normalisation",), lambda: _overlap_add(np.ones(L), kernel_spectra, block_size, halfwidth))
+
+    # The plans are stored in double precision; the convolution itself is done in that of the spectra
+    kernel_spectra = kernel_spectra.astype(np.result_type(dtype, np.complex64), copy=False)
+    result = _overlap_add(spectra, kernel_spectra, block_size, halfwidth)
+    result /= normalisation.astype(dtype, copy=False)
+
+    if not uniform:
+        result = _resample(result, *_interpolation_weights(wavelengths, grid))
+    return result
@@ -0,0 +1,147 @@
+"""
+Closed-form retrieval of DoLP and AoLP from modulated spectra.
+
+With a fixed retardance `delta`, the modulation
+    I = 0.5 * S * (1 + DoLP * cos(2 pi delta / wavelength + 2 AoLP))
+is linear in a = DoLP cos(2 AoLP) and b = DoLP sin(2 AoLP):
+    I - 0.5 * S = 0.5 * S * cos(phi) * a - 0.5 * S * sin(phi) * b
+so the least-squares solution for a whole stack of spectra is a single
+matrix product with the pseudo-inverse of the (L, 2) design matrix.
+"""
+import numpy as np
+from scipy.optimize import curve_fit
+from . import elements
+from .cache import LRUCache, wavelength_fingerprint
+from .ispex import _correct_AoLP90, _merge_DoLP_AoLP, _wrap_AoLP
+
+# Pseudo-inverses of design matrices, keyed on (wavelengths, source, delta)
+_pinv_cache = LRUCache(maxsize=32)
+
+
+def design_matrix(wavelengths, source_intensity, delta=4480):
+    """
+    Design matrix with shape (L, 2) for the linear modulation model, with
+    columns for DoLP cos(2 AoLP) and DoLP sin(2 AoLP).
+    A stack of source spectra (..., L) gives a stack of design matrices.
+    """
+    phase = 2 * np.pi * delta / wavelengths
+    return 0.5 * source_intensity[...,np.newaxis] * np.stack([np.cos(phase), -np.sin(phase)], axis=-1)
+
+
+def design_pinv(wavelengths, source_intensity, delta=4480):
+    """
+    Pseudo-inverse (2, L) of the design matrix, cached on the wavelength
+    grid, source spectrum and retardance.
+    """
+    key = (wavelength_fingerprint(wavelengths), wavelength_fingerprint(source_intensity), delta)
+    return _pinv_cache.get(key, lambda: np.linalg.pinv(design_matrix(wavelengths, source_intensity, delta)))
+
+
+def _DoLP_AoLP(coefficients):
+    """
+    Convert linear coefficients (..., 2) into DoLP and AoLP (in degrees,
+    wrapped like `spex.retrieve_DoLP`).
+    """
+    a, b = np.moveaxis(coefficients, -1, 0)
+    DoLP = np.asarray(np.hypot(a, b))
+    AoLP = _wrap_AoLP(np.rad2deg(0.5 * np.arctan2(b, a)))
+    return DoLP, AoLP
+
+
+def retrieve_DoLP_linear(wavelengths, source, Is, delta=4480, refine=True):
+    """
+    Retrieve DoLP and AoLP from a stack of spectra `Is` with shape (..., L),
+    measured through a retarder `delta` from a `source` (L, 4).
+
+    The linear solution is the exact least-squares optimum whenever it lies
+    within the physical bounds. If `refine` is True, spectra where it does
+    not (DoLP > 1) are refined with a bounded non-linear fit, like
+    `spex.retrieve_DoLP`; otherwise their DoLP is clipped to 1.
+    The calculation is done in the precision of `Is` (float32 or float64).
+    """
+    Is = np.asarray(Is)
+    dtype = np.result_type(Is, np.float32)
+    source_intensity = source[:,0].astype(dtype, copy=False)
+    pinv = design_pinv(wavelengths, source[:,0], delta).astype(dtype, copy=False)
+
+    residual = Is - 0.5 * source_intensity
+    coefficients = np.einsum("kw,...w->...k", pinv, residual)
+    DoLP, AoLP = _DoLP_AoLP(coefficients)
+
+    out_of_bounds = DoLP > 1
+    if refine and np.any(out_of_bounds):
+        DoLP[out_of_bounds], AoLP[out_of_bounds] = refine_DoLP(wavelengths, source, Is[out_of_bounds], AoLPs=AoLP[out_of_bounds], delta=delta)
+    else:
+        DoLP = np.asarray(np.clip(DoLP, 0, 1))
+
+    return DoLP, AoLP
+
+
+def refine_DoLP(wavelengths, source, Is, DoLPs=None, AoLPs=None, delta=4480):
+    """
+    Non-linear bounded fit of DoLP and AoLP to each spectrum in `Is` (N, L),
+    starting from initial estimates (e.g. from `retrieve_DoLP_linear`).
+    """
+    source_intensity = source[:,0]
+    mod_source = lambda wvl, DoLP, AoLP: elements.modulation(wvl, source_intensity, DoLP, AoLP, delta)
+    DoLPs = np.ones(len(Is)) if DoLPs is None else np.clip(DoLPs, 0, 1)
+    AoLPs = np.zeros(len(Is)) if AoLPs is None else np.clip(AoLPs, -90, 90)
+
+    results = np.array([curve_fit(mod_source, wavelengths, I, bounds=([0, -90], [1, 90]), p0=[D, A])[0] for I, D, A in zip(Is, DoLPs, AoLPs)]).reshape(-1, 2)
+    DoLPs, AoLPs = results.T
+    return DoLPs, _wrap_AoLP(AoLPs)
+
+
+def retrieve_DoLP_linear2(wavelengths, source, I0s, I90s, delta=4480, refine=True):
+    """
+    Retrieve DoLP and AoLP from pairs of iSPEX 2 spectra, like
+    `spex.retrieve_DoLP_many2` but with the linear retrieval for each channel.
+    """
+    DoLPs0 , AoLPs0  = retrieve_DoLP_linear(wavelengths, source, I0s , delta=delta, refine=refine)
+    DoLPs90, AoLPs90 = retrieve_DoLP_linear(wavelengths, source, I90s, delta=delta, refine=refine)
+    AoLPs90 = _correct_AoLP90(AoLPs90)
+    D, A = _merge_DoLP_AoLP(DoLPs0, DoLPs90, AoLPs0, AoLPs90)
+    return D, A
+
+
+def retrieve_DoLP_joint(wavelengths, source, I0s, I90s, delta=4480, refine=True):
+    """
+    Retrieve DoLP and AoLP from pairs of iSPEX 2 spectra (..., L) with one
+    fit to both channels at once, with a shared DoLP and AoLP.
+
+    The 90 degree channel sees the same modulation with the opposite sign, so
+    the joint design matrix is [X; -X] and its least-squares solution is
+    simply the linear solution for (I0 - I90) / 2. This halves the number of
+    fits compared to fitting each channel, and needs no merging of the
+    results, so it is continuous in AoLP.
+    `refine` works as in `retrieve_DoLP_linear`, with a joint non-linear fit.
+    """
+    I0s = np.asarray(I0s) ; I90s = np.asarray(I90s)
+    dtype = np.result_type(I0s, I90s, np.float32)
+    pinv = design_pinv(wavelengths, source[:,0], delta).astype(dtype, copy=False)
+
+    coefficients = np.einsum("kw,...w->...k", pinv, 0.5 * (I0s - I90s))
+    DoLP, AoLP = _DoLP_AoLP(coefficients)
+
+    out_of_bounds = DoLP > 1
+    if refine and np.any(out_of_bounds):
+        DoLP[out_of_bounds], AoLP[out_of_bounds] = refine_DoLP_joint(wavelengths, source, I0s[out_of_bounds], I90s[out_of_bounds], AoLPs=AoLP[out_of_bounds], delta=delta)
+    else:
+        DoLP = np.asarray(np.clip(DoLP, 0, 1))
+
+    return DoLP, AoLP
+
+
+def refine_DoLP_joint(wavelengths, source, I0s, I90s, DoLPs=None, AoLPs=None, delta=4480):
+    """
+    Joint non-linear bounded fit of DoLP and AoLP to each pair of spectra in
+    `I0s` and `I90s` (N, L), starting from initial estimates.
+    """
+    source_intensity = source[:,0]
+    mod_source = lambda wvl, DoLP, AoLP: np.concatenate([elements.modulation(wvl, source_intensity, DoLP, AoLP, delta), elements.modulation(wvl, source_intensity, DoLP, AoLP+90, delta)])
+    DoLPs = np.ones(len(I0s)) if DoLPs is None else np.clip(DoLPs, 0, 1)
+    AoLPs = np.zeros(len(I0s)) if AoLPs is None else np.clip(AoLPs, -90, 90)
+
+    results = np.array([curve_fit(mod_source, wavelengths, np.concatenate([I0, I90]), bounds=([0, -90], [1, 90]), p0=[D, A])[0] for I0, I90, D, A in zip(I0s, I90s, DoLPs, AoLPs)]).reshape(-1, 2)
+    DoLPs, AoLPs = results.T
+    return DoLPs, _wrap_AoLP(AoLPs)
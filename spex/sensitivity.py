@@ -0,0 +1,300 @@
+"""
+Analytic sensitivity of simulated intensities and retrieved DoLP/AoLP to
+instrument parameters.
+
+The derivatives of the element Mueller matrices are calculated in closed
+form and propagated through the chain with the product rule, so that
+d(I)/d(parameter) for every parameter comes from one pass. Through the
+linear retrieval (see `spex.retrieval`) these give d(DoLP)/d(parameter) and
+d(AoLP)/d(parameter), and from those, first-order guesses of the tolerance
+margins. The response of the retrieval is strongly non-linear for several
+parameters (e.g. the retarder and polarizer angles), where these guesses are
+too large by up to an order of magnitude; they are only meant to seed the
+margin search in `spex.margins.find_margin` (see `seeded_margins`).
+"""
+import numpy as np
+from numpy import sin, cos
+from . import elements, stokes
+from .ispex import iSPEX_DEFAULTS, iSPEX2_DEFAULTS, _sweep_parameters
+from .margins import D_err, A_err, margin_adaptive
+from .retrieval import design_matrix
+from .train import propagate_intensity
+
+
+def Rotation_matrix_derivative_radians(phi):
+    """
+    Derivative of `Rotation_matrix_radians(phi)` with respect to `phi`.
+    """
+    cos_2phi = cos(2*phi)
+    sin_2phi = sin(2*phi)
+
+    derivative = elements._empty_stack(phi)
+    derivative[...,1,1] = -2*sin_2phi
+    derivative[...,1,2] = 2*cos_2phi
+    derivative[...,2,1] = -2*cos_2phi
+    derivative[...,2,2] = -2*sin_2phi
+    return derivative
+
+
+def rotate_element_derivative_radians(element, phi):
+    """
+    Derivative of `rotate_element_radians(element, phi)` with respect to
+    `phi`, for an element that does not depend on `phi` itself.
+    """
+    R_minus = elements.Rotation_matrix_radians(-phi)
+    R_plus = elements.Rotation_matrix_radians(phi)
+    return -Rotation_matrix_derivative_radians(-phi) @ element @ R_plus + R_minus @ element @ Rotation_matrix_derivative_radians(phi)
+
+
+def Linear_polarizer_derivative_degrees(phi_degrees):
+    """
+    Derivative of `Linear_polarizer_degrees(phi_degrees)` with respect to
+    `phi_degrees`.
+    """
+    phi = np.deg2rad(phi_degrees)
+    return rotate_element_derivative_radians(elements.Linear_polarizer_0, phi) * np.pi/180
+
+
+def Retarder_derivatives_radians(delta, phi):
+    """
+    Derivatives of `Retarder_radians(delta, phi)` with respect to `delta` and
+    `phi`, as two stacks with shape (..., 4, 4).
+    """
+    cos_d = cos(delta)
+    sin_d = sin(delta)
+    cos_2phi = cos(2*phi)
+    sin_2phi = sin(2*phi)
+
+    d_delta = elements._empty_stack(delta, phi)
+    d_delta[...,1,1] = -sin_2phi**2 * sin_d
+    d_delta[...,1,2] = d_delta[...,2,1] = cos_2phi * sin_2phi * sin_d
+    d_delta[...,1,3] = sin_2phi * cos_d
+    d_delta[...,2,2] = -cos_2phi**2 * sin_d
+    d_delta[...,2,3] = -cos_2phi * cos_d
+    d_delta[...,3,1] = -sin_2phi * cos_d
+    d_delta[...,3,2] = cos_2phi * cos_d
+    d_delta[...,3,3] = -sin_d
+
+    d_phi = elements._empty_stack(delta, phi)
+    d_phi[...,1,1] = -4 * cos_2phi * sin_2phi * (1 - cos_d)
+    d_phi[...,1,2] = d_phi[...,2,1] = 2 * (cos_2phi**2 - sin_2phi**2) * (1 - cos_d)
+    d_phi[...,1,3] = 2 * cos_2phi * sin_d
+    d_phi[...,2,2] = 4 * cos_2phi * sin_2phi * (1 - cos_d)
+    d_phi[...,2,3] = 2 * sin_2phi * sin_d
+    d_phi[...,3,1] = -2 * cos_2phi * sin_d
+    d_phi[...,3,2] = -2 * sin_2phi * sin_d
+
+    return d_delta, d_phi
+
+
+def Retarder_wavelengths_derivatives(d_nm, t, wavelengths):
+    """
+    Derivatives of `Retarder_wavelengths(d_nm, t, wavelengths)` with respect
+    to the retardance `d_nm` (per nm) and the angle `t` (per degree).
+    """
+    d_rad = 2 * np.pi * np.divide(d_nm, wavelengths)
+    t_rad = np.deg2rad(t)
+    d_delta, d_phi = Retarder_derivatives_radians(d_rad, t_rad)
+
+    d_d_nm = d_delta * (2 * np.pi / np.asarray(wavelengths))[...,np.newaxis,np.newaxis]
+    d_t = d_phi * np.pi/180
+    return d_d_nm, d_t
+
+
+def intensity_jacobian(matrices, derivatives, source):
+    """
+    Derivatives of the intensity behind a chain of Mueller `matrices` (first
+    element first) with respect to element parameters.
+    `derivatives` is a list with, for each element, a dictionary mapping
+    parameter names to the derivative of that element's matrix.
+    Returns a dictionary mapping parameter names to d(I)/d(parameter).
+
+    The Stokes vector in front of each element and the first row of the
+    chain behind it are calculated once, so every derivative only costs one
+    contraction: dI/dp = row_behind . dM/dp . vector_in_front.
+    """
+    # Stokes vectors in front of each element
+    vectors = [np.asarray(source)]
+    for matrix in matrices[:-1]:
+        vectors.append(np.einsum("...ij,...j->...i", matrix, vectors[-1]))
+
+    # First rows of the chain behind each element
+    rows = [np.array([1., 0., 0., 0.])]
+    for matrix in matrices[:0:-1]:
+        rows.append(np.einsum("...i,...ij->...j", rows[-1], matrix))
+    rows = rows[::-1]
+
+    jacobian = {}
+    for row, vector, element_derivatives in zip(rows, vectors, derivatives):
+        for parameter, derivative in element_derivatives.items():
+            jacobian[parameter] = np.einsum("...i,...ij,...j->...", row, derivative, vector)
+    return jacobian
+
+
+def _iSPEX_chain(wavelengths, p, POL_t):
+    """
+    Mueller matrices of the iSPEX elements and their derivatives, for one
+    polarizer angle. `p` holds the parameters as from `_sweep_parameters`.
+    """
+    matrices = []
+    derivatives = []
+    for element in ["QWP", "MOR1", "MOR2"]:
+        d_nm, t = p[f"{element}_d"], p[f"{element}_t"]
+        matrices.append(elements.Retarder_wavelengths(d_nm, t, wavelengths))
+        d_d, d_t = Retarder_wavelengths_derivatives(d_nm, t, wavelengths)
+        derivatives.append({f"{element}_d": d_d, f"{element}_t": d_t})
+
+    matrices.append(elements.Linear_polarizer_degrees(POL_t))
+    derivatives.append(Linear_polarizer_derivative_degrees(POL_t))
+    return matrices, derivatives
+
+
+def iSPEX_intensity_jacobian(wavelengths, source, **perturbations):
+    """
+    Intensity measured by iSPEX and its derivatives with respect to every
+    instrument parameter, at the default instrument plus optional
+    `perturbations` (see `spex.simulate_iSPEX_sweep`).
+    Returns the intensity (..., L) and a dictionary of derivatives (..., L).
+    """
+    _, p = _sweep_parameters(iSPEX_DEFAULTS, perturbations)
+    matrices, derivatives = _iSPEX_chain(wavelengths, p, p["POL_t"])
+    derivatives[-1] = {"POL_t": derivatives[-1]}
+
+    I = propagate_intensity(matrices, source)
+    return I, intensity_jacobian(matrices, derivatives, source)
+
+
+def iSPEX2_intensity_jacobian(wavelengths, source, **perturbations):
+    """
+    Intensities measured by iSPEX 2 in both channels and their derivatives
+    with respect to every instrument parameter, at the default instrument
+    plus optional `perturbations` (see `spex.simulate_iSPEX2_sweep`).
+    Returns the intensities (I0, I90) and a dictionary of derivatives, each
+    a pair (dI0, dI90). The derivatives with respect to a polarizer angle
+    are zero in the other channel.
+    """
+    _, p = _sweep_parameters(iSPEX2_DEFAULTS, perturbations)
+
+    intensities = []
+    jacobians = []
+    for channel in ["POL0_t", "POL90_t"]:
+        matrices, derivatives = _iSPEX_chain(wavelengths, p, p[channel])
+        derivatives[-1] = {channel: derivatives[-1]}
+        intensities.append(propagate_intensity(matrices, source))
+        jacobians.append(intensity_jacobian(matrices, derivatives, source))
+
+    jacobian = {}
+    for parameter in iSPEX2_DEFAULTS:
+        dI0 = jacobians[0].get(parameter, np.zeros_like(intensities[0]))
+        dI90 = jacobians[1].get(parameter, np.zeros_like(intensities[1]))
+        jacobian[parameter] = (dI0, dI90)
+
+    return tuple(intensities), jacobian
+
+
+def retrieval_jacobian(wavelengths, source_intensity, I, dI, delta=4480):
+    """
+    Propagate intensity derivatives `dI` (..., L) through the linear
+    retrieval of DoLP and AoLP (see `spex.retrieval`).
+    `I` are the nominal intensities, used to find the point of linearisation.
+    `source_intensity` (..., L) may differ per spectrum.
+    Returns the retrieved DoLP and AoLP (in degrees) and their derivatives.
+    """
+    pinv = np.linalg.pinv(design_matrix(wavelengths, source_intensity, delta))
+    a, b = np.moveaxis(np.einsum("...kw,...w->...k", pinv, I - 0.5 * source_intensity), -1, 0)
+    da, db = np.moveaxis(np.einsum("...kw,...w->...k", pinv, dI), -1, 0)
+
+    DoLP = np.hypot(a, b)
+    AoLP = np.rad2deg(0.5 * np.arctan2(b, a))
+    dDoLP = (a * da + b * db) / DoLP
+    dAoLP = np.rad2deg(0.5 * (a * db - b * da) / DoLP**2)
+    return DoLP, AoLP, dDoLP, dAoLP
+
+
+def _merge_weights(A0, A90):
+    """
+    Weights given to the 0 degree channel by `spex.ispex._merge_DoLP_AoLP`.
+    """
+    weight = np.full(np.shape(A0), 0.5)
+    weight[(A0 > -5) & (A0 < 5)] = 1.
+    weight[(A90 > 85) | (A90 < -85)] = 0.
+    return weight
+
+
+def DoLP_AoLP_jacobian(wavelengths, source, instrument="iSPEX2", delta=4480):
+    """
+    Derivatives of the DoLP and AoLP retrieved with the linear retrieval
+    with respect to every instrument parameter, at the default instrument.
+    `source` has a shape (L, 4) or (..., L, 4) for a batch of sources.
+
+    Returns the retrieved DoLP and AoLP at the default instrument, and a
+    dictionary mapping each parameter to a pair (dDoLP, dAoLP).
+    For iSPEX 2, the channels are combined with the same weights as
+    `spex.ispex._merge_DoLP_AoLP` uses at the default instrument.
+    """
+    source_intensity = np.asarray(source)[...,0]
+    if instrument == "iSPEX":
+        I, dIs = iSPEX_intensity_jacobian(wavelengths, source)
+        DoLP, AoLP = retrieval_jacobian(wavelengths, source_intensity, I, np.zeros_like(I), delta)[:2]
+        jacobian = {parameter: retrieval_jacobian(wavelengths, source_intensity, I, dI, delta)[2:] for parameter, dI in dIs.items()}
+
+    elif instrument == "iSPEX2":
+        (I0, I90), dIs = iSPEX2_intensity_jacobian(wavelengths, source)
+        D0 , A0  = retrieval_jacobian(wavelengths, source_intensity, I0 , np.zeros_like(I0 ), delta)[:2]
+        D90, A90 = retrieval_jacobian(wavelengths, source_intensity, I90, np.zeros_like(I90), delta)[:2]
+        A90 = A90 + 90.
+        A90 = np.where(A90 > 90, A90 - 180, A90)
+        weight = _merge_weights(A0, A90)
+
+        DoLP = weight * D0 + (1 - weight) * D90
+        AoLP = np.where(weight == 1, A0, np.where(weight == 0, A90, 0.5 * (A0 + A90)))
+        jacobian = {}
+        for parameter, (dI0, dI90) in dIs.items():
+            dD0, dA0 = retrieval_jacobian(wavelengths, source_intensity, I0, dI0, delta)[2:]
+            dD90, dA90 = retrieval_jacobian(wavelengths, source_intensity, I90, dI90, delta)[2:]
+            jacobian[parameter] = (weight * dD0 + (1 - weight) * dD90, weight * dA0 + (1 - weight) * dA90)
+
+    else:
+        raise ValueError(f"Unknown instrument: {instrument}")
+
+    return DoLP, AoLP, jacobian
+
+
+def first_order_guesses(wavelengths, source, instrument="iSPEX2", Dlim=0.03, Alim=5, delta=4480):
+    """
+    First-order guess of the margin on every instrument parameter: the
+    perturbation at which the linearised DoLP or AoLP error reaches its limit,
+    starting from the error at the default instrument.
+    These are NOT margins: where the response is non-linear they can be an
+    order of magnitude too large (e.g. MOR1_t, POL0_t). Use them to seed
+    `spex.margins.find_margin`, as `seeded_margins` does.
+    Parameters to which the retrieval is insensitive to first order get an
+    infinite guess.
+    Returns a dictionary of guesses with the batch shape of `source`.
+    """
+    source = np.asarray(source)
+    DoLP_real = stokes.DoLP(*np.moveaxis(source[...,0,:], -1, 0))
+    AoLP_real = stokes.AoLP_deg(*np.moveaxis(source[...,0,:], -1, 0))
+    DoLP, AoLP, jacobian = DoLP_AoLP_jacobian(wavelengths, source, instrument=instrument, delta=delta)
+
+    D_headroom = np.clip(Dlim - np.abs(D_err(DoLP, DoLP_real)), 0, None)
+    A_headroom = np.clip(Alim - A_err(AoLP, AoLP_real), 0, None)
+
+    margins = {}
+    with np.errstate(divide="ignore"):
+        for parameter, (dDoLP, dAoLP) in jacobian.items():
+            D_margin = D_headroom / np.abs(dDoLP / DoLP_real)
+            A_margin = A_headroom / np.abs(dAoLP)
+            margins[parameter] = np.minimum(D_margin, A_margin)
+    return margins
+
+
+def seeded_margins(wavelengths, source, xmax, instrument="iSPEX2", method="linear", Dlim=0.03, Alim=5, **kwargs):
+    """
+    Margins on the instrument parameters in `xmax` (a dictionary with the
+    largest perturbation to consider for each), found with
+    `spex.margins.margin_adaptive` seeded by `first_order_guesses`, for a
+    single `source` (L, 4). Other keyword arguments go to `margin_adaptive`.
+    """
+    guesses = first_order_guesses(wavelengths, source, instrument=instrument, Dlim=Dlim, Alim=Alim)
+    return {parameter: margin_adaptive(wavelengths, source, parameter, xmax_parameter, instrument, method, Dlim=Dlim, Alim=Alim, guess=guesses[parameter], **kwargs) for parameter, xmax_parameter in xmax.items()}
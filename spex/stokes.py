@@ -1,4 +1,5 @@
 import numpy as np
+from .precision import get_dtype
 
 def DoP(I, Q, U, V):
     return np.sqrt(Q**2 + U**2 + V**2) / I
@@ -19,10 +20,207 @@ def Stokes(I=0., Q=0., U=0., V=0.):
 def Stokes_from_pol(I0=0, I90=0, I45=0, Im45=0, ILHC=0, IRHC=0):
     return Stokes(I0+I90, I0-I90, I45-Im45, ILHC-IRHC)
 
-def Stokes_nm(I=0., Q=0., U=0., V=0.):
-    arr = np.zeros((len(I), 4))
+def Stokes_nm(I=0., Q=0., U=0., V=0., dtype=None):
+    arr = np.zeros((len(I), 4), dtype=get_dtype(dtype))
     arr[:,0] = I
     arr[:,1] = Q  # split to allow int/float Q/U/V values
     arr[:,2] = U
     arr[:,3] = V
     return arr
+
+
+class StokesArray(object):
+    """
+    Stack of Stokes vectors in a single contiguous array with shape (..., 4),
+    for any number of leading batch axes (e.g. (L, 4) for a spectrum, or
+    (N, L, 4) for many).
+    I, Q, U and V are views into the array, so reading or assigning them does
+    not copy, and the derived quantities can be written into existing arrays.
+    The underlying array can be passed to the simulations as a `source`.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data, dtype=None, copy=False):
+        """
+        Create the object.
+        data: Array with shape (..., 4).
+        dtype: Data type of the underlying array, e.g. np.float32. Default: that of `data`, or float64 for non-float input.
+        copy: If False, `data` is used without copying when it is already contiguous and of the right type.
+        """
+        if dtype is None:
+            dtype = getattr(data, "dtype", np.float64)
+            if not np.issubdtype(dtype, np.floating):
+                dtype = np.float64
+        data = np.array(data, dtype=dtype, copy=True, order="C") if copy else np.ascontiguousarray(data, dtype=dtype)
+        if data.shape[-1:] != (4,):
+            raise ValueError(f"Stokes arrays must have a last axis of length 4, not shape {data.shape}")
+        self.data = data
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return f"StokesArray with batch shape {self.shape} ({self.dtype})"
+
+
+    @classmethod
+    def empty(cls, shape, dtype=np.float64):
+        """
+        Uninitialised Stokes array with batch shape `shape`.
+        """
+        return cls(np.empty(tuple(np.atleast_1d(shape)) + (4,), dtype=dtype))
+
+
+    @classmethod
+    def from_components(cls, I=0., Q=0., U=0., V=0., dtype=np.float64):
+        """
+        Stokes array from (broadcastable) components, written directly into
+        one new array.
+        """
+        shape = np.broadcast_shapes(*[np.shape(x) for x in (I, Q, U, V)])
+        stokes = cls.empty(shape, dtype=dtype)
+        stokes.I, stokes.Q, stokes.U, stokes.V = I, Q, U, V
+        return stokes
+
+
+    def __array__(self, dtype=None, copy=None):
+        """
+        The underlying array, following the numpy `copy` semantics: always a
+        copy if `copy` is True, never if it is False (a ValueError is raised
+        if that is impossible), and only if needed if it is None.
+        """
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        if copy is False and dtype != self.dtype:
+            raise ValueError(f"Cannot convert a {self.dtype} StokesArray to {dtype} without copying")
+        return self.data.astype(dtype, copy=bool(copy))
+
+
+    def __len__(self):
+        """
+        Length of the first batch axis, or 1 for a single Stokes vector.
+        """
+        return len(self.data) if self.shape else 1
+
+
+    def __getitem__(self, index):
+        """
+        Index the batch axes; the result shares memory with this array
+        wherever numpy indexing does.
+        """
+        return StokesArray(self.data[index])
+
+
+    @property
+    def shape(self):
+        return self.data.shape[:-1]
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def I(self):
+        return self.data[...,0]
+
+    @I.setter
+    def I(self, value):
+        self.data[...,0] = value
+
+    @property
+    def Q(self):
+        return self.data[...,1]
+
+    @Q.setter
+    def Q(self, value):
+        self.data[...,1] = value
+
+    @property
+    def U(self):
+        return self.data[...,2]
+
+    @U.setter
+    def U(self, value):
+        self.data[...,2] = value
+
+    @property
+    def V(self):
+        return self.data[...,3]
+
+    @V.setter
+    def V(self, value):
+        self.data[...,3] = value
+
+
+    def _out(self, out):
+        """
+        Array to write a derived quantity into: `out`, or a new array with
+        the batch shape. A new array is 0-d (rather than a numpy scalar) for
+        a single Stokes vector, so it can be passed on as `out` again.
+        """
+        return np.empty(self.shape, dtype=self.dtype) if out is None else out
+
+
+    def polarised_intensity(self, out=None):
+        """
+        sqrt(Q^2 + U^2 + V^2), written into `out` if given.
+        """
+        out = np.hypot(self.Q, self.U, out=self._out(out))
+        return np.hypot(out, self.V, out=out)
+
+
+    def is_physical(self, tolerance=0.):
+        """
+        Boolean array that is True where the Stokes vector is physical:
+        I >= 0 and Q^2 + U^2 + V^2 <= I^2 (with a relative `tolerance`).
+        """
+        return (self.I >= 0) & (self.polarised_intensity() <= self.I * (1 + tolerance))
+
+
+    def validate(self, tolerance=0.):
+        """
+        Raise a ValueError if any Stokes vector in the array is unphysical.
+        """
+        physical = self.is_physical(tolerance)
+        if not physical.all():
+            raise ValueError(f"{physical.size - np.count_nonzero(physical)} of {physical.size} Stokes vectors are unphysical")
+
+
+    def DoP(self, out=None):
+        """
+        Degree of polarisation, written into `out` if given.
+        """
+        out = self.polarised_intensity(out=out)
+        return np.divide(out, self.I, out=out)
+
+
+    def DoLP(self, out=None):
+        """
+        Degree of linear polarisation, written into `out` if given.
+        """
+        out = np.hypot(self.Q, self.U, out=self._out(out))
+        return np.divide(out, self.I, out=out)
+
+
+    def AoLP(self, out=None):
+        """
+        Angle of linear polarisation in radians, written into `out` if given.
+        """
+        out = np.arctan2(self.U, self.Q, out=self._out(out))
+        return np.multiply(out, 0.5, out=out)
+
+
+    def AoLP_deg(self, out=None):
+        """
+        Angle of linear polarisation in degrees, written into `out` if given.
+        """
+        out = np.arctan2(self.U, self.Q, out=self._out(out))
+        return np.multiply(out, 0.5 * 180 / np.pi, out=out)
+
+
+    def normalise(self):
+        """
+        Divide all components by I, in place, and return this object.
+        """
+        np.divide(self.data, self.I[...,np.newaxis], out=self.data)
+        return self
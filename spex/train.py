@@ -0,0 +1,228 @@
+"""
+Optical trains: ordered chains of polarisation elements that are multiplied
+into a single system Mueller matrix per wavelength.
+"""
+import numpy as np
+from . import elements
+from .cache import LRUCache, wavelength_fingerprint, hashable, qualified_name, cached_element
+from .precision import get_dtype
+
+
+def propagate_intensity(matrices, source):
+    """
+    Propagate a `source` Stokes vector through a chain of Mueller `matrices`
+    (first element first) and return only the resulting intensity (Stokes I).
+
+    Instead of multiplying full 4x4 matrices, the source vector is carried
+    forward through the elements before the largest one in the chain, and the
+    first row (1x4) of the detector is carried backward through the elements
+    after it. The largest element is then contracted with both in a single
+    einsum, so that no (..., 4) intermediate is made at its batch size.
+    This allows e.g. a (R, L, 4, 4) stack of foils to be evaluated without
+    storing (R, L, 4) Stokes vectors.
+
+    The matrices and `source` (shape (..., L, 4)) are broadcast against each
+    other. The result has the broadcast shape without the Stokes axis, and
+    the precision of the matrices.
+    """
+    matrices = [np.asarray(matrix) for matrix in matrices]
+    if len(matrices) == 0:
+        return np.asarray(source)[...,0]
+    dtype = np.result_type(*matrices)
+
+    # Find the element with the largest stack
+    k = int(np.argmax([matrix.size for matrix in matrices]))
+
+    # Carry the source forward up to the largest element
+    vector = np.asarray(source, dtype=dtype)
+    for matrix in matrices[:k]:
+        vector = np.einsum("...ij,...j->...i", matrix, vector)
+
+    # Carry the first row backward down to the largest element
+    row = np.array([1., 0., 0., 0.], dtype=dtype)
+    for matrix in matrices[:k:-1]:
+        row = np.einsum("...i,...ij->...j", row, matrix)
+
+    intensity = np.einsum("...i,...ij,...j->...", row, matrices[k], vector)
+    return intensity
+
+
+class Element(object):
+    """
+    A single optical element, described by a constructor from `spex.elements`
+    and the parameters passed to it.
+    Wavelength-dependent constructors (such as `Retarder_wavelengths`) take the
+    wavelength grid as their last argument; it is not part of `parameters`.
+    """
+    def __init__(self, constructor, *parameters, wavelength_dependent=False, name=None):
+        self.constructor = constructor
+        self.parameters = parameters
+        self.wavelength_dependent = wavelength_dependent
+        self.name = constructor.__name__ if name is None else name
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        parameters = ", ".join(str(p) for p in self.parameters)
+        return f"{self.name}({parameters})"
+
+
+    @property
+    def key(self):
+        """
+        Hashable description of this element, used for caching.
+        """
+        return (qualified_name(self.constructor), tuple(hashable(p) for p in self.parameters))
+
+
+    def matrix(self, wavelengths):
+        """
+        Mueller matrix of this element, either as a single (4, 4) matrix or as
+        a stack (L, 4, 4) for wavelength-dependent elements.
+        If caching is enabled through `spex.cache.enable`, the matrix is
+        looked up in the element cache first.
+        """
+        if self.wavelength_dependent:
+            return cached_element(self.constructor, *self.parameters, wavelengths=wavelengths)
+        else:
+            return cached_element(self.constructor, *self.parameters)
+
+
+def Retarder(d_nm, t):
+    """
+    Retarder with a retardance `d_nm` in nm at an angle `t` in degrees.
+    """
+    return Element(elements.Retarder_wavelengths, d_nm, t, wavelength_dependent=True, name="Retarder")
+
+
+def Polarizer(phi_degrees):
+    """
+    Ideal linear polarizer at an angle `phi_degrees`.
+    """
+    return Element(elements.Linear_polarizer_degrees, phi_degrees, name="Polarizer")
+
+
+def Polarizer_general(kx, ky, phi_degrees=0):
+    """
+    Partial linear polarizer with transmittances `kx` and `ky` at an angle `phi_degrees`.
+    """
+    return Element(elements.Linear_polarizer_general, kx, ky, phi_degrees, name="Polarizer_general")
+
+
+def Filter(attenuation):
+    """
+    Neutral filter with a given `attenuation`.
+    """
+    return Element(elements.Filter, attenuation, name="Filter")
+
+
+class OpticalTrain(object):
+    """
+    An ordered chain of optical elements.
+    The elements are given in the order in which light passes through them.
+    The system Mueller matrix is calculated once per wavelength grid and
+    cached (for the `maxsize` most recently used grids), so propagating many sources through the same instrument only
+    costs one matrix-vector product per source.
+    """
+    def __init__(self, elements, maxsize=8):
+        """
+        Create the object.
+        elements: Ordered list of `Element` objects, first element first.
+        maxsize: Maximum number of cached system matrices and intensity rows.
+        """
+        self.elements = list(elements)
+        self._cache = LRUCache(maxsize=maxsize)
+
+
+    def __repr__(self):
+        """
+        The string that gets printed to describe this object.
+        """
+        return "OpticalTrain: " + " -> ".join(repr(element) for element in self.elements)
+
+
+    def __len__(self):
+        return len(self.elements)
+
+
+    @property
+    def key(self):
+        """
+        Hashable description of the whole chain, used for caching.
+        """
+        return tuple(element.key for element in self.elements)
+
+
+    def matrices(self, wavelengths):
+        """
+        Mueller matrices of the individual elements, in order.
+        """
+        return [element.matrix(wavelengths) for element in self.elements]
+
+
+    def system_matrix(self, wavelengths):
+        """
+        Calculate the system Mueller matrix M_N @ ... @ M_1 for every
+        wavelength, with shape (L, 4, 4).
+        The result is cached on the element parameters, wavelength grid and
+        working precision.
+        """
+        key = (self.key, wavelength_fingerprint(wavelengths), get_dtype().str)
+
+        def build():
+            # Multiply the elements, broadcasting constant (4, 4) matrices over wavelength
+            system = np.broadcast_to(np.eye(4, dtype=get_dtype()), (len(wavelengths), 4, 4))
+            for matrix in self.matrices(wavelengths):
+                system = matrix @ system
+            return system
+
+        return self._cache.get(key, build)
+
+
+    def intensity_row(self, wavelengths):
+        """
+        Calculate the first row of the system Mueller matrix, with shape
+        (L, 4), by carrying the row vector [1, 0, 0, 0] backward through the
+        elements. This is all that is needed to calculate intensities.
+        The result is cached on the element parameters, wavelength grid and
+        working precision.
+        """
+        key = ("intensity", self.key, wavelength_fingerprint(wavelengths), get_dtype().str)
+
+        def build():
+            row = np.broadcast_to(np.array([1., 0., 0., 0.], dtype=get_dtype()), (len(wavelengths), 4))
+            for matrix in self.matrices(wavelengths)[::-1]:
+                row = np.einsum("...i,...ij->...j", row, matrix)
+            return row
+
+        return self._cache.get(key, build)
+
+
+    def clear_cache(self):
+        """
+        Remove all cached system matrices.
+        """
+        self._cache.clear()
+
+
+    def propagate(self, wavelengths, source):
+        """
+        Propagate a `source` Stokes vector through the optical train.
+        `source` has a shape (L, 4), or (..., L, 4) for a batch of sources.
+        The result has the same shape as `source`.
+        """
+        system = self.system_matrix(wavelengths)
+        return np.einsum("wij,...wj->...wi", system, np.asarray(source, dtype=system.dtype))
+
+
+    def propagate_intensity(self, wavelengths, source):
+        """
+        Propagate a `source` Stokes vector through the optical train and
+        return only the resulting intensity (Stokes I).
+        `source` has a shape (L, 4), or (..., L, 4) for a batch of sources.
+        The result has a shape (L,) or (..., L).
+        """
+        row = self.intensity_row(wavelengths)
+        return np.einsum("wj,...wj->...w", row, np.asarray(source, dtype=row.dtype))
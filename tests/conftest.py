@@ -0,0 +1,73 @@
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+SPECTROMETERS = ("1105161U2", "1105162U2")
+
+
+def write_folder(folder, nr_files=4, nr_spectra=3, seed=1, start=0):
+    """
+    Write a synthetic groundSPEX folder: spectrum, dark and timestamp files
+    for both spectrometers, in the Avantes layout.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for spectrometer in SPECTROMETERS:
+        for i in range(start, start+nr_files):
+            filename = folder/f"Spectrometer_{spectrometer}_{i}_pix.txt"
+            filename.write_text("".join(f"{c}," for c in rng.integers(0, 2**16, nr_spectra*3648)))
+            dark = rng.integers(0, 2**12, (nr_spectra, 13))
+            filename.with_suffix(".dark13.txt").write_text("".join("".join(f"{c}," for c in row) + "\n" for row in dark))
+            timestamps = np.sort(rng.integers(0, 10**6, nr_spectra)) + 10**6 * i
+            filename.with_suffix(".timestamps.txt").write_text("".join(f"{t}\n" for t in timestamps))
+    return folder
+
+
+def load_baseline(filename):
+    """
+    The original (general) loaders, using np.genfromtxt and np.loadtxt.
+    """
+    counts = np.genfromtxt(filename, delimiter=",")[:-1]
+    if len(counts) > 3648:
+        counts = counts.reshape((-1, 3648))
+    dark = np.genfromtxt(filename.with_suffix(".dark13.txt"), delimiter=",")[...,:13]
+    timestamps = np.loadtxt(filename.with_suffix(".timestamps.txt"), dtype=np.int64)
+    return counts, dark, timestamps
+
+
+@pytest.fixture
+def folder(tmp_path):
+    return write_folder(tmp_path/"data")
+
+
+@pytest.fixture
+def folder_single(tmp_path):
+    return write_folder(tmp_path/"data_single", nr_files=3, nr_spectra=1)
+
+
+@pytest.fixture
+def calibration():
+    """
+    Synthetic calibration data for `data_processing.correct_chunks`, so that
+    the groundSPEX calibration files are not needed.
+    """
+    from groundspex.data_processing import generate_wavelengths
+    rng = np.random.default_rng(3)
+    darkmap = SimpleNamespace(darkmodblack=rng.normal(size=(2, 13, 5, 5))*1e-6, darkmodspec=rng.normal(size=(2, 3648, 5, 5))*1e-6)
+    return dict(darkmap=darkmap, wavelengths=generate_wavelengths(), transmission_correction_data=np.ones(3648))
+
+
+def load_folder_baseline(folder):
+    """
+    The original `load_data_folder`, built on `load_baseline`. That crashed
+    on files with a single timestamp; those are given as [N, 2] here.
+    """
+    from groundspex.io import get_filenames
+    filenames = get_filenames(folder)
+    products = []
+    for k in range(3):
+        data = np.array([[load_baseline(f)[k] for f in channel] for channel in filenames])
+        products.append(np.squeeze(np.moveaxis(data, (1, 2), (0, 1)) if data.ndim > 2 else data.T))
+    return tuple(products)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from spex import cache, elements
+from spex.precision import precision
+
+wavelengths = np.linspace(400, 700, 31)
+
+
+@pytest.fixture
+def element_cache():
+    yield cache.enable(maxsize=4)
+    cache.disable()
+
+
+def test_lru_eviction():
+    lru = cache.LRUCache(maxsize=2)
+    for key in "abc":
+        lru.get(key, lambda: np.zeros(3))
+    assert "a" not in lru and "b" in lru and "c" in lru
+    lru.get("b", lambda: np.ones(3))
+    lru.get("d", lambda: np.zeros(3))
+    assert "c" not in lru and "b" in lru
+    assert lru.info()[:3] == (1, 4, 2)
+
+
+def test_lru_bytes_and_read_only():
+    lru = cache.LRUCache(maxbytes=100)
+    value = lru.get("small", lambda: np.zeros(10))
+    assert not value.flags.writeable
+    lru.get("large", lambda: np.zeros(20))
+    assert "large" not in lru and lru.nbytes == 80
+
+
+def test_cached_element(element_cache):
+    first = cache.cached_element(elements.Retarder_wavelengths, 140., 0., wavelengths=wavelengths)
+    second = cache.cached_element(elements.Retarder_wavelengths, 140., 0., wavelengths=wavelengths)
+    assert first is second and element_cache.hits == 1
+    assert np.array_equal(first, elements.Retarder_wavelengths(140., 0., wavelengths))
+
+    # A different grid or precision gives a different entry
+    assert cache.cached_element(elements.Retarder_wavelengths, 140., 0., wavelengths=wavelengths[:-1]).shape[0] == len(wavelengths) - 1
+    with precision(np.float32):
+        assert cache.cached_element(elements.Retarder_wavelengths, 140., 0., wavelengths=wavelengths).dtype == np.float32
+
+
+def test_disabled_by_default():
+    assert cache.element_cache() is None
+    first = cache.cached_element(elements.Linear_polarizer_degrees, 0.)
+    assert first is not cache.cached_element(elements.Linear_polarizer_degrees, 0.)
+
+
+def test_constructors_with_the_same_name(element_cache):
+    # A constructor from another module with the same name as one in spex.elements
+    def Filter(attenuation):
+        return np.zeros((4, 4))
+    assert not np.array_equal(cache.cached_element(elements.Filter, 0.5), cache.cached_element(Filter, 0.5))
+    assert len(element_cache) == 2
@@ -0,0 +1,39 @@
+import numpy as np
+from spex import elements
+
+wavelengths = np.linspace(400, 700, 7)
+
+
+def test_retarder_grid_matches_loop():
+    d_nm = np.array([[130.], [140.], [150.]])
+    t = np.array([[-5.], [0.], [5.]])
+    stack = elements.Retarder_wavelengths(d_nm, t, wavelengths)
+    assert stack.shape == (3, len(wavelengths), 4, 4)
+    for k in range(3):
+        for l, wavelength in enumerate(wavelengths):
+            expected = elements.Retarder_frac_deg(d_nm[k,0] / wavelength, t[k,0])
+            assert np.allclose(stack[k,l], expected)
+
+
+def test_closed_form_retarder_matches_rotation():
+    delta, phi = 1.3, np.deg2rad(25.)
+    unrotated = elements.Retarder_radians(delta, 0.)
+    assert np.allclose(elements.Retarder_radians(delta, phi), elements.rotate_element_radians(unrotated, phi))
+
+
+def test_polarizers_broadcast():
+    angles = np.array([0., 30., 90.])
+    stack = elements.Linear_polarizer_degrees(angles)
+    assert stack.shape == (3, 4, 4)
+    for matrix, angle in zip(stack, angles):
+        assert np.allclose(matrix, elements.Linear_polarizer_degrees(angle))
+
+    general = elements.Linear_polarizer_general(np.array([1., 0.9]), 0., angles[:,np.newaxis])
+    assert general.shape == (3, 2, 4, 4)
+    assert np.allclose(general[:,0], stack)
+
+
+def test_filter():
+    stack = elements.Filter(np.array([0.5, 1.]))
+    assert stack.shape == (2, 4, 4)
+    assert np.allclose(stack[0], 0.5 * np.eye(4))
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from spex import stokes
+from spex.emulator import ErrorTable
+from spex.margins import D_err, A_err, simulate_and_retrieve
+
+wavelengths = np.arange(450, 700, 1.)
+# (0.8, -0.8) is outside the unit disc; cells next to it interpolate to NaN
+Qrange = np.array([0.2, 0.5, 0.8])
+Urange = np.array([-0.8, -0.5, -0.2])
+parameters = {"QWP_t": np.linspace(-4, 4, 5), "MOR1_t": np.linspace(-2, 2, 3)}
+
+
+@pytest.fixture(scope="module")
+def table():
+    return ErrorTable.build(wavelengths, Qrange, Urange, parameters, batch_size=4)
+
+
+def test_grid_points_match_simulation(table):
+    assert table.DoLP_errors.shape == (3, 3, 5, 3)
+    assert np.all(np.isnan(table.DoLP_errors[2,0])) and not np.any(np.isnan(table.DoLP_errors[1,1]))
+
+    Q, U = 0.5, -0.2
+    source = stokes.Stokes_nm(np.ones_like(wavelengths), Q, U, 0.)
+    DoLPs, AoLPs = simulate_and_retrieve(wavelengths, source, QWP_t=np.array([2.]), MOR1_t=np.array([-2.]))
+    DoLP_error, AoLP_error = table(Q, U, QWP_t=2., MOR1_t=-2.)
+    assert np.isclose(DoLP_error, D_err(DoLPs, stokes.DoLP(1., Q, U, 0.))[0], atol=1e-6)
+    assert np.isclose(AoLP_error, A_err(AoLPs, stokes.AoLP_deg(1., Q, U, 0.))[0], atol=1e-4)
+
+
+def test_interpolation_and_bounds(table):
+    DoLP_errors, AoLP_errors = table(0.2, -0.5, QWP_t=np.linspace(-4, 4, 9))
+    assert DoLP_errors.shape == AoLP_errors.shape == (9,)
+    assert np.isclose(DoLP_errors[1], table.DoLP_errors[0,1,0:2,1].mean())
+    assert np.isnan(table(0.2, -0.5, QWP_t=5.)[0])
+    with pytest.raises(TypeError):
+        table(0.6, 0., POL_t=1.)
+
+
+def test_save_and_load(table, tmp_path):
+    table.save(tmp_path/"table.npz")
+    loaded = ErrorTable.load(tmp_path/"table.npz")
+    assert loaded.parameters == table.parameters and loaded.instrument == table.instrument
+    assert np.array_equal(loaded.AoLP_errors, table.AoLP_errors, equal_nan=True)
+
+
+def test_queries_near_empty_cells():
+    # The origin (Q = U = 0) and the corners (outside the unit disc) have no values
+    table = ErrorTable.build(wavelengths, [-0.8, 0., 0.8], [-0.8, 0., 0.8], {"QWP_t": np.linspace(-4, 4, 3)})
+    assert np.isnan(table.DoLP_errors[1,1]).all() and np.isnan(table.DoLP_errors[0,0]).all()
+
+    # A valid grid point next to empty cells gives its own value
+    DoLP_error, AoLP_error = table(0.8, 0., QWP_t=4.)
+    assert np.isclose(DoLP_error, table.DoLP_errors[2,1,2]) and np.isclose(AoLP_error, table.AoLP_errors[2,1,2])
+
+    # Close to the origin, the valid neighbours are interpolated
+    DoLP_error, AoLP_error = table(0.05, 0.05, QWP_t=4.)
+    neighbours = table.DoLP_errors[[1,2],[2,1],2]
+    assert np.isfinite(AoLP_error) and neighbours.min() <= DoLP_error <= neighbours.max()
+
+    # Near the edge of the disc as well, but not outside it
+    assert np.isfinite(table(0.7, -0.7, QWP_t=0.)[0])
+    assert np.isnan(table(0.8, -0.8, QWP_t=0.)[0])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from conftest import write_folder
+from groundspex import io, data_processing
+from groundspex.archive import CampaignArchive, convert_folder
+
+
+def test_append_read_truncate(tmp_path):
+    archive = CampaignArchive(tmp_path/"archive")
+    archive.append(source="a", x=np.arange(6).reshape(3, 2), y=np.ones(3))
+    archive.append(source="b", x=np.arange(6, 10).reshape(2, 2), y=np.zeros(2))
+    assert len(archive) == 5
+    assert np.array_equal(archive["x"], np.arange(10).reshape(5, 2))
+    assert np.array_equal(archive.read(2, 4, ["y"])["y"], [1, 0])
+    with pytest.raises(ValueError):
+        archive.append(x=np.zeros((1, 3)), y=np.zeros(1))
+
+    archive.truncate(3)
+    reopened = CampaignArchive(tmp_path/"archive")
+    assert len(reopened) == 3 and [entry["source"] for entry in reopened.sources] == ["a"]
+    assert np.array_equal(reopened["x"], np.arange(6).reshape(3, 2))
+
+
+def test_convert_folder_matches_iterator(folder, tmp_path):
+    archive = convert_folder(folder, tmp_path/"archive", chunk_size=3)
+    chunks = list(io.iterate_data_folder(folder))
+    for k, product in enumerate(["data", "data_dark", "data_timestamps"]):
+        assert np.array_equal(archive[product], np.concatenate([chunk[k] for chunk in chunks]))
+
+    # Converting the same folder again does nothing
+    length = len(archive)
+    assert len(convert_folder(folder, archive)) == length
+
+
+def test_convert_folder_resumes_interrupted(folder, tmp_path):
+    archive = convert_folder(folder, tmp_path/"archive", chunk_size=3)
+    expected = np.array(archive["data"])
+    archive.index["complete"] = []
+    archive.truncate(5)
+    archive = convert_folder(folder, CampaignArchive(tmp_path/"archive"), chunk_size=3)
+    assert np.array_equal(archive["data"], expected)
+
+
+def test_convert_folder_corrected(folder, tmp_path, calibration):
+    archive = convert_folder(folder, tmp_path/"archive", corrected=True, **calibration)
+    chunk = next(io.iterate_data_folder(folder))
+    wavelengths, expected, _ = next(data_processing.correct_chunks(iter([chunk]), **calibration))
+    assert np.allclose(archive["data_corrected"][:len(expected)], expected, equal_nan=True)
+    assert np.array_equal(np.load(archive.folder/"wavelengths.npy"), wavelengths)
+
+    # A folder without new data does not need the wavelengths
+    empty = tmp_path/"empty"
+    empty.mkdir()
+    assert len(convert_folder(empty, archive, corrected=True, **calibration)) == len(archive)
+
+
+def test_convert_folder_compact(folder, tmp_path):
+    archive = convert_folder(folder, tmp_path/"archive", compact=True)
+    assert archive["data"].dtype == io.COMPACT_DTYPE
+    chunks = list(io.iterate_data_folder(folder))
+    assert np.array_equal(archive.raw("data").to_float(), np.concatenate([chunk[0] for chunk in chunks]))
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import pytest
+from conftest import load_folder_baseline
+from groundspex import io
+
+
+@pytest.mark.parametrize("fixture", ["folder", "folder_single"])
+def test_load_data_folder_matches_baseline(fixture, request):
+    folder = request.getfixturevalue(fixture)
+    for loaded, expected in zip(io.load_data_folder(folder), load_folder_baseline(folder)):
+        if fixture == "folder_single" and expected.ndim == 3:
+            # The original put the spectrometer axis last for files with a single spectrum
+            expected = np.swapaxes(expected, 1, 2)
+        assert loaded.shape == expected.shape
+        assert np.array_equal(loaded, expected)
+
+
+def test_no_cache_by_default(folder):
+    io.load_data_folder(folder)
+    assert not (folder/io.CACHE_FOLDER).exists()
+
+
+def test_cache_round_trip(folder):
+    first = io.load_data_folder(folder, cache=True)
+    assert (folder/io.CACHE_FOLDER/"signature.json").exists()
+    second = io.load_data_folder(folder, cache=True)
+    for a, b in zip(first, second):
+        assert isinstance(b, np.memmap)
+        assert np.array_equal(a, b)
+
+    # Cached arrays can be corrected in place, without changing the cache
+    second[0][...] = 0
+    third = io.load_data_folder(folder, cache=True)
+    assert np.array_equal(third[0], first[0])
+
+
+def test_cache_invalidated_by_changes(folder):
+    io.load_data_folder(folder, cache=True)
+    filename = io.get_filenames(folder)[0][0]
+    filename.write_text("".join("1," for _ in range(3*3648)))
+    os.utime(filename, ns=(0, 0))
+    data = io.load_data_folder(folder, cache=True)[0]
+    assert np.all(data[0,:,0] == 1)
+
+
+def test_unwritable_folder(folder, monkeypatch):
+    def fail(*args, **kwargs):
+        raise PermissionError
+    monkeypatch.setattr(io.Path, "mkdir", fail)
+    data = io.load_data_folder(folder, cache=True)
+    assert np.array_equal(data[0], load_folder_baseline(folder)[0])
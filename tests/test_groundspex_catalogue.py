@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from groundspex import io
+
+
+@pytest.mark.parametrize("fixture", ["folder", "folder_single"])
+def test_catalogue_matches_loaded_data(fixture, request):
+    folder = request.getfixturevalue(fixture)
+    catalogue = io.ExposureCatalogue.build(folder)
+    assert np.all(np.diff(catalogue.timestamps) >= 0)
+
+    data, data_dark, data_timestamps = [np.asarray(array) for array in io.load_data_folder(folder)]
+    if data.ndim == 3:  # One spectrum per file
+        data, data_dark, data_timestamps = data[:,np.newaxis], data_dark[:,np.newaxis], data_timestamps[:,np.newaxis]
+    for spectrometer in (0, 1):
+        selection = catalogue.between(spectrometer=spectrometer)
+        files, spectra = selection.entries["file_number"], selection.entries["spectrum"]
+        assert np.array_equal(selection.timestamps, data_timestamps[files, spectra, spectrometer])
+        assert np.array_equal(selection.load_spectra(), data[files, spectra, spectrometer])
+        assert np.array_equal(selection.load_dark(), data_dark[files, spectra, spectrometer])
+
+
+def test_between(folder):
+    catalogue = io.ExposureCatalogue.build(folder)
+    start, stop = catalogue.timestamps[3], catalogue.timestamps[10]
+    selection = catalogue.between(start, stop)
+    assert len(selection) == 7
+    assert np.all((selection.timestamps >= start) & (selection.timestamps < stop))
+
+
+def test_load_dark_reads_each_file_once(folder, monkeypatch):
+    calls = []
+    load = io.load_data_file_dark
+    monkeypatch.setattr(io, "load_data_file_dark", lambda filename: calls.append(filename) or load(filename))
+    catalogue = io.ExposureCatalogue.build(folder)
+    catalogue.load_dark()
+    assert len(calls) == len(set(calls)) == len(set(catalogue.entries["file"]))
+
+
+def test_save_and_load(folder):
+    catalogue = io.ExposureCatalogue.load(folder)
+    assert (folder/io.CACHE_FOLDER/"catalogue.npy").exists()
+    again = io.ExposureCatalogue.load(folder)
+    assert np.array_equal(again.entries, catalogue.entries)
+
+
+def test_load_spectra_falls_back_on_text(folder):
+    catalogue = io.ExposureCatalogue.build(folder)
+    entry = catalogue.entries[0]
+    filename = folder/entry["file"]
+    text = filename.read_bytes()
+    filename.write_bytes(text[:entry["offset"]] + b"x" + text[entry["offset"]+1:])
+    spectrum = catalogue[:1].load_spectra()[0]
+    assert np.isnan(spectrum[0])
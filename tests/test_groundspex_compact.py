@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from groundspex import io, data_processing
+
+
+def test_from_float_roundtrip():
+    data = np.array([[0., 1., np.nan], [65535., 2., 3.]])
+    raw = io.RawCounts.from_float(data)
+    assert raw.dtype == io.COMPACT_DTYPE and raw.nbytes < data.nbytes
+    assert np.array_equal(raw.mask, np.isnan(data))
+    assert np.array_equal(raw.to_float(), data, equal_nan=True)
+    assert np.array_equal(raw[1].to_float(), data[1])
+
+    # Without missing values, there is no mask
+    assert io.RawCounts.from_float(data[1]).mask is None
+
+
+@pytest.mark.parametrize("data", [[1.5, 2.], [-1., 2.], [70000., 2.]])
+def test_from_float_not_exact(data):
+    with pytest.raises(ValueError):
+        io.RawCounts.from_float(np.array(data))
+
+
+def test_load_data_bulk_compact(folder):
+    filenames1, filenames2 = io.get_filenames(folder)
+    data = io.load_data_bulk(filenames1, filenames2)
+    raw = io.load_data_bulk(filenames1, filenames2, compact=True)
+    assert isinstance(raw, io.RawCounts) and raw.shape == data.shape
+    assert np.array_equal(raw.to_float(), data)
+
+
+def test_cache_roundtrip_with_mask(folder):
+    # Make one value missing, so the cache has to store a mask
+    filename = sorted(folder.glob("*_pix.txt"))[0]
+    text = filename.read_text()
+    filename.write_text("NaN" + text[text.index(","):])
+
+    first = io.load_data_folder(folder, cache=True, compact=True)
+    assert (folder/io.CACHE_FOLDER/"data_mask.npy").exists()
+    assert not list((folder/io.CACHE_FOLDER).glob("*.tmp.*"))
+
+    cached = io.load_data_folder(folder, cache=True, compact=True)
+    floats = io.load_data_folder(folder)
+    for a, b, reference in zip(first[:2], cached[:2], floats[:2]):
+        assert isinstance(b, io.RawCounts)
+        assert np.array_equal(b.to_float(), a.to_float(), equal_nan=True)
+        assert np.array_equal(b.to_float(), reference, equal_nan=True)
+    assert np.isnan(cached[0].to_float()).sum() == 1
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_correct_chunks_compact(folder, calibration, dtype):
+    reference = list(data_processing.correct_chunks(io.iterate_data_folder(folder, chunk_size=2), **calibration))
+    compact = list(data_processing.correct_chunks(io.iterate_data_folder(folder, chunk_size=2, compact=True), dtype=dtype, **calibration))
+    for (wavelengths, data, timestamps), (wavelengths_c, data_c, timestamps_c) in zip(reference, compact):
+        assert data_c.dtype == dtype
+        assert np.array_equal(timestamps, timestamps_c)
+        # float32 keeps about 7 significant digits of the largest values
+        tolerance = 1e-6 if dtype == np.float32 else 1e-14
+        np.testing.assert_allclose(data_c, data, rtol=0, atol=tolerance*np.abs(data).max())
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from conftest import load_baseline
+from groundspex import io
+
+
+def test_parse_numbers():
+    assert np.array_equal(io.parse_numbers(b"1,2,3,\n4 5;6\t"), [1, 2, 3, 4, 5, 6])
+    assert io.parse_numbers(b"1,2,3,", dtype=np.int64).dtype == np.int64
+    assert io.parse_numbers(b"1,2,x,4,") is None
+
+
+@pytest.mark.parametrize("fixture", ["folder", "folder_single"])
+def test_fast_loaders_match_baseline(fixture, request):
+    folder = request.getfixturevalue(fixture)
+    for filename in sum(io.get_filenames(folder), []):
+        counts, dark, timestamps = load_baseline(filename)
+        assert np.array_equal(io.load_data_file(filename), counts)
+        assert np.array_equal(io.load_data_file_dark(filename), dark)
+        timestamp = io.load_data_file_timestamp(filename)
+        assert np.array_equal(timestamp, timestamps) and timestamp.shape == timestamps.shape
+
+
+def test_malformed_files_fall_back(tmp_path):
+    filename = tmp_path/"Spectrometer_1105161U2_0_pix.txt"
+    filename.write_text("1,2,x,4,")
+    filename.with_suffix(".dark13.txt").write_text("1,2,3,4,5,6,x,8,9,10,11,12,13,\n")
+    filename.with_suffix(".timestamps.txt").write_text("12\n")
+    assert io.parse_pixel_file(filename) is None
+    counts, dark, _ = load_baseline(filename)
+    assert np.array_equal(io.load_data_file(filename), counts, equal_nan=True)
+    assert np.isnan(io.load_data_file(filename)[2])
+    assert np.array_equal(io.load_data_file_dark(filename), dark, equal_nan=True)
+
+
+def test_empty_fields_fall_back(tmp_path):
+    filename = tmp_path/"Spectrometer_1105161U2_0_pix.txt"
+    filename.write_text("1,,3,4,")
+    assert np.array_equal(io.load_data_file(filename), [1, np.nan, 3, 4], equal_nan=True)
+
+
+@pytest.mark.parametrize("fixture", ["folder", "folder_single"])
+def test_load_data_bulk_matches_original(fixture, request):
+    filenames1, filenames2 = io.get_filenames(request.getfixturevalue(fixture))
+    # The original load_data_bulk
+    expected = np.array([[load_baseline(f)[0] for f in filenames] for filenames in [filenames1, filenames2]])
+    expected = np.squeeze(np.moveaxis(expected, (1, 2), (0, 1)))
+    assert np.array_equal(io.load_data_bulk(filenames1, filenames2), expected)
+    with pytest.raises(ValueError):
+        io.load_data_bulk(filenames1, filenames2[:-1])
+
+
+def test_load_data_bulk_shape_mismatch(folder):
+    filenames1, filenames2 = io.get_filenames(folder)
+    filenames2[-1].write_text("1,2,3,")
+    with pytest.raises(ValueError):
+        io.load_data_bulk(filenames1, filenames2)
+
+
+def test_parse_numbers_checks_fields():
+    assert io._count_fields(b" 1, 2,,3\n") == 3
+    assert io.parse_numbers(b"   ") is not None and len(io.parse_numbers(b"   ")) == 0
+    assert io.parse_numbers(b"12x,3,") is None
+    assert io.parse_numbers(b"12.5\n13\n", dtype=np.int64) is None
+    assert np.isnan(io.parse_numbers(b"NaN,1,")[0])
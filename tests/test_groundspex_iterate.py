@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from groundspex import io
+
+
+@pytest.mark.parametrize("fixture", ["folder", "folder_single"])
+@pytest.mark.parametrize("chunk_size", [1, 3, 50])
+def test_chunks_match_load_data_folder(fixture, chunk_size, request):
+    folder = request.getfixturevalue(fixture)
+    data, data_dark, data_timestamps = io.load_data_folder(folder)
+    chunks = list(io.iterate_data_folder(folder, chunk_size=chunk_size))
+    assert len(chunks) == -(-len(io.get_filenames(folder)[0]) // chunk_size)
+
+    for loaded, streamed in zip((data, data_dark, data_timestamps), zip(*chunks)):
+        streamed = np.concatenate(streamed)
+        assert streamed.shape[1] == 2
+        assert np.array_equal(loaded.reshape(streamed.shape), streamed)
+
+
+def test_single_spectrum_axis_order(folder_single):
+    data, data_dark, data_timestamps = io.load_data_folder(folder_single)
+    chunk = next(io.iterate_data_folder(folder_single))
+    assert data.shape == chunk[0].shape == (3, 2, 3648)
+    assert data_dark.shape == chunk[1].shape == (3, 2, 13)
+    assert data_timestamps.shape == chunk[2].shape == (3, 2)
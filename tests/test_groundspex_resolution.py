@@ -0,0 +1,24 @@
+import numpy as np
+from groundspex import demodulation
+from groundspex.data_processing import generate_wavelengths
+from spex.resolution import convolve_lsf
+
+wavelengths = generate_wavelengths()[0]  # Non-uniform pixel grid of the first spectrometer
+dolp = np.full_like(wavelengths, 0.5)
+aolp = np.zeros_like(wavelengths)
+
+
+def test_modulation_is_smoothed():
+    sharp = demodulation.modulation_normalised(wavelengths, dolp, aolp)
+    smooth = demodulation.modulation_normalised(wavelengths, dolp, aolp, fwhm=5.)
+    assert np.abs(smooth).max() < np.abs(sharp).max()
+    assert np.allclose(smooth, convolve_lsf(wavelengths, sharp, 5.))
+
+
+def test_modulation_with_varying_fwhm():
+    # The LSF of the Avantes spectrometers broadens towards the red
+    fwhm = np.linspace(1., 3., len(wavelengths))
+    Splus, Smin = demodulation.modulation(wavelengths, np.ones_like(wavelengths), dolp, aolp, fwhm=fwhm)
+    assert np.allclose(Splus + Smin, 1.)
+    assert np.array_equal(demodulation.modulation(wavelengths, np.ones_like(wavelengths), dolp, aolp, fwhm=np.zeros_like(wavelengths))[0],
+                          demodulation.modulation(wavelengths, np.ones_like(wavelengths), dolp, aolp)[0])
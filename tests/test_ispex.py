@@ -0,0 +1,42 @@
+import numpy as np
+import spex
+from spex import stokes
+
+wavelengths = np.arange(450, 700, 1.)
+source = stokes.Stokes_nm(np.ones_like(wavelengths), 0.3, 0.4, 0.)
+
+
+def test_iSPEX_sweep_matches_single_simulations():
+    prange = np.linspace(-5, 5, 3)
+    Is = spex.simulate_iSPEX_sweep(wavelengths, source, QWP_t=prange)
+    for I, x in zip(Is, prange):
+        assert np.allclose(I, spex.simulate_iSPEX(wavelengths, source, QWP_t=x)[0])
+
+
+def test_iSPEX2_sweep_matches_single_simulations():
+    prange = np.linspace(-5, 5, 3)
+    I0s, I90s = spex.simulate_iSPEX2_sweep(wavelengths, source, POL0_t=prange)
+    assert I0s.shape == I90s.shape == (3, len(wavelengths))
+    for I0, I90, x in zip(I0s, I90s, prange):
+        expected = spex.simulate_iSPEX2(wavelengths, source, POL0_t=x)
+        assert np.allclose(I0, expected[0]) and np.allclose(I90, expected[1])
+
+
+def test_iSPEX2_sweep_with_batch_of_sources():
+    sources = np.stack([stokes.Stokes_nm(np.ones_like(wavelengths), Q, 0., 0.) for Q in (0.1, 0.5, -0.3)])
+    I0s, I90s = spex.simulate_iSPEX2_sweep(wavelengths, sources)
+    assert I0s.shape == I90s.shape == (3, len(wavelengths))
+    for I0, I90, single in zip(I0s, I90s, sources):
+        expected = spex.simulate_iSPEX2(wavelengths, single)
+        assert np.allclose(I0, expected[0]) and np.allclose(I90, expected[1])
+
+
+def test_dispersive_retardance():
+    # A retardance per wavelength, as allowed by Retarder_wavelengths
+    QWP_d = np.linspace(135., 145., len(wavelengths))
+    I = spex.simulate_iSPEX(wavelengths, source, QWP_d=QWP_d)[0]
+    I0, I90 = spex.simulate_iSPEX2(wavelengths, source, QWP_d=QWP_d)
+    assert np.allclose(I, I0)
+    for k in (0, 100, -1):
+        assert np.isclose(I[k], spex.simulate_iSPEX(wavelengths, source, QWP_d=QWP_d[k])[0][k])
+    assert spex.iSPEX_train(QWP_d=140.) is spex.iSPEX_train(QWP_d=140.)
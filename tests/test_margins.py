@@ -0,0 +1,44 @@
+import numpy as np
+from spex import stokes
+from spex.margins import margin, margin_adaptive, margin_map, simulate_and_retrieve
+
+wavelengths = np.arange(450, 700, 1.)
+parameters = {"QWP_t": np.linspace(-12, 12, 25), "POL_t": np.linspace(-9, 9, 19)}
+
+
+def test_margin():
+    x = np.linspace(-5, 5, 11)
+    DoLPs = np.where(np.abs(x) >= 3, 0.6, 0.5)
+    assert margin(x, DoLPs, np.zeros_like(x), 0.5, 0.) == 3.
+    assert margin(x, np.full_like(x, 0.5), np.zeros_like(x), 0.5, 0.) == 5.
+
+
+def test_margin_map_iSPEX(tmp_path):
+    Qrange = Urange = np.linspace(-1, 1, 3)
+    margins = margin_map(wavelengths, Qrange, Urange, parameters, instrument="iSPEX", checkpoint=tmp_path/"checkpoint")
+    assert list(margins) == list(parameters)
+    for values in margins.values():
+        assert values.shape == (3, 3)
+        assert np.isnan(values[1,1]) and np.isnan(values[0,0])
+        assert np.all(np.isfinite(values[[0,1,1,2],[1,0,2,1]]))
+
+    # A second run only loads the checkpoint
+    resumed = margin_map(wavelengths, Qrange, Urange, parameters, instrument="iSPEX", checkpoint=tmp_path/"checkpoint")
+    for parameter in parameters:
+        assert np.array_equal(margins[parameter], resumed[parameter], equal_nan=True)
+
+
+def test_margin_map_matches_sweep():
+    source = stokes.Stokes_nm(np.ones_like(wavelengths), 0.5, 0., 0.)
+    DoLPs, AoLPs = simulate_and_retrieve(wavelengths, source, "iSPEX", **{"POL_t": parameters["POL_t"]})
+    expected = margin(parameters["POL_t"], DoLPs, AoLPs, 0.5, 0.)
+    margins = margin_map(wavelengths, [0.5], [0.], {"POL_t": parameters["POL_t"]}, instrument="iSPEX")
+    assert margins["POL_t"][0,0] == expected
+
+
+def test_margin_adaptive_matches_dense_sweep():
+    source = stokes.Stokes_nm(np.ones_like(wavelengths), 0.3, 0.4, 0.)
+    x = np.linspace(-20, 20, 4001)
+    DoLPs, AoLPs = simulate_and_retrieve(wavelengths, source, **{"MOR1_t": x})
+    expected = margin(x, DoLPs, AoLPs, 0.5, stokes.AoLP_deg(1., 0.3, 0.4, 0.))
+    assert np.isclose(margin_adaptive(wavelengths, source, "MOR1_t", 20.), expected, atol=0.02)
@@ -0,0 +1,40 @@
+import numpy as np
+from spex import elements, stokes
+from spex.ispex import iSPEX_train
+from spex.modulation import Modulation_matrix, Demodulation_matrix, modulate, demodulate
+
+wavelengths = np.arange(450, 700, 1.)
+
+
+def polarimeter():
+    """
+    Linear polarizers at four angles behind a wavelength-dependent filter,
+    which measure I, Q and U.
+    """
+    attenuation = elements.Filter(np.linspace(0.8, 1., len(wavelengths)))
+    return [[attenuation, elements.Linear_polarizer_degrees(angle)] for angle in (0., 45., 90., 135.)]
+
+
+def test_channel_types_agree():
+    train = iSPEX_train()
+    from_train = Modulation_matrix([train], wavelengths)
+    from_list = Modulation_matrix([train.matrices(wavelengths)])
+    from_matrix = Modulation_matrix([train.system_matrix(wavelengths)])
+    assert from_train.shape == (len(wavelengths), 1, 4)
+    assert np.allclose(from_list, from_train) and np.allclose(from_matrix, from_train)
+
+    # A wavelength-independent channel is broadcast
+    assert Modulation_matrix([train, elements.Linear_polarizer_degrees(0.)], wavelengths).shape == (len(wavelengths), 2, 4)
+
+
+def test_demodulate_inverts_modulate():
+    modulation_matrix = Modulation_matrix(polarimeter(), wavelengths)
+    demodulation_matrix = Demodulation_matrix(modulation_matrix, components=(0, 1, 2))
+    assert demodulation_matrix.shape == (len(wavelengths), 4, 4)
+    assert Demodulation_matrix(modulation_matrix, components=(0, 1, 2)) is demodulation_matrix
+
+    sources = np.stack([stokes.Stokes_nm(np.ones_like(wavelengths), Q, U, 0.) for Q, U in [(0.1, 0.2), (-0.5, 0.3)]])
+    measurements = modulate(modulation_matrix, sources)
+    assert measurements.shape == (2, 4, len(wavelengths))
+    assert np.allclose(measurements[:,0], 0.5 * np.linspace(0.8, 1., len(wavelengths)) * (1 + np.array([[0.1], [-0.5]])))
+    assert np.allclose(demodulate(demodulation_matrix, measurements), sources)
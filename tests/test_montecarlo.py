@@ -0,0 +1,75 @@
+import numpy as np
+from spex import stokes, montecarlo
+from spex.montecarlo import StreamingStatistics, draw_parameters, monte_carlo
+
+wavelengths = np.arange(450, 700, 1.)
+source = stokes.Stokes_nm(np.ones_like(wavelengths), 0.3, 0.4, 0.)
+distributions = {"QWP_t": ("normal", 2.), "MOR1_t": ("uniform", 3.)}
+
+
+def test_streaming_statistics_match_numpy():
+    values = np.random.default_rng(1).normal(size=10000)
+    statistics = StreamingStatistics((-5., 5.), bins=2000)
+    for chunk in np.array_split(values, 7):
+        statistics.update(chunk)
+    assert statistics.count == len(values)
+    assert np.isclose(statistics.mean, values.mean()) and np.isclose(statistics.std, values.std(ddof=1))
+    assert statistics.min == values.min() and statistics.max == values.max()
+    assert np.allclose(statistics.quantile([0.1, 0.5, 0.9]), np.quantile(values, [0.1, 0.5, 0.9]), atol=0.01)
+
+    # Merging two halves gives the same result
+    first, second = StreamingStatistics((-5., 5.), bins=2000), StreamingStatistics((-5., 5.), bins=2000)
+    first.update(values[:3000]) ; second.update(values[3000:])
+    first.merge(second)
+    assert np.isclose(first.mean, statistics.mean) and np.isclose(first.std, statistics.std)
+    assert np.array_equal(first.histogram, statistics.histogram)
+
+
+def test_draw_parameters():
+    draws = draw_parameters(np.random.default_rng(1), {**distributions, "POL0_t": lambda rng, size: np.full(size, 0.5)}, 100)
+    assert np.all(np.abs(draws["MOR1_t"]) <= 3.) and np.all(draws["POL0_t"] == 0.5)
+    assert draws["QWP_t"].shape == (100,)
+
+
+def test_monte_carlo_does_not_depend_on_jobs():
+    serial = monte_carlo(wavelengths, source, distributions, 300, batch_size=100, seed=4)
+    parallel = monte_carlo(wavelengths, source, distributions, 300, batch_size=100, seed=4, n_jobs=2)
+    assert serial.count == 300
+    assert serial.summary() == parallel.summary()
+    assert 0 <= serial.failure_rate <= 1
+
+
+class _CountingExecutor(object):
+    """
+    Runs tasks on submission, in this process, and records how many results
+    have been submitted but not collected yet.
+    """
+    def __init__(self, n_jobs, initializer, initargs):
+        initializer(*initargs)
+        self.pending = self.max_pending = 0
+        _CountingExecutor.last = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+    def submit(self, function, *arguments):
+        executor = self
+        class Result(object):
+            value = function(*arguments)
+            def result(self):
+                executor.pending -= 1
+                return self.value
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        return Result()
+
+
+def test_monte_carlo_bounds_batches_in_flight(monkeypatch):
+    monkeypatch.setattr(montecarlo, "ProcessPoolExecutor", _CountingExecutor)
+    serial = monte_carlo(wavelengths, source, distributions, 200, batch_size=20, seed=5)
+    parallel = monte_carlo(wavelengths, source, distributions, 200, batch_size=20, seed=5, n_jobs=2)
+    assert parallel.summary() == serial.summary()
+    assert _CountingExecutor.last.max_pending == 4 and _CountingExecutor.last.pending == 0
@@ -0,0 +1,42 @@
+import numpy as np
+import spex
+from spex import stokes
+from spex.noise import DetectorNoise, noisy_realisations, retrieval_precision
+
+wavelengths = np.arange(450, 700, 1.)
+source = stokes.Stokes_nm(np.ones_like(wavelengths), 0.3, 0.4, 0.)
+
+
+def test_counts_statistics():
+    noise = DetectorNoise(electrons_per_intensity=1e4, gain=2., read_noise=5., dark=100., bias=50., quantise=False)
+    intensity = np.array([0.1, 1.])
+    counts = noise.counts(intensity, np.random.default_rng(1), size=20000)
+    assert counts.shape == (20000, 2)
+    electrons = intensity * 1e4 + 100.
+    assert np.allclose(counts.mean(axis=0), electrons / 2. + 50., rtol=2e-3)
+    assert np.allclose(counts.var(axis=0), (electrons + 25.) / 4., rtol=5e-2)
+    assert np.allclose(noise.intensity(counts).mean(axis=0), intensity, rtol=5e-3)
+
+
+def test_quantise_and_clip():
+    noise = DetectorNoise(electrons_per_intensity=1e6, bit_depth=12)
+    counts = noise.counts(np.array([0.001, 1.]), np.random.default_rng(1))
+    assert np.all(counts == np.round(counts)) and counts[1] == 2**12 - 1
+
+
+def test_realisations_are_reproducible():
+    I0, I90 = spex.simulate_iSPEX2(wavelengths, source)
+    noise = DetectorNoise()
+    batches = list(noisy_realisations((I0, I90), noise, 25, batch_size=10, seed=3))
+    assert [batch[0].shape for batch in batches] == [(8, len(wavelengths)), (8, len(wavelengths)), (9, len(wavelengths))]
+    again = list(noisy_realisations((I0, I90), noise, 25, batch_size=10, seed=3))
+    assert all(np.array_equal(a[1], b[1]) for a, b in zip(batches, again))
+
+
+def test_retrieval_precision():
+    intensities = spex.simulate_iSPEX2(wavelengths, source)
+    precise = retrieval_precision(wavelengths, source, intensities, DetectorNoise(electrons_per_intensity=1e8), 50, seed=1)
+    noisy = retrieval_precision(wavelengths, source, intensities, DetectorNoise(electrons_per_intensity=1e3), 50, seed=1)
+    assert precise.count == noisy.count == 50
+    assert precise.DoLP.std < noisy.DoLP.std
+    assert precise.failure_rate == 0
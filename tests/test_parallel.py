@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from spex import elements, stokes
+from spex.ispex import retrieve_DoLP_many, retrieve_DoLP_many2
+from spex.parallel import chunked_map, number_of_jobs
+
+wavelengths = np.arange(450, 700, 1.)
+source = stokes.Stokes_nm(np.ones_like(wavelengths), 0., 0., 0.)
+DoLPs_real = np.array([0.1, 0.3, 0.5, 0.7, 0.9])
+AoLPs_real = np.array([-60., -20., 0., 30., 70.])
+
+
+def _scale(factor, chunk):
+    return factor * chunk
+
+
+def _chunk_size(chunk):
+    return [len(chunk)]
+
+
+def test_chunked_map():
+    items = np.arange(10)
+    serial = chunked_map(_scale, items, shared=(2,))
+    assert np.array_equal(serial, 2 * items)
+    assert np.array_equal(chunked_map(_scale, items, shared=(2,), n_jobs=2), serial)
+    with ThreadPoolExecutor(3) as executor:
+        assert np.array_equal(chunked_map(_scale, items, shared=(2,), executor=executor), serial)
+        # The number of workers sets the number of chunks
+        sizes = chunked_map(_chunk_size, items, executor=executor, n_jobs=2, chunks_per_job=1)
+        assert np.array_equal(sizes, [5, 5])
+
+
+def test_number_of_jobs():
+    assert number_of_jobs(None) == number_of_jobs(1) == 1
+    assert number_of_jobs(-1) >= 1
+
+
+def test_retrieve_DoLP_many_in_parallel():
+    Is = np.stack([elements.modulation(wavelengths, source[:,0], D, A, 4480) for D, A in zip(DoLPs_real, AoLPs_real)])
+    DoLPs, AoLPs = retrieve_DoLP_many(wavelengths, source, Is)
+    assert np.allclose(DoLPs, DoLPs_real, atol=1e-6) and np.allclose(AoLPs, AoLPs_real, atol=1e-4)
+
+    DoLPs_parallel, AoLPs_parallel = retrieve_DoLP_many(wavelengths, source, Is, n_jobs=2)
+    assert np.array_equal(DoLPs_parallel, DoLPs) and np.array_equal(AoLPs_parallel, AoLPs)
+
+    # iSPEX 2: the 90 degree channel sees the AoLP rotated by 90 degrees
+    I90s = np.stack([elements.modulation(wavelengths, source[:,0], D, A+90, 4480) for D, A in zip(DoLPs_real, AoLPs_real)])
+    DoLPs, AoLPs = retrieve_DoLP_many2(wavelengths, source, Is, I90s, n_jobs=2)
+    assert np.allclose(DoLPs, DoLPs_real, atol=1e-6) and np.allclose(AoLPs, AoLPs_real, atol=1e-4)
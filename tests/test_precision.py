@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import spex
+from spex import elements, stokes
+from spex.precision import get_dtype, precision
+
+wavelengths = np.arange(450, 700, 1.)
+source = stokes.Stokes_nm(np.ones_like(wavelengths), 0.3, 0.4, 0.)
+
+
+def test_set_and_restore():
+    assert get_dtype() == np.float64
+    with precision(np.float32):
+        assert elements.Retarder_wavelengths(140., 0., wavelengths).dtype == np.float32
+    assert get_dtype() == np.float64
+    try:
+        spex.set_precision(np.float32)
+        assert elements.Linear_polarizer_degrees(0.).dtype == np.float32
+    finally:
+        spex.set_precision(np.float64)
+    with pytest.raises(ValueError):
+        spex.set_precision(np.float16)
+
+
+def test_float32_sweeps_and_retrieval():
+    prange = np.linspace(-5, 5, 11)
+    I0s, I90s = spex.simulate_iSPEX2_sweep(wavelengths, source, dtype=np.float32, MOR1_t=prange)
+    expected = spex.simulate_iSPEX2_sweep(wavelengths, source, MOR1_t=prange)
+    assert I0s.dtype == I90s.dtype == np.float32
+    assert np.allclose(I0s, expected[0], atol=1e-6) and np.allclose(I90s, expected[1], atol=1e-6)
+
+    DoLPs, AoLPs = spex.retrieve_DoLP_joint(wavelengths, source, I0s, I90s)
+    DoLPs_expected, AoLPs_expected = spex.retrieve_DoLP_joint(wavelengths, source, *expected)
+    assert DoLPs.dtype == AoLPs.dtype == np.float32
+    assert np.allclose(DoLPs, DoLPs_expected, rtol=1e-5) and np.allclose(AoLPs, AoLPs_expected, atol=1e-4)
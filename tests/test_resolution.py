@@ -0,0 +1,45 @@
+import numpy as np
+from spex.resolution import convolve_lsf, gaussian_kernel, _overlap_add, FWHM_TO_SIGMA
+
+wavelengths = np.arange(400, 700, 0.5)
+
+
+def test_gaussian_kernel():
+    kernel = gaussian_kernel(2.5)
+    assert len(kernel) == 2*10 + 1 and np.isclose(kernel.sum(), 1.)
+    assert np.allclose(kernel, kernel[::-1])
+
+
+def test_matches_direct_convolution():
+    spectra = np.random.default_rng(1).normal(size=(3, len(wavelengths)))
+    kernel = gaussian_kernel(2. * FWHM_TO_SIGMA / 0.5)
+    expected = np.array([np.convolve(spectrum, kernel, mode="same") for spectrum in spectra]) / np.convolve(np.ones(len(wavelengths)), kernel, mode="same")
+    assert np.allclose(convolve_lsf(wavelengths, spectra, 2., block_size=64), expected)
+    assert convolve_lsf(wavelengths, spectra, None) is spectra
+
+
+def test_flat_spectrum_and_precision():
+    fwhm = np.linspace(1., 4., len(wavelengths))
+    flat = np.ones((2, len(wavelengths)), dtype=np.float32)
+    result = convolve_lsf(wavelengths, flat, fwhm)
+    assert result.dtype == np.float32 and np.allclose(result, 1., atol=1e-5)
+
+
+def test_non_uniform_grid():
+    grid = 400 + 300 * np.linspace(0, 1, 600)**1.2
+    spectrum = np.sin(grid / 10.)
+    # Compare with the same spectrum convolved on a fine uniform grid, away from the edges
+    fine = np.linspace(400, 700, 6001)
+    expected = np.interp(grid, fine, convolve_lsf(fine, np.sin(fine / 10.), 2.))
+    assert np.allclose(convolve_lsf(grid, spectrum, 2.)[10:-10], expected[10:-10], atol=1e-3)
+    assert np.allclose(convolve_lsf(grid, np.ones_like(grid), 3.), 1.)
+
+
+def test_float32_is_convolved_in_float32():
+    spectra = np.random.default_rng(3).normal(size=(2, len(wavelengths)))
+    # One kernel spectrum for each block of 32 pixels
+    kernel_spectra = np.tile(np.fft.rfft(gaussian_kernel(3.), 64), (len(wavelengths)//32 + 1, 1))
+    assert _overlap_add(spectra.astype(np.float32), kernel_spectra.astype(np.complex64), 32, 12).dtype == np.float32
+    result = convolve_lsf(wavelengths, spectra.astype(np.float32), np.linspace(1., 3., len(wavelengths)))
+    assert result.dtype == np.float32
+    assert np.allclose(result, convolve_lsf(wavelengths, spectra, np.linspace(1., 3., len(wavelengths))), atol=1e-5)
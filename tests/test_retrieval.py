@@ -0,0 +1,45 @@
+import numpy as np
+from spex import elements, stokes
+from spex.retrieval import retrieve_DoLP_linear, refine_DoLP, retrieve_DoLP_linear2, retrieve_DoLP_joint
+
+wavelengths = np.arange(450, 700, 0.5)
+source = stokes.Stokes_nm(np.ones_like(wavelengths), 0., 0., 0.)
+
+
+def spectrum(DoLP, AoLP, delta=4480):
+    return elements.modulation(wavelengths, source[:,0], DoLP, AoLP, delta)
+
+
+def test_single_spectrum_gives_arrays():
+    DoLP, AoLP = retrieve_DoLP_linear(wavelengths, source, spectrum(0.4, 20.))
+    assert isinstance(DoLP, np.ndarray) and DoLP.shape == ()
+    assert isinstance(AoLP, np.ndarray) and AoLP.shape == ()
+    assert np.isclose(DoLP, 0.4) and np.isclose(AoLP, 20.)
+
+
+def test_batch_matches_truth():
+    DoLPs_real = np.array([0.1, 0.5, 0.9])
+    AoLPs_real = np.array([-60., 0., 45.])
+    Is = np.stack([spectrum(D, A) for D, A in zip(DoLPs_real, AoLPs_real)])
+    DoLPs, AoLPs = retrieve_DoLP_linear(wavelengths, source, Is)
+    assert DoLPs.shape == AoLPs.shape == (3,)
+    assert np.allclose(DoLPs, DoLPs_real) and np.allclose(AoLPs, AoLPs_real)
+
+
+def test_AoLP_wrap_matches_nonlinear():
+    # AoLPs at or below -89.9 degrees are reported as their equivalent near +90
+    I = spectrum(0.5, -89.95)
+    _, AoLP_linear = retrieve_DoLP_linear(wavelengths, source, I)
+    _, AoLP_fit = refine_DoLP(wavelengths, source, I[np.newaxis], AoLPs=[-89.95])
+    assert np.isclose(AoLP_linear, 90.05)
+    assert np.allclose(AoLP_fit, 90.05, atol=1e-3)
+    _, AoLP_linear = retrieve_DoLP_linear(wavelengths, source, spectrum(0.5, -89.5))
+    assert np.isclose(AoLP_linear, -89.5)
+
+
+def test_dual_channel():
+    I0 = spectrum(0.3, 10.)
+    I90 = spectrum(0.3, 100.)
+    for retrieve in (retrieve_DoLP_linear2, retrieve_DoLP_joint):
+        DoLP, AoLP = retrieve(wavelengths, source, I0[np.newaxis], I90[np.newaxis])
+        assert np.allclose(DoLP, 0.3) and np.allclose(AoLP, 10.)
@@ -0,0 +1,41 @@
+import numpy as np
+import spex
+from spex import stokes
+from spex.margins import find_margin, margin_adaptive
+from spex.sensitivity import iSPEX_intensity_jacobian, iSPEX2_intensity_jacobian, first_order_guesses, seeded_margins
+
+wavelengths = np.arange(450, 700, 1.)
+source = stokes.Stokes_nm(np.ones_like(wavelengths), 0.3, 0.4, 0.)
+
+
+def test_intensity_jacobian_matches_finite_differences():
+    I, jacobian = iSPEX_intensity_jacobian(wavelengths, source)
+    h = 1e-4
+    for parameter, dI in jacobian.items():
+        I_plus = spex.simulate_iSPEX_sweep(wavelengths, source, **{parameter: np.array([h, -h])})
+        assert np.allclose(dI, (I_plus[0] - I_plus[1]) / (2*h), atol=1e-6)
+
+
+def test_iSPEX2_jacobian_matches_finite_differences():
+    (I0, I90), jacobian = iSPEX2_intensity_jacobian(wavelengths, source)
+    h = 1e-4
+    for parameter, (dI0, dI90) in jacobian.items():
+        I0s, I90s = spex.simulate_iSPEX2_sweep(wavelengths, source, **{parameter: np.array([h, -h])})
+        assert np.allclose(dI0, (I0s[0] - I0s[1]) / (2*h), atol=1e-6)
+        assert np.allclose(dI90, (I90s[0] - I90s[1]) / (2*h), atol=1e-6)
+
+
+def test_find_margin_guess_does_not_change_result():
+    exceeds = lambda x: np.abs(x) >= 3.3
+    for guess in (None, 3.4, 0.5, 100.):
+        assert np.isclose(find_margin(exceeds, 10., guess=guess), 3.3, atol=0.01)
+
+
+def test_seeded_margins_match_adaptive():
+    xmax = {"QWP_t": 20., "MOR1_t": 20., "POL0_t": 20.}
+    guesses = first_order_guesses(wavelengths, source)
+    margins = seeded_margins(wavelengths, source, xmax)
+    for parameter, x in xmax.items():
+        expected = margin_adaptive(wavelengths, source, parameter, x)
+        assert np.isclose(margins[parameter], expected, atol=x/1000)
+        assert guesses[parameter] >= 0
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from spex import stokes
+from spex.stokes import StokesArray
+
+
+@pytest.mark.parametrize("single", [StokesArray.from_components(1., .3, .2, 0.), StokesArray(np.array([1, .3, .2, 0]))])
+def test_single_vector(single):
+    assert single.shape == () and len(single) == 1
+    assert np.isclose(single.DoLP(), stokes.DoLP(1., .3, .2, 0.))
+    assert np.isclose(single.DoP(), stokes.DoP(1., .3, .2, 0.))
+    assert np.isclose(single.AoLP(), stokes.AoLP(1., .3, .2, 0.))
+    assert np.isclose(single.AoLP_deg(), stokes.AoLP_deg(1., .3, .2, 0.))
+    assert np.isclose(single.polarised_intensity(), np.hypot(.3, .2))
+    assert single.is_physical()
+    single.validate()
+
+
+def test_batch_matches_functions():
+    rng = np.random.default_rng(0)
+    Q, U, V = rng.uniform(-0.5, 0.5, (3, 5, 7))
+    data = StokesArray.from_components(1., Q, U, V)
+    assert data.shape == (5, 7) and len(data) == 5
+    assert np.allclose(data.DoP(), stokes.DoP(1., Q, U, V))
+    assert np.allclose(data.DoLP(), stokes.DoLP(1., Q, U, V))
+    assert np.allclose(data.AoLP_deg(), stokes.AoLP_deg(1., Q, U, V))
+    assert data.is_physical().all()
+
+
+def test_views_and_out():
+    data = StokesArray(np.tile([2., 1., 0., 0.], (3, 1)))
+    data.Q[1] = 0.
+    assert data.data[1,1] == 0.
+    out = np.empty(3)
+    assert data.DoLP(out=out) is out
+    assert np.allclose(out, [0.5, 0., 0.5])
+    assert np.allclose(data.normalise().I, 1.)
+
+
+def test_validate_unphysical():
+    data = StokesArray.from_components(1., [0.5, 1.5], 0., 0.)
+    assert list(data.is_physical()) == [True, False]
+    with pytest.raises(ValueError):
+        data.validate()
+
+
+def test_array_copy():
+    data = StokesArray.from_components(1., .3, .2, 0.)
+    assert np.asarray(data) is data.data
+    assert np.array(data) is not data.data
+    assert np.asarray(data, dtype=np.float32).dtype == np.float32
+    with pytest.raises(ValueError):
+        np.asarray(data, dtype=np.float32, copy=False)
+
+
+def test_wrong_shape():
+    with pytest.raises(ValueError):
+        StokesArray(np.zeros((3, 3)))
@@ -0,0 +1,39 @@
+import numpy as np
+from spex import elements
+from spex.cache import wavelength_fingerprint
+from spex.train import OpticalTrain, Retarder, Polarizer, propagate_intensity
+
+wavelengths = np.linspace(400, 700, 31)
+source = np.tile([1., 0.3, -0.2, 0.], (len(wavelengths), 1))
+
+
+def make_train(**kwargs):
+    return OpticalTrain([Retarder(140., 0.), Retarder(2240., -45.), Polarizer(0.)], **kwargs)
+
+
+def test_system_matrix_matches_product():
+    train = make_train()
+    expected = elements.Linear_polarizer_degrees(0.) @ elements.Retarder_wavelengths(2240., -45., wavelengths) @ elements.Retarder_wavelengths(140., 0., wavelengths)
+    assert np.allclose(train.system_matrix(wavelengths), expected)
+
+
+def test_propagate_intensity_matches_propagate():
+    train = make_train()
+    assert np.allclose(train.propagate_intensity(wavelengths, source), train.propagate(wavelengths, source)[...,0])
+    assert np.allclose(propagate_intensity(train.matrices(wavelengths), source), train.propagate(wavelengths, source)[...,0])
+
+
+def test_cache_is_reused_and_bounded():
+    train = make_train(maxsize=2)
+    assert train.system_matrix(wavelengths) is train.system_matrix(wavelengths)
+    for shift in range(5):
+        train.system_matrix(wavelengths + shift)
+    assert len(train._cache) == 2
+
+
+def test_cache_distinguishes_grids():
+    train = make_train()
+    other = wavelengths.copy()
+    other[3] += 1e-9
+    assert wavelength_fingerprint(other) != wavelength_fingerprint(wavelengths)
+    assert not np.array_equal(train.system_matrix(other), train.system_matrix(wavelengths))